@@ -0,0 +1,343 @@
+"""Ingest (and optionally analysis) benchmark against an in-process ClickHouse sink.
+
+Usage (from the project root):
+    python -m benchmarks.synthetic_data ./bench_data --records 1000000 --files 4
+    python -m benchmarks.ingest_benchmark ./bench_data --save benchmarks/results/baseline.json
+    python -m benchmarks.ingest_benchmark ./bench_data --compare benchmarks/results/baseline.json
+
+Inserts go to `SinkQuery`, which stands in for the dbutils connection and only
+counts what it receives, so the numbers measure our code and not the server.
+Each run executes in its own process so peak RSS belongs to that run alone:
+
+  stages:columnar   decompress, parse, model_batch, transform, key_index and write_df timed
+                    separately over the largest file
+  stages:records    read_jsonl_gz_file, data_modeling and insert_batch over the same file
+  e2e:<mode>        AmazonReviewsIngestion.main over the whole folder, per ingest mode
+
+With --analysis the report queries are also timed against the ClickHouse server
+from the environment. --local_analysis times them on the polars report backend over
+the benchmark files instead (local:<query> each, local:report all together), no
+server needed. --compare exits with status 1 if a stage is slower (or
+uses more memory) than the baseline by more than --tolerance.
+"""
+import argparse
+import gzip
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import polars as pl
+
+from config.config import logger
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+
+class SinkQuery:
+    """In-process stand-in for `dbutils.Query`: answers every query with one row and counts written rows"""
+    rows: Dict[str, int] = defaultdict(int)
+    bytes: Dict[str, int] = defaultdict(int)
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def sql_query(self, sql: str) -> pl.DataFrame:
+        return pl.DataFrame({'test': [1]})
+
+    def sql_write(self, df: pl.DataFrame, schema: str, table_name: str, max_chunk: int) -> None:
+        SinkQuery.rows[table_name] += len(df)
+        SinkQuery.bytes[table_name] += df.estimated_size()
+
+
+def _use_sink() -> None:
+    # ClickHouseDB connects through the name imported into its module
+    import src.utils.clickhouse
+    src.utils.clickhouse.Query = SinkQuery
+
+
+def _ingestion(data_folder: str, writer: str = 'dbutils', **settings):
+    from src.pipelines.ingest import AmazonReviewsIngestion
+    _use_sink()
+    # every run reads the same files, a persistent key index would drop them all as duplicates after the first
+    return AmazonReviewsIngestion(data_folder=data_folder, writer=writer, use_manifest=False, key_index=False,
+                                  **settings)
+
+
+class StageTimer:
+    """Accumulates wall time, rows and raw bytes per stage"""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = defaultdict(lambda: {'seconds': 0.0, 'rows': 0, 'bytes': 0})
+
+    def add(self, stage: str, seconds: float, rows: int = 0, nbytes: int = 0) -> None:
+        self.stages[stage]['seconds'] += seconds
+        self.stages[stage]['rows'] += rows
+        self.stages[stage]['bytes'] += nbytes
+
+    def timed(self, stage: str, func: Callable, *args) -> Any:
+        start = time.perf_counter()
+        result = func(*args)
+        self.add(stage, time.perf_counter() - start)
+        return result
+
+
+def _result(seconds: float, rows: int, nbytes: int, **extra) -> Dict[str, Any]:
+    from src.utils.profiling import peak_rss_mb
+    return {
+        'seconds': round(seconds, 3),
+        'rows': rows,
+        'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else 0.0,
+        'mb_per_sec': round(nbytes / (1024 * 1024) / seconds, 2) if seconds > 0 else 0.0,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        **extra,
+    }
+
+
+def _stage_results(timer: StageTimer, raw_bytes: int) -> Dict[str, Dict[str, Any]]:
+    # MB/sec is always relative to the uncompressed input the stage covered
+    return {stage: _result(values['seconds'], int(values['rows']), values['bytes'] or raw_bytes)
+            for stage, values in timer.stages.items()}
+
+
+def run_columnar_stages(data_folder: str, file_path: str, batch_size: int) -> Dict[str, Dict[str, Any]]:
+    """Time every stage of the columnar path separately over one file"""
+    from src.utils.key_index import KeyIndex
+    ingestion = _ingestion(data_folder, batch_size=batch_size)
+    # duplicate lookups and inserts into a fresh index, as the first ingest of a file
+    key_index = KeyIndex(tempfile.mkdtemp(prefix='bench_key_index_'), ingestion.reviews_table,
+                         ['asin', 'user_id', 'parent_asin'], version_column='timestamp',
+                         ignore_columns=['ingest_ts'])
+    timer = StageTimer()
+    raw_bytes = 0
+    chunks = ingestion.read_jsonl_gz_chunks(file_path)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        timer.add('decompress', time.perf_counter() - start, rows=chunk.count(b'\n'), nbytes=len(chunk))
+        raw_bytes += len(chunk)
+        raw_df = timer.timed('parse', ingestion.parse_chunk, chunk)
+        reviews_df, images_df = timer.timed('model_batch', ingestion.model_batch, raw_df)
+        reviews_df = timer.timed('transform', ingestion.transform_plans[ingestion.reviews_table].apply, reviews_df)
+        images_df = timer.timed('transform', ingestion.transform_plans[ingestion.images_table].apply, images_df)
+        _, entries = timer.timed('key_index', key_index.filter_new, reviews_df)
+        timer.timed('key_index', key_index.add, entries)
+        timer.timed('write_df', ingestion.write_df, reviews_df, ingestion.reviews_table)
+        timer.timed('write_df', ingestion.write_df, images_df, ingestion.images_table)
+        for stage in ('parse', 'model_batch', 'transform', 'key_index', 'write_df'):
+            timer.add(stage, 0.0, rows=len(raw_df))
+    return _stage_results(timer, raw_bytes)
+
+
+def run_records_stages(data_folder: str, file_path: str, batch_size: int) -> Dict[str, Dict[str, Any]]:
+    """Time the per-record path (records mode) over one file"""
+    ingestion = _ingestion(data_folder, batch_size=batch_size, ingest_mode='records')
+    timer = StageTimer()
+    records = ingestion.read_jsonl_gz_file(file_path)
+    batch_data, images_data = [], []
+    while True:
+        start = time.perf_counter()
+        record = next(records, None)
+        if record is None:
+            break
+        timer.add('read_jsonl_gz_file', time.perf_counter() - start, rows=1)
+        start = time.perf_counter()
+        review, images = ingestion.data_modeling(record)
+        timer.add('data_modeling', time.perf_counter() - start, rows=1)
+        batch_data.append(review)
+        images_data.extend(images)
+        if len(batch_data) >= batch_size:
+            timer.timed('insert_batch', ingestion.insert_batch, batch_data, ingestion.reviews_table)
+            timer.timed('insert_batch', ingestion.insert_batch, images_data, ingestion.images_table)
+            timer.add('insert_batch', 0.0, rows=len(batch_data))
+            batch_data, images_data = [], []
+    if batch_data:
+        timer.timed('insert_batch', ingestion.insert_batch, batch_data, ingestion.reviews_table)
+        timer.timed('insert_batch', ingestion.insert_batch, images_data, ingestion.images_table)
+        timer.add('insert_batch', 0.0, rows=len(batch_data))
+    return _stage_results(timer, _raw_size([file_path]))
+
+
+def run_end_to_end(data_folder: str, ingest_mode: str, batch_size: int, raw_bytes: int) -> Dict[str, Any]:
+    """AmazonReviewsIngestion.main over the whole folder"""
+    ingestion = _ingestion(data_folder, batch_size=batch_size, ingest_mode=ingest_mode)
+    start = time.perf_counter()
+    ingestion.main()
+    seconds = time.perf_counter() - start
+    return _result(seconds, SinkQuery.rows[ingestion.reviews_table], raw_bytes,
+                   images=SinkQuery.rows[ingestion.images_table])
+
+
+def _in_child(func: Callable, *args) -> Any:
+    """Run one benchmark in a fresh process so its peak RSS is not inflated by earlier runs"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(func, *args).result()
+
+
+def run_analysis_queries() -> Dict[str, Dict[str, Any]]:
+    """Time each report query against the configured ClickHouse server"""
+    from src.sql.analysis import queries
+    from src.utils.clickhouse import ClickHouseDB
+    db = ClickHouseDB()
+    results = {}
+    for name, sql in queries.items():
+        start = time.perf_counter()
+        df = db.sql_query(sql)
+        results[f"query:{name}"] = _result(time.perf_counter() - start, len(df), 0)
+    # the whole report query set as generate_report runs it, should take about as long as the slowest query
+    from src.pipelines.analyze import REPORT_QUERIES, AmazonReviewsAnalysis
+    analysis = AmazonReviewsAnalysis(output_dir=tempfile.mkdtemp(prefix='bench_report_'))
+    start = time.perf_counter()
+    report = analysis.run_queries(REPORT_QUERIES)
+    rows = sum(len(df) for df in report.values() if isinstance(df, pl.DataFrame))
+    results["query:report_concurrent"] = _result(time.perf_counter() - start, rows, 0)
+    return results
+
+
+def run_local_analysis(data_folder: str, raw_bytes: int) -> Dict[str, Dict[str, Any]]:
+    """Time the report queries on the polars backend over the files of `data_folder`"""
+    from src.pipelines.analyze import REPORT_QUERIES
+    from src.utils.report_backends import PolarsReportBackend, scan_reviews
+    rows = scan_reviews(data_folder, dedupe=False).select(pl.len()).collect().item()
+    results = {}
+    for name in REPORT_QUERIES:
+        backend = PolarsReportBackend(data_folder)  # every query scans the files on its own
+        start = time.perf_counter()
+        backend.fetch(name)
+        results[f"local:{name}"] = _result(time.perf_counter() - start, rows, raw_bytes)
+    start = time.perf_counter()
+    PolarsReportBackend(data_folder).run_queries(REPORT_QUERIES)
+    results["local:report"] = _result(time.perf_counter() - start, rows, raw_bytes)
+    return results
+
+
+def _raw_size(files: List[str]) -> int:
+    size = 0
+    for file_path in files:
+        with gzip.open(file_path, 'rb') as f:
+            while block := f.read(1024 * 1024):
+                size += len(block)
+    return size
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of `results` against `baseline`: lower throughput or higher peak RSS beyond `tolerance`"""
+    regressions = []
+    logger.info(f"Comparison against {baseline['created_at']} ({baseline.get('git_commit')})")
+    logger.info("-" * 80)
+    logger.info(f"{'run':32} | {'rows/sec':>12} | {'change':>8} | {'peak MB':>8} | {'change':>8}")
+    for name, run in results['runs'].items():
+        before = baseline['runs'].get(name)
+        if before is None:
+            continue
+        speed = run['rows_per_sec'] / before['rows_per_sec'] - 1 if before['rows_per_sec'] else 0.0
+        memory = run['peak_rss_mb'] / before['peak_rss_mb'] - 1 if before['peak_rss_mb'] else 0.0
+        # query runs are measured against a live server, only their latency counts
+        if speed < -tolerance:
+            regressions.append(f"{name}: {speed:+.1%} rows/sec")
+        if memory > tolerance and not name.startswith('query:'):
+            regressions.append(f"{name}: {memory:+.1%} peak RSS")
+        logger.info(f"{name:32} | {run['rows_per_sec']:>12.0f} | {speed:>+8.1%} | "
+                    f"{run['peak_rss_mb']:>8.1f} | {memory:>+8.1%}")
+    logger.info("-" * 80)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_folder", type=str)
+    parser.add_argument("--modes", type=str, nargs="+", default=['columnar', 'pipelined', 'records'])
+    parser.add_argument("--batch_size", type=int, default=5000)
+    parser.add_argument("--skip_stages", action="store_true", help="Only run the end-to-end runs.")
+    parser.add_argument("--analysis", action="store_true",
+                        help="Also time the report queries against the ClickHouse server from the environment.")
+    parser.add_argument("--local_analysis", action="store_true",
+                        help="Also time the report queries on the polars backend over the benchmark files.")
+    parser.add_argument("--save", type=str, default=None,
+                        help="Where to write the results JSON; defaults to benchmarks/results/<timestamp>.json.")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline results JSON to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression (0.1 = 10%%).")
+    args = parser.parse_args()
+
+    files = sorted(Path(args.data_folder).rglob('*.jsonl.gz'), key=lambda path: path.stat().st_size, reverse=True)
+    if not files:
+        logger.error(f"No .jsonl.gz files found in '{args.data_folder}', see benchmarks/synthetic_data.py")
+        sys.exit(1)
+    raw_bytes = _raw_size([str(path) for path in files])
+
+    runs: Dict[str, Dict[str, Any]] = {}
+    if not args.skip_stages:
+        largest = str(files[0])
+        logger.info(f"Timing ingest stages over {largest}")
+        for stage, values in _in_child(run_columnar_stages, args.data_folder, largest, args.batch_size).items():
+            runs[f"stages:columnar:{stage}"] = values
+        if 'records' in args.modes:
+            for stage, values in _in_child(run_records_stages, args.data_folder, largest, args.batch_size).items():
+                runs[f"stages:records:{stage}"] = values
+    for mode in args.modes:
+        logger.info(f"Running end-to-end ingestion in {mode} mode")
+        runs[f"e2e:{mode}"] = _in_child(run_end_to_end, args.data_folder, mode, args.batch_size, raw_bytes)
+    if args.analysis:
+        runs.update(run_analysis_queries())
+    if args.local_analysis:
+        logger.info("Timing the report queries on the polars backend")
+        runs.update(_in_child(run_local_analysis, args.data_folder, raw_bytes))
+
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'polars': pl.__version__,
+        'cpu_count': multiprocessing.cpu_count(),
+        'batch_size': args.batch_size,
+        'data': {
+            'files': len(files),
+            'compressed_mb': round(sum(path.stat().st_size for path in files) / (1024 * 1024), 1),
+            'raw_mb': round(raw_bytes / (1024 * 1024), 1),
+        },
+        'runs': runs,
+    }
+
+    logger.info(f"Ingest benchmark for {args.data_folder} ({results['data']['raw_mb']} MB raw)")
+    logger.info("-" * 80)
+    logger.info(f"{'run':32} | {'seconds':>8} | {'rows/sec':>12} | {'MB/sec':>8} | {'peak MB':>8}")
+    for name, run in runs.items():
+        logger.info(f"{name:32} | {run['seconds']:>8.2f} | {run['rows_per_sec']:>12.0f} | "
+                    f"{run['mb_per_sec']:>8.2f} | {run['peak_rss_mb']:>8.1f}")
+    logger.info("-" * 80)
+
+    save_path = Path(args.save) if args.save else RESULTS_DIR / f"ingest_{datetime.now():%Y%m%d_%H%M%S}.json"
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(save_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results saved to {save_path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            for regression in regressions:
+                logger.error(f"Regression: {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Storage size, bytes scanned and query times of the layout profiles in create_schema.py.
+
+Usage (from the project root, against the ClickHouse server from the environment):
+    python -m benchmarks.layout_benchmark --profiles default optimized --repeat 3
+
+Every profile gets a copy of `reviews` as `reviews_bench_<profile>` (the first --limit
+rows, all by default). The report queries of src/sql/analysis.py plus a few probes for
+what the layouts target (one user, a recent time range, the newest `ingest_ts` rows and
+a sampled count) then run against each copy. Times are the best of --repeat runs; rows
+and bytes read come from system.query_log. The copies are dropped afterwards unless
+--keep is passed.
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict
+
+from config.config import clickhouse_config, logger
+from src.sql.analysis import queries
+from src.sql.create_schema import get_layout_query, layout_profiles
+from src.utils.clickhouse import ClickHouseDB
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+
+def _probe_queries(db: ClickHouseDB, table: str) -> Dict[str, str]:
+    """Queries the layouts are meant to speed up, with literals taken from the data"""
+    database = clickhouse_config['db_name']
+    user_id, max_timestamp, max_ingest_ts = db.sql_query(
+        f"SELECT any(user_id) AS user_id, toString(max(timestamp)) AS max_timestamp, "
+        f"toString(max(ingest_ts)) AS max_ingest_ts FROM {database}.{table}"
+    ).row(0)
+    return {
+        'probe:one_user': f"SELECT count() AS reviews, avg(rating) AS avg_rating FROM {database}.{{table}} "
+                          f"WHERE user_id = '{user_id}'",
+        'probe:last_90_days': f"SELECT toStartOfMonth(timestamp) AS month, count() AS reviews FROM {database}.{{table}} "
+                              f"WHERE timestamp > toDateTime('{max_timestamp}') - INTERVAL 90 DAY GROUP BY month",
+        'probe:last_ingest_hour': f"SELECT count() AS reviews FROM {database}.{{table}} "
+                                  f"WHERE ingest_ts > toDateTime('{max_ingest_ts}') - INTERVAL 1 HOUR",
+        'probe:sampled_users': f"SELECT round(uniqCombined(user_id) * 10) AS users FROM {database}.{{table}} SAMPLE 0.1",
+    }
+
+
+def _tagged(sql: str, tag: str) -> str:
+    """Query with a log_comment to find it in system.query_log"""
+    return f"{sql.strip().rstrip(';')}\nSETTINGS log_comment = '{tag}'"
+
+
+def _storage(db: ClickHouseDB, table: str) -> Dict[str, Any]:
+    df = db.sql_query(
+        f"SELECT sum(rows) AS rows, sum(data_compressed_bytes) AS compressed, "
+        f"sum(data_uncompressed_bytes) AS uncompressed, count() AS parts FROM system.parts "
+        f"WHERE database = '{clickhouse_config['db_name']}' AND table = '{table}' AND active"
+    )
+    rows, compressed, uncompressed, parts = df.row(0)
+    return {'rows': rows, 'compressed_mb': round(compressed / (1024 * 1024), 1),
+            'uncompressed_mb': round(uncompressed / (1024 * 1024), 1), 'parts': parts}
+
+
+def run_profile(db: ClickHouseDB, profile: str, run_id: str, limit: int | None, repeat: int) -> Dict[str, Any]:
+    database = clickhouse_config['db_name']
+    table = f"reviews_bench_{profile}"
+    db.sql_query(f"DROP TABLE IF EXISTS {database}.{table}")
+    db.sql_query(get_layout_query("create_reviews_table", profile, table))
+    start = time.perf_counter()
+    db.sql_query(f"INSERT INTO {database}.{table} SELECT * FROM {database}.reviews"
+                 + (f" LIMIT {limit}" if limit else ""))
+    # merged parts, like a table that has been live for a while
+    db.sql_query(f"OPTIMIZE TABLE {database}.{table} FINAL")
+    load_seconds = time.perf_counter() - start
+
+    benchmark_queries = {f"query:{name}": sql.replace(f"{database}.reviews", f"{database}.{{table}}")
+                         for name, sql in queries.items()}
+    benchmark_queries.update(_probe_queries(db, table))
+    runs = {}
+    for name, sql in benchmark_queries.items():
+        sql = sql.replace('{table}', table)
+        best = float('inf')
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                db.sql_query(_tagged(sql, f"layout_bench:{run_id}:{profile}:{name}"))
+                best = min(best, time.perf_counter() - start)
+        except Exception as e:
+            # e.g. SAMPLE on a table without a sampling key
+            logger.warning(f"{profile} {name} failed: {e}")
+            runs[name] = {'error': str(e).splitlines()[0]}
+            continue
+        runs[name] = {'seconds': round(best, 4)}
+
+    db.sql_query("SYSTEM FLUSH LOGS")
+    scanned = db.sql_query(
+        f"SELECT log_comment, max(read_rows) AS read_rows, max(read_bytes) AS read_bytes FROM system.query_log "
+        f"WHERE type = 'QueryFinish' AND log_comment LIKE 'layout_bench:{run_id}:{profile}:%' GROUP BY log_comment"
+    )
+    for tag, read_rows, read_bytes in scanned.rows():
+        name = tag.split(':', 3)[3]
+        if name in runs:
+            runs[name].update({'read_rows': read_rows, 'read_mb': round(read_bytes / (1024 * 1024), 2)})
+    return {'table': table, 'load_seconds': round(load_seconds, 2), 'storage': _storage(db, table), 'runs': runs}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", type=str, nargs="+", default=sorted(layout_profiles))
+    parser.add_argument("--limit", type=int, default=None, help="Rows of reviews copied into each profile.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help="Keep the reviews_bench_<profile> tables.")
+    parser.add_argument("--save", type=str, default=None,
+                        help="Where to write the results JSON; defaults to benchmarks/results/layout_<timestamp>.json.")
+    args = parser.parse_args()
+
+    db = ClickHouseDB()
+    run_id = uuid.uuid4().hex[:8]
+    profiles = {}
+    for profile in args.profiles:
+        logger.info(f"Benchmarking layout '{profile}'")
+        try:
+            profiles[profile] = run_profile(db, profile, run_id, args.limit, args.repeat)
+        finally:
+            if not args.keep:
+                db.sql_query(f"DROP TABLE IF EXISTS {clickhouse_config['db_name']}.reviews_bench_{profile}")
+
+    logger.info("Layout benchmark")
+    logger.info("-" * 80)
+    logger.info(f"{'profile':12} | {'rows':>12} | {'compressed MB':>14} | {'uncompressed MB':>16} | {'parts':>6}")
+    for profile, result in profiles.items():
+        storage = result['storage']
+        logger.info(f"{profile:12} | {storage['rows']:>12} | {storage['compressed_mb']:>14.1f} | "
+                    f"{storage['uncompressed_mb']:>16.1f} | {storage['parts']:>6}")
+    logger.info("-" * 80)
+    logger.info(f"{'query':32} | {'profile':12} | {'seconds':>8} | {'rows read':>12} | {'MB read':>10}")
+    for name in next(iter(profiles.values()))['runs'] if profiles else []:
+        for profile, result in profiles.items():
+            run = result['runs'].get(name, {})
+            if 'error' in run:
+                logger.info(f"{name:32} | {profile:12} | {'error':>8} | {run['error'][:40]}")
+                continue
+            logger.info(f"{name:32} | {profile:12} | {run.get('seconds', 0):>8.3f} | "
+                        f"{run.get('read_rows', 0):>12} | {run.get('read_mb', 0):>10.2f}")
+    logger.info("-" * 80)
+
+    results = {'created_at': datetime.now().isoformat(timespec='seconds'), 'limit': args.limit,
+               'repeat': args.repeat, 'profiles': profiles}
+    save_path = Path(args.save) if args.save else RESULTS_DIR / f"layout_{datetime.now():%Y%m%d_%H%M%S}.json"
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(save_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results saved to {save_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Scaling of segment-parallel decompression and parsing for one .jsonl.gz file.
+
+Usage (from the project root):
+    python -m benchmarks.parallel_gzip path/to/Category.jsonl.gz --workers 1 2 4 8
+
+The baseline is the sequential gzip + Polars path used by columnar ingestion. Every
+run must produce the same number of records, otherwise the benchmark fails.
+"""
+import argparse
+import gzip
+import time
+
+from config.config import logger
+from src.utils.gzip_segments import DEFAULT_SEGMENT_BYTES, iter_segment_frames, load_segment_index, resegment_file
+from src.utils.jsonl import iter_line_chunks, parse_jsonl_chunk
+
+
+def _sequential(file_path: str, batch_size: int) -> int:
+    rows = 0
+    with gzip.open(file_path, 'rb') as f:
+        for chunk in iter_line_chunks(f, batch_size):
+            rows += len(parse_jsonl_chunk(chunk))
+    return rows
+
+
+def _parallel(file_path: str, index: dict, batch_size: int, workers: int) -> int:
+    return sum(len(df) for df in iter_segment_frames(file_path, index, batch_size, workers))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file_path", type=str)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--batch_size", type=int, default=5000)
+    parser.add_argument("--segment_mb", type=int, default=DEFAULT_SEGMENT_BYTES // (1024 * 1024))
+    args = parser.parse_args()
+
+    index = load_segment_index(args.file_path)
+    if index is None or index['segment_bytes'] != args.segment_mb * 1024 * 1024:
+        start = time.perf_counter()
+        index = resegment_file(args.file_path, segment_bytes=args.segment_mb * 1024 * 1024, workers=max(args.workers))
+        logger.info(f"Re-segmenting took {time.perf_counter() - start:.2f} s (one-time cost)")
+
+    start = time.perf_counter()
+    expected = _sequential(args.file_path, args.batch_size)
+    baseline = time.perf_counter() - start
+
+    results = [('sequential', expected, baseline)]
+    for workers in args.workers:
+        start = time.perf_counter()
+        rows = _parallel(args.file_path, index, args.batch_size, workers)
+        elapsed = time.perf_counter() - start
+        if rows != expected:
+            raise RuntimeError(f"{workers} workers read {rows} records, expected {expected}")
+        results.append((f"{workers} workers", rows, elapsed))
+
+    logger.info(f"Parallel gzip benchmark for {args.file_path} ({len(index['segments'])} segments)")
+    logger.info("-" * 60)
+    logger.info(f"{'run':14} | {'records':>10} | {'seconds':>8} | {'rows/sec':>10} | speedup")
+    for name, rows, elapsed in results:
+        logger.info(f"{name:14} | {rows:>10} | {elapsed:>8.2f} | {rows / elapsed:>10.0f} | {baseline / elapsed:.2f}x")
+    logger.info("-" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Sharded writer benchmark: routing, balance and per-shard insert stats over local stand-in shards.
+
+Usage (from the project root):
+    python -m benchmarks.synthetic_data ./bench_data --records 1000000 --files 4
+    python -m benchmarks.shard_benchmark ./bench_data --shards 1 2 4
+
+For every shard count, that many StandInClickHouseServer endpoints are started in this
+process and the folder is ingested through `--writer sharded`; the other queries go to
+the SinkQuery of ingest_benchmark.py. The stand-ins decode every block they receive on
+the same cores as the ingest, so rows/sec is a floor for the splitting and fan-out cost,
+not the throughput of a real cluster. Each run also checks that the rows of every shard
+key landed on one shard only, and the run fails otherwise.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.ingest_benchmark import RESULTS_DIR, _git_commit, _ingestion
+from config.config import clickhouse_config, logger
+from src.utils.metrics import metrics
+from src.utils.standin_server import StandInClickHouseServer
+from src.utils.writers import shard_stats
+
+
+def run_sharded(data_folder: str, shards: int, batch_size: int) -> Dict[str, Any]:
+    servers = [StandInClickHouseServer().start() for _ in range(shards)]
+    try:
+        clickhouse_config['shards'] = ','.join(f"{server.host}:{server.port}" for server in servers)
+        metrics.drain()
+        ingestion = _ingestion(data_folder, writer='sharded', batch_size=batch_size)
+        start = time.perf_counter()
+        ingestion.main()
+        seconds = time.perf_counter() - start
+        shard_key = ingestion.writer.shard_key
+        # shard key -> shards that received it, over both tables
+        owners: Dict[str, set] = {}
+        for index, server in enumerate(servers):
+            for block in server.blocks:
+                for key in block.frame.get_column(shard_key).unique().to_list():
+                    owners.setdefault(key, set()).add(index)
+        rows = [server.rows() for server in servers]
+        mean_rows = sum(rows) / len(rows)
+        return {
+            'seconds': round(seconds, 2),
+            'rows': sum(rows),
+            'rows_per_sec': round(sum(rows) / seconds, 1) if seconds else 0.0,
+            'balance': round(max(rows) / mean_rows, 3) if mean_rows else 0.0,
+            'split_keys': sum(len(shard_set) > 1 for shard_set in owners.values()),
+            'shards': shard_stats(metrics.snapshot()),
+        }
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_folder", type=str)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch_size", type=int, default=50000)
+    parser.add_argument("--save", type=str, default=None,
+                        help="Where to write the results JSON; defaults to benchmarks/results/shards_<timestamp>.json.")
+    args = parser.parse_args()
+
+    if not list(Path(args.data_folder).rglob('*.jsonl.gz')):
+        logger.error(f"No .jsonl.gz files found in '{args.data_folder}', see benchmarks/synthetic_data.py")
+        sys.exit(1)
+    runs: Dict[str, Dict[str, Any]] = {}
+    failures: List[str] = []
+    for shards in args.shards:
+        logger.info(f"Ingesting {args.data_folder} into {shards} stand-in shards...")
+        run = runs[f"shards:{shards}"] = run_sharded(args.data_folder, shards, args.batch_size)
+        if run['split_keys']:
+            failures.append(f"shards:{shards}: {run['split_keys']} shard keys were written to several shards")
+
+    logger.info("Shard Benchmark")
+    logger.info("-" * 60)
+    for name, run in runs.items():
+        logger.info(f"{name:12} | {run['rows']:>10} rows | {run['seconds']:>8.2f}s | {run['rows_per_sec']:>10} rows/s | "
+                    f"balance {run['balance']:.2f}")
+        for shard, stats in sorted(run['shards'].items()):
+            logger.info(f"{'':12} | {shard:24} | {stats['rows']:>10} rows | {stats['inserts']:>6} inserts | "
+                        f"{stats['mean_latency_s']:>7}s mean")
+    logger.info("-" * 60)
+
+    results = {'created_at': datetime.now().isoformat(timespec='seconds'), 'git_commit': _git_commit(),
+               'python': sys.version.split()[0], 'batch_size': args.batch_size, 'runs': runs}
+    save_path = Path(args.save) if args.save else RESULTS_DIR / f"shards_{datetime.now():%Y%m%d_%H%M%S}.json"
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(save_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results saved to {save_path}")
+
+    if failures:
+        for failure in failures:
+            logger.error(f"Shard routing: {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
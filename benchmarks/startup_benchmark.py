@@ -0,0 +1,195 @@
+"""Fixed cost of launching the CLI: import times and time to the first inserted batch.
+
+Usage (from the project root):
+    python -m benchmarks.synthetic_data ./bench_data --records 100000 --files 2
+    python -m benchmarks.startup_benchmark ./bench_data --save benchmarks/results/startup_baseline.json
+    python -m benchmarks.startup_benchmark ./bench_data --compare benchmarks/results/startup_baseline.json
+
+Every run starts a fresh interpreter, the way a scheduler launches `main.py`, and the
+best of --repeat runs is kept:
+
+  cli:help              python main.py --help
+  import:<module>       importing the ingest and report pipelines
+  cli:plan              python main.py ingest --plan, without any CLICKHOUSE_* settings
+  first_batch:<mode>    from launch until the first insert of `ingest` reaches the in-process sink
+
+Runs that load a module listed in DEFERRED_MODULES for them fail the benchmark, as does
+--compare when a run is slower than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from config.config import REQUIRED_SETTINGS, logger
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# modules a run must not import; they belong to other code paths or to the first query
+DEFERRED_MODULES = {
+    'cli:help': ['polars', 'dbutils', 'matplotlib'],
+    'import:src.pipelines.ingest': ['dbutils', 'matplotlib'],
+    'import:src.pipelines.analyze': ['dbutils', 'matplotlib'],
+    'cli:plan': ['dbutils', 'matplotlib', 'src.utils.staging'],
+}
+_WATCHED_MODULES = sorted({module for modules in DEFERRED_MODULES.values() for module in modules})
+
+# printed by the child on stderr, followed by JSON
+_MARKER = 'STARTUP_BENCH '
+
+# runs `main.py` like the command line would and reports the heavy modules it loaded
+_RUN_MAIN = """
+import json, runpy, sys
+sys.argv = ['main.py'] + {argv!r}
+try:
+    runpy.run_path('main.py', run_name='__main__')
+except SystemExit:
+    pass
+sys.stderr.write({marker!r} + json.dumps({{'modules': [m for m in {watched!r} if m in sys.modules]}}) + '\\n')
+"""
+
+_IMPORT = """
+import json, sys
+import {module}
+sys.stderr.write({marker!r} + json.dumps({{'modules': [m for m in {watched!r} if m in sys.modules]}}) + '\\n')
+"""
+
+# stops the process at the first insert; the sink stands in for the server (see ingest_benchmark.py)
+_FIRST_BATCH = """
+import json, os, sys, time
+from benchmarks.ingest_benchmark import SinkQuery, _ingestion
+
+def first_write(self, df, schema, table_name, max_chunk):
+    sys.stderr.write({marker!r} + json.dumps({{'first_batch_at': time.time(), 'rows': len(df)}}) + '\\n')
+    sys.stderr.flush()
+    os._exit(0)
+
+SinkQuery.sql_write = first_write
+_ingestion({data_folder!r}, ingest_mode={mode!r}).main()
+"""
+
+
+def _run_child(code: str, env: Dict[str, str]) -> tuple[float, Dict[str, Any]]:
+    start = time.time()
+    result = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_ROOT, env=env, capture_output=True, text=True)
+    seconds = time.time() - start
+    lines = [line for line in result.stderr.splitlines() if line.startswith(_MARKER)]
+    if not lines:
+        raise RuntimeError(f"Startup run failed (exit {result.returncode}): {result.stderr[-2000:]}")
+    return seconds, json.loads(lines[-1][len(_MARKER):])
+
+
+def _environment(with_settings: bool) -> Dict[str, str]:
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    for variable in REQUIRED_SETTINGS.values():
+        if with_settings:
+            # the sink never connects, any value will do
+            env.setdefault(variable, 'startup_bench')
+        else:
+            # empty rather than unset, so a .env file does not fill them in again
+            env[variable] = ''
+    return env
+
+
+def run_startup(data_folder: str, modes: List[str], repeat: int) -> Dict[str, Dict[str, Any]]:
+    scenarios = {
+        'cli:help': (_RUN_MAIN.format(argv=['--help'], marker=_MARKER, watched=_WATCHED_MODULES), True),
+        'import:src.pipelines.ingest': (_IMPORT.format(module='src.pipelines.ingest', marker=_MARKER,
+                                                       watched=_WATCHED_MODULES), True),
+        'import:src.pipelines.analyze': (_IMPORT.format(module='src.pipelines.analyze', marker=_MARKER,
+                                                        watched=_WATCHED_MODULES), True),
+        'cli:plan': (_RUN_MAIN.format(argv=['ingest', '--plan', '--data_folder', data_folder], marker=_MARKER,
+                                      watched=_WATCHED_MODULES), False),
+    }
+    for mode in modes:
+        scenarios[f"first_batch:{mode}"] = (_FIRST_BATCH.format(marker=_MARKER, data_folder=data_folder, mode=mode),
+                                            True)
+    runs = {}
+    for name, (code, with_settings) in scenarios.items():
+        best, report = float('inf'), {}
+        for _ in range(repeat):
+            start = time.time()
+            seconds, report = _run_child(code, _environment(with_settings))
+            if 'first_batch_at' in report:
+                seconds = report['first_batch_at'] - start
+            best = min(best, seconds)
+        runs[name] = {'seconds': round(best, 3), **{key: value for key, value in report.items()
+                                                    if key != 'first_batch_at'}}
+        logger.info(f"{name:32} | {best:>8.3f}s")
+    return runs
+
+
+def check(runs: Dict[str, Dict[str, Any]], baseline: Dict[str, Any] | None, tolerance: float) -> List[str]:
+    """Deferred modules that were imported, and runs slower than the baseline beyond `tolerance`"""
+    failures = []
+    for name, modules in DEFERRED_MODULES.items():
+        loaded = sorted(set(runs.get(name, {}).get('modules', [])) & set(modules))
+        if loaded:
+            failures.append(f"{name}: imports {', '.join(loaded)}")
+    if baseline is None:
+        return failures
+    logger.info(f"Comparison against {baseline['created_at']} ({baseline.get('git_commit')})")
+    logger.info("-" * 60)
+    for name, run in runs.items():
+        before = baseline['runs'].get(name)
+        if before is None:
+            continue
+        change = run['seconds'] / before['seconds'] - 1 if before['seconds'] else 0.0
+        if change > tolerance:
+            failures.append(f"{name}: {change:+.1%} seconds")
+        logger.info(f"{name:32} | {run['seconds']:>8.3f}s | {change:>+8.1%}")
+    logger.info("-" * 60)
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_folder", type=str)
+    parser.add_argument("--modes", type=str, nargs="+", default=['columnar', 'pipelined'])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", type=str, default=None,
+                        help="Where to write the results JSON; defaults to benchmarks/results/startup_<timestamp>.json.")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline results JSON to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown (0.2 = 20%%).")
+    args = parser.parse_args()
+
+    if not list(Path(args.data_folder).rglob('*.jsonl.gz')):
+        logger.error(f"No .jsonl.gz files found in '{args.data_folder}', see benchmarks/synthetic_data.py")
+        sys.exit(1)
+    logger.info("Startup benchmark")
+    logger.info("-" * 60)
+    runs = run_startup(str(Path(args.data_folder).resolve()), args.modes, args.repeat)
+    logger.info("-" * 60)
+
+    try:
+        git_commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                    check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_commit = None
+    results = {'created_at': datetime.now().isoformat(timespec='seconds'), 'git_commit': git_commit,
+               'python': sys.version.split()[0], 'repeat': args.repeat, 'runs': runs}
+    save_path = Path(args.save) if args.save else RESULTS_DIR / f"startup_{datetime.now():%Y%m%d_%H%M%S}.json"
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(save_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results saved to {save_path}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    failures = check(runs, baseline, args.tolerance)
+    if failures:
+        for failure in failures:
+            logger.error(f"Startup regression: {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Synthetic Amazon Reviews 2023 files for benchmarks.
+
+Usage (from the project root):
+    python -m benchmarks.synthetic_data ./bench_data --records 1000000 --files 4
+
+Files are written as `<prefix>_<n>.jsonl.gz` with the same fields as the real
+dataset. asin and user_id follow Zipf distributions (a few bestsellers and power
+reviewers), a fraction of the reviews carries image attachments or very long
+texts, and some helpful_vote values are null. The same seed gives the same files.
+"""
+import argparse
+import gzip
+import io
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import polars as pl
+
+from config.config import logger
+from src.utils.jsonl import RAW_REVIEW_SCHEMA
+
+WORDS = ('great product quality price works well love bought item return broke fast shipping size fit color '
+         'cheap perfect would recommend again not worth money battery easy use disappointed exactly expected '
+         'arrived damaged small large sturdy daughter son gift kitchen daily months after still').split()
+
+# real star ratings are heavily skewed towards 5
+RATING_WEIGHTS = [0.10, 0.05, 0.08, 0.17, 0.60]
+
+# 2000-01-01 .. 2023-09-01 in epoch ms
+TIMESTAMP_RANGE = (946684800000, 1693526400000)
+
+# most image reviews carry one to four photos
+MAX_IMAGES = 4
+
+# rows generated and written at a time, bounds memory for large files
+GENERATE_BATCH = 100_000
+
+
+def _text_pool(rng: np.random.Generator, size: int, long_fraction: float) -> List[str]:
+    """Review texts to sample from; most are a few sentences, `long_fraction` are thousands of words"""
+    pool = []
+    for i in range(size):
+        if rng.random() < long_fraction:
+            words = int(rng.integers(1500, 4000))
+        else:
+            words = int(rng.lognormal(3.5, 0.8)) + 1
+        tokens = rng.choice(WORDS, size=words)
+        # the real data uses html line breaks between paragraphs
+        pool.append('<br /><br />'.join(' '.join(tokens[i:i + 40]) for i in range(0, words, 40)))
+    return pool
+
+
+def _zipf_ranks(rng: np.random.Generator, count: int, population: int, exponent: float) -> np.ndarray:
+    ranks = rng.zipf(exponent, size=count)
+    # the tail beyond the population is spread uniformly instead of piling up on the last id
+    return np.where(ranks > population, rng.integers(1, population + 1, size=count), ranks)
+
+
+def _image_struct(row: pl.Expr, position: int) -> pl.Expr:
+    url = 'https://images.example.com/{}_' + str(position)
+    return pl.struct(
+        pl.format(url + '._SL256_.jpg', row).alias('small_image_url'),
+        pl.format(url + '._SL800_.jpg', row).alias('medium_image_url'),
+        pl.format(url + '.jpg', row).alias('large_image_url'),
+        pl.lit('IMAGE').alias('attachment_type'),
+    )
+
+
+def generate_batch(rng: np.random.Generator, count: int, offset: int, texts: pl.Series, titles: pl.Series,
+                   products: int, users: int, image_fraction: float, null_helpful_fraction: float) -> pl.DataFrame:
+    """One batch of synthetic reviews as a frame with the raw JSONL schema"""
+    # recent years have far more reviews, so bend a uniform draw towards the end of the range
+    span = TIMESTAMP_RANGE[1] - TIMESTAMP_RANGE[0]
+    df = pl.DataFrame({
+        'row': np.arange(offset, offset + count),
+        'rating': rng.choice([1.0, 2.0, 3.0, 4.0, 5.0], size=count, p=RATING_WEIGHTS),
+        'title': titles.gather(rng.integers(0, len(titles), size=count)),
+        'text': texts.gather(rng.integers(0, len(texts), size=count)),
+        'image_count': np.where(rng.random(count) < image_fraction, rng.integers(1, MAX_IMAGES + 1, size=count), 0),
+        'asin_rank': _zipf_ranks(rng, count, products, 1.3),
+        'user_rank': _zipf_ranks(rng, count, users, 1.15),
+        'timestamp': TIMESTAMP_RANGE[0] + (np.sqrt(rng.random(count)) * span).astype(np.int64),
+        'helpful_vote': rng.geometric(0.5, size=count) - 1,
+        'helpful_null': rng.random(count) < null_helpful_fraction,
+        'verified_purchase': rng.random(count) < 0.9,
+    })
+    return df.select(
+        'rating', 'title', 'text',
+        pl.concat_list([_image_struct(pl.col('row'), j) for j in range(MAX_IMAGES)])
+        .list.head(pl.col('image_count')).alias('images'),
+        pl.format('B{}', pl.col('asin_rank').cast(pl.Utf8).str.zfill(9)).alias('asin'),
+        # a parent groups the variants (colors, sizes) of ten neighbouring asins
+        pl.format('P{}', (pl.col('asin_rank') // 10).cast(pl.Utf8).str.zfill(8)).alias('parent_asin'),
+        pl.format('AG{}', pl.col('user_rank').cast(pl.Utf8).str.zfill(9)).alias('user_id'),
+        'timestamp',
+        pl.when(pl.col('helpful_null')).then(None).otherwise(pl.col('helpful_vote')).alias('helpful_vote'),
+        'verified_purchase',
+    ).cast(RAW_REVIEW_SCHEMA)
+
+
+def generate_file(file_path: Path, records: int, seed: int, products: int = 200_000, users: int = 1_000_000,
+                  image_fraction: float = 0.1, long_text_fraction: float = 0.01,
+                  null_helpful_fraction: float = 0.02) -> Dict[str, Any]:
+    """Write one synthetic `.jsonl.gz` file and return its record count and sizes"""
+    rng = np.random.default_rng(seed)
+    texts = pl.Series(_text_pool(rng, 5000, long_text_fraction))
+    titles = pl.Series([' '.join(rng.choice(WORDS, size=int(rng.integers(1, 8)))).capitalize() for _ in range(1000)])
+    raw_bytes = 0
+    with gzip.open(file_path, 'wb', compresslevel=6) as f:
+        for offset in range(0, records, GENERATE_BATCH):
+            df = generate_batch(rng, min(GENERATE_BATCH, records - offset), offset, texts, titles,
+                                products, users, image_fraction, null_helpful_fraction)
+            buffer = io.BytesIO()
+            df.write_ndjson(buffer)
+            raw_bytes += buffer.tell()
+            f.write(buffer.getvalue())
+    return {'file': str(file_path), 'records': records, 'raw_mb': round(raw_bytes / (1024 * 1024), 1),
+            'compressed_mb': round(file_path.stat().st_size / (1024 * 1024), 1)}
+
+
+def generate_folder(output_folder: str, records: int, files: int = 1, seed: int = 42, prefix: str = 'Synthetic',
+                    **options) -> List[Dict[str, Any]]:
+    """Split `records` over `files` files; the first file is the largest, like a big category"""
+    folder = Path(output_folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    weights = np.array([1 / (i + 1) for i in range(files)])
+    counts = np.floor(records * weights / weights.sum()).astype(int)
+    counts[0] += records - counts.sum()
+    results = []
+    for i, count in enumerate(counts):
+        result = generate_file(folder / f"{prefix}_{i}.jsonl.gz", int(count), seed + i, **options)
+        logger.info(f"Wrote {result['records']} records to {result['file']} "
+                    f"({result['raw_mb']} MB raw, {result['compressed_mb']} MB compressed)")
+        results.append(result)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_folder", type=str)
+    parser.add_argument("--records", type=int, default=100_000, help="Total records over all files.")
+    parser.add_argument("--files", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--prefix", type=str, default='Synthetic')
+    parser.add_argument("--products", type=int, default=200_000, help="Distinct asins to draw from.")
+    parser.add_argument("--users", type=int, default=1_000_000, help="Distinct user_ids to draw from.")
+    parser.add_argument("--image_fraction", type=float, default=0.1)
+    parser.add_argument("--long_text_fraction", type=float, default=0.01)
+    parser.add_argument("--null_helpful_fraction", type=float, default=0.02)
+    args = parser.parse_args()
+
+    generate_folder(args.output_folder, args.records, args.files, args.seed, args.prefix,
+                    products=args.products, users=args.users, image_fraction=args.image_fraction,
+                    long_text_fraction=args.long_text_fraction, null_helpful_fraction=args.null_helpful_fraction)
+
+
+if __name__ == "__main__":
+    main()
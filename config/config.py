@@ -9,12 +9,36 @@ logging.basicConfig(
     stream=sys.stdout, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+# connection settings every ClickHouse command needs; they are checked when the first connection
+# opens, so --help, --plan and the polars report run without them
+REQUIRED_SETTINGS = {
+    'db_name': 'CLICKHOUSE_DB',
+    'db_user': 'CLICKHOUSE_USER',
+    'db_pass': 'CLICKHOUSE_PASSWORD',
+    'db_host': 'CLICKHOUSE_HOST',
+    'db_port': 'CLICKHOUSE_PORT',
+}
+
 clickhouse_config = {
     'db_type': 'clickhouse',
-    'db_name': os.environ['CLICKHOUSE_DB'],
-    'db_user': os.environ['CLICKHOUSE_USER'],
-    'db_pass': os.environ['CLICKHOUSE_PASSWORD'],
-    'db_host': os.environ['CLICKHOUSE_HOST'],
-    'db_port': os.environ['CLICKHOUSE_PORT'],
-    'max_chunk': 50000
-}
\ No newline at end of file
+    **{key: os.environ.get(variable) for key, variable in REQUIRED_SETTINGS.items()},
+    'max_chunk': 50000,
+    # writer backend for inserts: 'dbutils' (Query.sql_write) or 'http' (compressed Parquet/Arrow blocks)
+    'writer': os.environ.get('CLICKHOUSE_WRITER', 'dbutils'),
+    'http_port': os.environ.get('CLICKHOUSE_HTTP_PORT', '8123'),
+    'http_format': os.environ.get('CLICKHOUSE_HTTP_FORMAT', 'parquet'),
+    'http_compression': os.environ.get('CLICKHOUSE_HTTP_COMPRESSION', 'zstd'),
+    'pool_size': int(os.environ.get('CLICKHOUSE_POOL_SIZE', 4)),
+    # sharded writer: HTTP endpoints (host:port, comma separated) each holding local tables, the column
+    # rows are routed by, and the cluster of the optional Distributed tables over them
+    'shards': os.environ.get('CLICKHOUSE_SHARDS', ''),
+    'shard_key': os.environ.get('CLICKHOUSE_SHARD_KEY', 'asin'),
+    'cluster': os.environ.get('CLICKHOUSE_CLUSTER'),
+    # storage layout of newly created tables, a profile of create_schema.layout_profiles
+    'layout_profile': os.environ.get('CLICKHOUSE_LAYOUT', 'default'),
+}
+
+
+def missing_clickhouse_settings() -> list:
+    """Environment variables of the required settings that are not set"""
+    return [variable for key, variable in REQUIRED_SETTINGS.items() if not clickhouse_config[key]]
@@ -4,6 +4,11 @@ import argparse
 commands_choice = [
     'ingest',
     'generate_report',
+    'replay_rejected',
+    'backfill_rollups',
+    'migrate_layout',
+    'build_key_index',
+    'stage',
 ]
 
 
@@ -14,20 +19,151 @@ def parse_arguments():
                         help="Name of the command to be executed")
     parser.add_argument("--data_folder", type=str, default="./src/data",
                         help="Path to the data folder (where the files to ingest are located and where to save the reports).")
+    parser.add_argument("--ingest_mode", type=str, default="columnar", choices=['columnar', 'pipelined', 'records'],
+                        help="How records are decoded during ingestion: whole Polars batches, Polars batches with "
+                             "decode/transform/insert stages overlapping, or one JSON record at a time.")
+    parser.add_argument("--batch_size", type=int, default=5000,
+                        help="Number of records to insert per batch.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes ingesting files in parallel (largest file first).")
+    parser.add_argument("--inflight_inserts", type=int, default=2,
+                        help="Concurrent inserts per file in pipelined mode.")
+    parser.add_argument("--queue_size", type=int, default=4,
+                        help="Batches buffered in front of each stage in pipelined mode.")
+    parser.add_argument("--decode_workers", type=int, default=1,
+                        help="Processes decompressing and parsing segments of a single file. Needs a segment index "
+                             "next to the file (see --resegment).")
+    parser.add_argument("--resegment", action="store_true",
+                        help="Re-chunk files without a segment index into independently compressed segments first.")
+    parser.add_argument("--writer", type=str, default=None, choices=['dbutils', 'http', 'sharded'],
+                        help="Insert backend; defaults to CLICKHOUSE_WRITER from the environment (dbutils). "
+                             "'sharded' spreads rows over the hosts in CLICKHOUSE_SHARDS.")
+    parser.add_argument("--distributed", action="store_true",
+                        help="--writer sharded: also create Distributed tables <table>_all over the shards of "
+                             "CLICKHOUSE_CLUSTER.")
+    parser.add_argument("--no_manifest", action="store_true",
+                        help="Ignore the processed-file manifest: re-ingest every file from the start.")
+    parser.add_argument("--plan", "--dry_run", "--dry-run", dest="plan", action="store_true",
+                        help="ingest: list the files, their status and batches without connecting to ClickHouse.")
+    parser.add_argument("--count_records", action="store_true",
+                        help="--plan: decompress files whose record count is not known from an earlier run.")
+    parser.add_argument("--stage", action="store_true",
+                        help="Read source files from their Parquet stage in .staging/ next to them, staging them "
+                             "on the first full read.")
+    parser.add_argument("--no_key_index", action="store_true",
+                        help="Do not drop rows whose key was already inserted; leave deduplication to ReplacingMergeTree.")
+    parser.add_argument("--batch_bytes", type=int, default=None,
+                        help="Target in-memory MB per review batch instead of --batch_size records; "
+                             "tuned at runtime from insert latency (columnar and pipelined modes).")
+    parser.add_argument("--image_batch_bytes", type=int, default=None,
+                        help="Target MB per review_images batch, defaults to --batch_bytes.")
+    parser.add_argument("--image_batch_size", type=int, default=None,
+                        help="review_images rows buffered per insert without a byte budget; defaults to --batch_size.")
+    parser.add_argument("--rollups", action="store_true",
+                        help="Create the report rollup tables and materialized views before ingesting.")
+    parser.add_argument("--layout", type=str, default=None,
+                        help="migrate_layout: storage layout profile to rebuild the tables in (default or optimized).")
+    parser.add_argument("--no_rollups", action="store_true",
+                        help="Run the report on the raw tables even when rollup tables exist.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Create rollup tables for the report and update them from the rows ingested since the "
+                             "last report.")
+    parser.add_argument("--full_rebuild", action="store_true",
+                        help="Recompute the incrementally updated report rollups from every row.")
+    parser.add_argument("--no_cache", action="store_true",
+                        help="Run every report query even if its tables did not change since the cached result.")
+    parser.add_argument("--cache_mb", type=int, default=512,
+                        help="Size limit of the report query cache in <data_folder>/analysis_output/.query_cache.")
+    parser.add_argument("--approx", action="store_true",
+                        help="Fast approximate report: distinct counts from sketches, sampled reads where possible, "
+                             "with 95%% error bounds next to each estimated metric.")
+    parser.add_argument("--sample_fraction", type=float, default=0.1,
+                        help="Fraction of reviews read by --approx, if the table has a sampling key on user_id.")
+    parser.add_argument("--no_fusion", action="store_true",
+                        help="Run the overview queries as separate scans instead of one fused scan of reviews.")
+    parser.add_argument("--dpi", type=int, default=300, help="Resolution of raster report figures.")
+    parser.add_argument("--image_format", type=str, default="png", choices=['png', 'jpg', 'svg', 'pdf'],
+                        help="File format of the report figures.")
+    parser.add_argument("--render_workers", type=int, default=4,
+                        help="Processes rendering report figures, one figure each.")
+    parser.add_argument("--report_backend", type=str, default="clickhouse", choices=['clickhouse', 'polars'],
+                        help="Engine of generate_report: the ClickHouse server, or Polars over local review files "
+                             "without a server.")
+    parser.add_argument("--report_source", type=str, default=None,
+                        help="Review files (.parquet, .jsonl, .jsonl.gz) the polars report reads; defaults to "
+                             "the data folder.")
+    parser.add_argument("--no_dedupe", action="store_true",
+                        help="Polars report: count every row of the files instead of one per review key.")
+    parser.add_argument("--report_concurrency", type=int, default=4,
+                        help="Report queries running at once, each on its own ClickHouse connection.")
+    parser.add_argument("--metrics_file", type=str, default=None,
+                        help="JSON stats file refreshed while ingesting; defaults to <data_folder>/ingest_metrics.json.")
+    parser.add_argument("--metrics_port", type=int, default=None,
+                        help="Serve live metrics in Prometheus text format on this port (/metrics).")
+    parser.add_argument("--metrics_interval", type=float, default=5.0,
+                        help="Seconds between refreshes of the metrics file.")
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_arguments()
-    if args.command_name == 'ingest':
+    if args.plan:
+        if args.command_name != 'ingest':
+            raise ValueError("--plan is only supported for ingest")
+        from src.utils.ingest_plan import log_plan, plan_ingest
+        log_plan(plan_ingest(args.data_folder, args.batch_size, use_manifest=not args.no_manifest, stage=args.stage,
+                             count_records=args.count_records), args.batch_size)
+    elif args.command_name == 'ingest':
         from src.pipelines.ingest import AmazonReviewsIngestion
-        instance = AmazonReviewsIngestion(data_folder=args.data_folder)
+        instance = AmazonReviewsIngestion(data_folder=args.data_folder, batch_size=args.batch_size,
+                                          ingest_mode=args.ingest_mode, workers=args.workers,
+                                          inflight_inserts=args.inflight_inserts, queue_size=args.queue_size,
+                                          decode_workers=args.decode_workers, resegment=args.resegment,
+                                          writer=args.writer, use_manifest=not args.no_manifest,
+                                          batch_bytes=args.batch_bytes and args.batch_bytes * 1024 * 1024,
+                                          image_batch_bytes=args.image_batch_bytes and args.image_batch_bytes * 1024 * 1024,
+                                          image_batch_size=args.image_batch_size, rollups=args.rollups,
+                                          key_index=not args.no_key_index, stage=args.stage,
+                                          distributed=args.distributed,
+                                          metrics_file=args.metrics_file or f"{args.data_folder}/ingest_metrics.json",
+                                          metrics_port=args.metrics_port, metrics_interval=args.metrics_interval)
         instance.main()
+    elif args.command_name == 'replay_rejected':
+        from src.pipelines.ingest import AmazonReviewsIngestion
+        instance = AmazonReviewsIngestion(data_folder=args.data_folder, writer=args.writer)
+        instance.replay_rejected()
+    elif args.command_name == 'backfill_rollups':
+        from src.pipelines.ingest import AmazonReviewsIngestion
+        instance = AmazonReviewsIngestion(data_folder=args.data_folder, writer=args.writer)
+        instance.backfill_rollups()
+    elif args.command_name == 'stage':
+        from src.pipelines.ingest import AmazonReviewsIngestion
+        instance = AmazonReviewsIngestion(data_folder=args.data_folder, workers=args.workers,
+                                          decode_workers=args.decode_workers, stage=True)
+        instance.stage_data_folder()
+    elif args.command_name == 'build_key_index':
+        from src.pipelines.ingest import AmazonReviewsIngestion
+        instance = AmazonReviewsIngestion(data_folder=args.data_folder, writer=args.writer)
+        instance.build_key_index()
+    elif args.command_name == 'migrate_layout':
+        if args.layout is None:
+            raise ValueError("migrate_layout needs --layout")
+        from src.pipelines.ingest import AmazonReviewsIngestion
+        instance = AmazonReviewsIngestion(data_folder=args.data_folder, writer=args.writer)
+        instance.migrate_layout(args.layout)
     elif args.command_name == 'generate_report':
         from src.pipelines.analyze import AmazonReviewsAnalysis
         analyse_folder = f"{args.data_folder}/analysis_output"
-        instance = AmazonReviewsAnalysis(output_dir=analyse_folder)
+        instance = AmazonReviewsAnalysis(output_dir=analyse_folder, concurrency=args.report_concurrency,
+                                         use_rollups=not args.no_rollups, incremental=args.incremental,
+                                         full_rebuild=args.full_rebuild, use_cache=not args.no_cache,
+                                         cache_max_bytes=args.cache_mb * 1024 * 1024, approx=args.approx,
+                                         sample_fraction=args.sample_fraction, fuse=not args.no_fusion,
+                                         dpi=args.dpi, image_format=args.image_format,
+                                         render_workers=args.render_workers, backend=args.report_backend,
+                                         local_source=args.report_source or args.data_folder,
+                                         dedupe=not args.no_dedupe)
         report = instance.main()
     else:
         raise ValueError(f"Unknown command: {args.command_name}")
@@ -1,28 +1,430 @@
+import json
+import math
+import multiprocessing
+import os
+import queue
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 import polars as pl
-import matplotlib.pyplot as plt
 
 
 from src.utils.clickhouse import ClickHouseDB
-from config.config import logger
-from src.sql.analysis import queries as analysis_sql_queries
+from config.config import clickhouse_config, logger
+from src.sql.create_schema import get_rollup_queries
+from src.sql.analysis import approx_queries, queries as analysis_sql_queries, rollup_queries, rollup_tables
+from src.sql.fusion import FusionFallback, fusable_queries, fuse_sql, split_fused
+from src.utils import plots
+from src.utils.query_cache import QueryCache, data_versions_sql
+from src.utils.report_backends import REPORT_BACKENDS, PolarsReportBackend
+
+OVERVIEW_QUERIES = ['rating_distribution', 'total_reviews', 'unique_products', 'unique_users', 'date_range',
+                    'verified_vs_unverified']
+# every query of a report, in the order the results are used
+REPORT_QUERIES = OVERVIEW_QUERIES + ['product_popularity', 'temporal_trends', 'user_behavior']
+
+# a failed query keeps its exception as result, so each analysis step handles it like before
+QueryResult = pl.DataFrame | Exception
+
+# watermark per rollup table of the incremental report, kept in the output folder
+REPORT_STATE_FILE = '.report_state.json'
+# rows this recent may belong to an insert that is still running, so they stay above the watermark
+WATERMARK_SETTLE_SECONDS = 300
+# incremental rollups are rebuilt from `reviews FINAL` at least this often, see refresh_report_state
+REBUILD_INTERVAL_DAYS = 7
+
+# relative standard error of uniqCombined at its default precision (HyperLogLog with 2^17 cells)
+UNIQ_COMBINED_ERROR = 1.04 / math.sqrt(2 ** 17)
+# error bounds of approximate metrics are reported as 95% intervals
+ERROR_Z = 1.96
+
 
 class AmazonReviewsAnalysis(ClickHouseDB):
     """Handles analysis of Amazon reviews data using Polars"""
 
-    def __init__(self, output_dir: str = "./src/data/analysis_output"):
-        super().__init__()
+    def __init__(self, output_dir: str = "./src/data/analysis_output", concurrency: int = 4, use_rollups: bool = True,
+                 use_cache: bool = True, cache_dir: str | None = None, cache_max_bytes: int = 512 * 1024 * 1024,
+                 incremental: bool = False, full_rebuild: bool = False,
+                 approx: bool = False, sample_fraction: float = 0.1, fuse: bool = True,
+                 dpi: int = 300, image_format: str = 'png', render_workers: int = 4,
+                 density_threshold: int = plots.DENSITY_THRESHOLD,
+                 backend: str = 'clickhouse', local_source: str = "./src/data", dedupe: bool = True):
+        if backend not in REPORT_BACKENDS:
+            logger.error(f"Unknown report backend '{backend}', expected one of {REPORT_BACKENDS}")
+            raise ValueError(f"Unknown report backend '{backend}', expected one of {REPORT_BACKENDS}")
+        # the polars backend runs the report on the review files in `local_source`, without a server
+        # (see report_backends.py); rollups, the result cache, fusion and --approx are ClickHouse only
+        self.local = PolarsReportBackend(local_source, dedupe=dedupe) if backend == 'polars' else None
+        super().__init__()  # connects on the first query, which the polars backend never runs
+        if self.local is not None and approx:
+            logger.warning("The polars backend runs the exact report, ignoring approx")
+            approx = False
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        
-    def basic_data_overview(self) -> dict[str, any]:
+        # read from the pre-aggregated rollup tables when they exist (see create_schema.py)
+        self.use_rollups = use_rollups and self.local is None
+        self._queries: dict[str, str] | None = None
+        # opt-in: rollup tables without a materialized view are created and brought up to date from the
+        # rows ingested since the last report; `full_rebuild` recomputes them from every row
+        self.incremental = incremental and self.use_rollups
+        self.full_rebuild = full_rebuild
+        self._watermarks: dict[str, str] = {}  # rollup table -> ingest_ts its states are complete up to
+        # sketches instead of exact distinct counts, and SAMPLE on reviews when it has a sampling key
+        if not 0 < sample_fraction <= 1:
+            logger.error(f"sample_fraction must be in (0, 1], got {sample_fraction}")
+            raise ValueError(f"sample_fraction must be in (0, 1], got {sample_fraction}")
+        self.approx = approx
+        self.sample_fraction = sample_fraction
+        self._approximated: dict[str, float] = {}  # query name -> fraction of rows it read
+        # answer queries over the same table with one scan (see src/sql/fusion.py)
+        self.fuse = fuse
+        # figures are rendered in `render_workers` processes; scatters above `density_threshold` points
+        # become 2D histograms
+        self.dpi = dpi
+        self.image_format = image_format
+        self.render_workers = render_workers
+        self.density_threshold = density_threshold
+        # report queries running at once, each on its own connection
+        self.concurrency = concurrency
+        self._connections: queue.Queue = queue.Queue()
+        self._connections.put(self)
+        self.query_timings: dict[str, float] = {}
+        # results of unchanged tables are read back from Parquet instead of running the query again
+        self.cache = (QueryCache(cache_dir or self.output_dir / '.query_cache', cache_max_bytes)
+                      if use_cache and self.local is None else None)
+        self._data_versions: dict[str, str] | None = None
+
+    @property
+    def queries(self) -> dict[str, str]:
+        """SQL of every analysis query; reports with an existing rollup table read from it"""
+        if self._queries is None:
+            queries = dict(analysis_sql_queries)
+            if self.approx:
+                queries.update(self._approx_queries())
+            if self.use_rollups:
+                if self.incremental:
+                    try:
+                        self.refresh_report_state()
+                    except Exception as e:
+                        logger.warning(f"Could not refresh the incremental report, "
+                                       f"tables it did not update read from reviews: {e}")
+                tables = set(rollup_tables.values())
+                existing = self._existing_tables(tables | {f"{table}_mv" for table in tables})
+                used = set()
+                for name, table in rollup_tables.items():
+                    if f"{table}_mv" in existing:
+                        # fed on every insert, so the table is complete
+                        queries[name] = rollup_queries[name]
+                    elif table in existing and table in self._watermarks:
+                        queries[name] = self._with_tail(rollup_queries[name], table)
+                    else:
+                        continue
+                    # the rollup is exact and cheaper than the approximation
+                    self._approximated.pop(name, None)
+                    used.add(table)
+                logger.info(f"Reading {len(used)}/{len(tables)} rollup tables instead of reviews"
+                            + (f": {', '.join(sorted(used))}" if used else ""))
+            self._queries = queries
+        return self._queries
+
+    @property
+    def state_path(self) -> Path:
+        return self.output_dir / REPORT_STATE_FILE
+
+    def _load_report_state(self) -> tuple[dict[str, str], dict[str, str]]:
+        """Watermark and time of the last rebuild of every incremental rollup table"""
+        try:
+            state = json.loads(self.state_path.read_text())
+        except FileNotFoundError:
+            return {}, {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable report state {self.state_path}: {e}")
+            return {}, {}
+        if state.get('database') != clickhouse_config['db_name']:
+            return {}, {}
+        return dict(state.get('watermarks', {})), dict(state.get('rebuilt_at', {}))
+
+    def _save_report_state(self, watermarks: dict[str, str], rebuilt_at: dict[str, str]) -> None:
+        tmp_path = self.state_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({'database': clickhouse_config['db_name'], 'watermarks': watermarks,
+                                        'rebuilt_at': rebuilt_at}, indent=2))
+        os.replace(tmp_path, self.state_path)
+
+    def refresh_report_state(self) -> dict[str, str]:
+        """Merge the rows ingested since the last report into the rollup tables.
+
+        Each rollup table without a materialized view holds the aggregate states of every row of
+        `reviews` up to its `ingest_ts` watermark, saved in `<output_dir>/.report_state.json`.
+        `ingest_ts` is stamped by the server when the insert runs, and the watermark stays
+        WATERMARK_SETTLE_SECONDS behind the newest row, so inserts still running are not skipped.
+        A refresh only aggregates the rows between the saved and the new watermark and inserts their
+        states, which the AggregatingMergeTree merges with the stored ones.
+
+        The states of a re-inserted review stay in the rollup after ReplacingMergeTree merged its
+        copies away, so counts drift above a full recompute until the next rebuild. Tables without
+        a saved watermark, rebuilt more than REBUILD_INTERVAL_DAYS ago, or all of them with
+        `full_rebuild`, are recomputed from `reviews FINAL`, i.e. one row per review. If a refresh
+        is interrupted between an insert and saving its watermark, run it again with `full_rebuild`.
+        """
+        database = clickhouse_config['db_name']
+        rollups = get_rollup_queries()
+        existing = self._existing_tables(set(rollups) | {f"{name}_mv" for name in rollups})
+        watermarks, rebuilt_at = ({}, {}) if self.full_rebuild else self._load_report_state()
+        rebuild_before = (datetime.now() - timedelta(days=REBUILD_INTERVAL_DAYS)).isoformat(timespec='seconds')
+        df = self.sql_query(
+            f"SELECT toString(least(max(ingest_ts), now() - INTERVAL {WATERMARK_SETTLE_SECONDS} SECOND)) AS watermark "
+            f"FROM {database}.reviews"
+        )
+        watermark = df.get_column('watermark')[0]
+        for name, rollup in rollups.items():
+            if f"{name}_mv" in existing:
+                # kept up to date by its materialized view (`ingest --rollups`)
+                watermarks.pop(name, None)
+                rebuilt_at.pop(name, None)
+                continue
+            previous = watermarks.get(name) if name in existing else None
+            if previous is not None and rebuilt_at.get(name, '') < rebuild_before:
+                logger.info(f"Rollup '{name}' was last rebuilt over {REBUILD_INTERVAL_DAYS} days ago, rebuilding it")
+                previous = None
+            if previous is not None and previous >= watermark:
+                self._watermarks[name] = previous
+                continue
+            start = time.perf_counter()
+            if previous is None:
+                self.sql_query(rollup['sql_create'])
+                self.sql_query(rollup['sql_truncate'])
+                # FINAL: the copies of a review ReplacingMergeTree has not merged yet count once
+                where = f" FINAL WHERE ingest_ts <= '{watermark}'"
+            else:
+                where = f" WHERE ingest_ts > '{previous}' AND ingest_ts <= '{watermark}'"
+            self.sql_query(f"INSERT INTO {database}.{name}{rollup['sql_select'].format(where=where)}")
+            if previous is None:
+                rebuilt_at[name] = datetime.now().isoformat(timespec='seconds')
+            # saved per table, so a failure later on keeps the tables already refreshed
+            watermarks[name] = self._watermarks[name] = watermark
+            self._save_report_state(watermarks, rebuilt_at)
+            logger.info(f"{'Rebuilt' if previous is None else 'Refreshed'} rollup '{name}' up to {watermark} "
+                        f"in {time.perf_counter() - start:.2f}s")
+        self._save_report_state(watermarks, rebuilt_at)
+        return watermarks
+
+    def _with_tail(self, sql: str, table: str) -> str:
+        """Rollup query over the stored states plus the states of the rows above the table's watermark"""
+        database = clickhouse_config['db_name']
+        tail = get_rollup_queries()[table]['sql_select'].format(
+            where=f" WHERE ingest_ts > '{self._watermarks[table]}'")
+        return sql.replace(f"FROM {database}.{table}", f"FROM (SELECT * FROM {database}.{table} UNION ALL{tail})")
+
+    def _approx_queries(self) -> dict[str, str]:
+        sample = self._can_sample()
+        fraction = self.sample_fraction if sample else 1.0
+        if self.sample_fraction < 1 and not sample:
+            logger.warning("reviews has no sampling key on user_id, approximate report reads every row")
+        queries = {}
+        for name, spec in approx_queries.items():
+            sampled = spec['sampled'] and fraction < 1
+            queries[name] = spec['sql'].format(sample=f"SAMPLE {fraction}" if sampled else '',
+                                               scale=1 / fraction if sampled else 1)
+            self._approximated[name] = fraction if sampled else 1.0
+        logger.info(f"Approximate report: {len(queries)} queries are estimated"
+                    + (f", sampled ones read {fraction:.0%} of reviews" if fraction < 1 else ""))
+        return queries
+
+    def _can_sample(self) -> bool:
+        """Sampled counts only scale back up when whole users are sampled"""
+        try:
+            df = self.sql_query(
+                f"SELECT sampling_key FROM system.tables "
+                f"WHERE database = '{clickhouse_config['db_name']}' AND name = 'reviews'"
+            )
+        except Exception as e:
+            logger.warning(f"Could not read the sampling key of reviews: {e}")
+            return False
+        return 'sampling_key' in df.columns and any('user_id' in (key or '') for key in df.get_column('sampling_key'))
+
+    def _with_error_bounds(self, name: str, df: pl.DataFrame) -> pl.DataFrame:
+        """Add a `<metric>_error` column (95% interval, +/-) next to every approximated metric"""
+        fraction = self._approximated[name]
+        bounds = []
+        for column, kind in approx_queries[name]['metrics'].items():
+            if column not in df.columns:
+                continue
+            value = pl.col(column).cast(pl.Float64)
+            # binomial error of a count scaled up from the sampled rows (zero without sampling)
+            variance = (1 - fraction) / (value * fraction).clip(lower_bound=1)
+            if kind == 'uniq':
+                variance = variance + UNIQ_COMBINED_ERROR ** 2
+            bounds.append((ERROR_Z * variance.sqrt() * value).round(1).alias(f"{column}_error"))
+        df = df.with_columns(bounds)
+        if len(df) == 1:
+            for column in approx_queries[name]['metrics']:
+                if f"{column}_error" in df.columns:
+                    logger.info(f"{name}: {column} ~ {df[column][0]} +/- {df[f'{column}_error'][0]}")
+        return df
+
+    def _existing_tables(self, names: set[str]) -> set[str]:
+        try:
+            df = self.sql_query(
+                f"SELECT name FROM system.tables WHERE database = '{clickhouse_config['db_name']}' "
+                f"AND name IN ({', '.join(repr(name) for name in sorted(names))})"
+            )
+        except Exception as e:
+            logger.warning(f"Could not look up rollup tables, reading from raw tables: {e}")
+            return set()
+        return set(df.get_column('name').to_list()) & names if 'name' in df.columns else set()
+
+    @property
+    def data_versions(self) -> dict[str, str]:
+        """Data version of every table (`db.table`), taken once per report for the cache keys"""
+        if self._data_versions is None:
+            database = clickhouse_config['db_name']
+            try:
+                df = self.sql_query(data_versions_sql(database))
+                self._data_versions = {f"{database}.{table}": f"{rows}:{max_block}"
+                                       for table, rows, max_block in df.select('table', 'rows', 'max_block').rows()}
+            except Exception as e:
+                logger.warning(f"Could not read table versions, query results will not be cached: {e}")
+                self._data_versions = {}
+        return self._data_versions
+
+    def cached_sql_query(self, sql: str, db: ClickHouseDB | None = None) -> pl.DataFrame:
+        """`sql_query` through the result cache, optionally on another connection"""
+        key = self.cache.key(sql, self.data_versions) if self.cache else None
+        if key:
+            df = self.cache.get(key)
+            if df is not None:
+                logger.info(f"Query result read from cache ({len(df)} rows)")
+                return df
+        df = (db or self).sql_query(sql)
+        if key:
+            self.cache.put(key, df)
+        return df
+
+    def _acquire_connection(self) -> ClickHouseDB:
+        """Connections for concurrent queries; new ones are opened on demand and reused afterwards.
+        At most `concurrency` exist since that is the number of threads asking for them."""
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            return ClickHouseDB(writer=self.writer_name)
+
+    def fetch_query(self, name: str, db: ClickHouseDB | None = None) -> pl.DataFrame:
+        """Result of one analysis query, with error bounds when it is approximated"""
+        if self.local is not None:
+            return self.local.fetch(name)
+        df = self.cached_sql_query(self.queries[name], db)
+        if name in self._approximated:
+            df = self._with_error_bounds(name, df)
+        return df
+
+    def _run_query(self, name: str) -> tuple[QueryResult, float]:
+        db = self._acquire_connection()
+        start = time.perf_counter()
+        try:
+            result = self.fetch_query(name, db)
+        except Exception as e:
+            result = e
+        finally:
+            self._connections.put(db)
+        return result, time.perf_counter() - start
+
+    def _fusion_groups(self, names: list[str]) -> list[list[str]]:
+        """Queries answered by one fused scan, per table; rollup and approximate variants run on their own"""
+        if not self.fuse:
+            return []
+        by_table: dict[str, list[str]] = {}
+        for name in names:
+            part = fusable_queries.get(name)
+            if part is not None and self.queries[name] == analysis_sql_queries[name]:
+                by_table.setdefault(part.table, []).append(name)
+        return [group for group in by_table.values() if len(group) > 1]
+
+    def _run_fused(self, names: list[str]) -> dict[str, tuple[QueryResult, float]]:
+        parts = [fusable_queries[name] for name in names]
+        db = self._acquire_connection()
+        start = time.perf_counter()
+        try:
+            results = split_fused(self.cached_sql_query(fuse_sql(parts), db), parts)
+            for name, result in results.items():
+                if isinstance(result, FusionFallback):
+                    logger.info(f"Running {name} on its own: {result}")
+                    try:
+                        results[name] = self.fetch_query(name, db)
+                    except Exception as e:
+                        results[name] = e
+        except Exception as e:
+            # every fused query fails with the error of the scan, like it would on its own
+            results = {name: e for name in names}
+        finally:
+            self._connections.put(db)
+        seconds = time.perf_counter() - start
+        return {name: (results[name], seconds) for name in names}
+
+    def run_queries(self, names: list[str]) -> dict[str, QueryResult]:
+        """Run analysis queries concurrently, at most `concurrency` at a time.
+        Returns each query's frame, or the exception it raised; wall times go to `query_timings`."""
+        # also resolves the rollup tables once, before the threads start
+        unknown = [name for name in names if name not in self.queries]
+        if unknown:
+            logger.error(f"Unknown analysis queries: {unknown}")
+            raise ValueError(f"Unknown analysis queries: {unknown}")
+        if self.local is not None:
+            start = time.perf_counter()
+            done = self.local.run_queries(names)
+            results = {}
+            for name in names:
+                results[name], self.query_timings[name] = done[name]
+            self.query_timings['total_wall_time'] = time.perf_counter() - start
+            return results
+        if self.cache:
+            self.data_versions  # same for every query of the report
+        logger.info(f"Running {len(names)} report queries ({self.concurrency} at a time)...")
+        start = time.perf_counter()
+        results = {}
+        groups = self._fusion_groups(names)
+        fused = {name for group in groups for name in group}
+        with ThreadPoolExecutor(max_workers=max(self.concurrency, 1), thread_name_prefix='report-query') as executor:
+            jobs = []
+            for group in groups:
+                logger.info(f"Fusing {len(group)} queries into one scan: {', '.join(group)}")
+                jobs.append(executor.submit(self._run_fused, group))
+            for name in names:
+                if name not in fused:
+                    jobs.append(executor.submit(lambda name=name: {name: self._run_query(name)}))
+            done = {}
+            for job in jobs:
+                done.update(job.result())
+        for name in names:
+            results[name], self.query_timings[name] = done[name]
+        self.query_timings['total_wall_time'] = time.perf_counter() - start
+        if self.cache:
+            logger.info(f"Query cache: {self.cache.hits} hits, {self.cache.misses} misses ({self.cache.cache_dir})")
+        return results
+
+    def _query_result(self, name: str, results: dict[str, QueryResult] | None) -> pl.DataFrame:
+        """Result of a query fetched by `run_queries`, or run it now; re-raises the query's error"""
+        if results is None or name not in results:
+            return self.fetch_query(name)
+        if isinstance(results[name], Exception):
+            raise results[name]
+        return results[name]
+
+    def _log_query_timings(self) -> None:
+        logger.info("Report Query Timings")
+        logger.info("-" * 40)
+        for name, seconds in sorted(self.query_timings.items(), key=lambda item: -item[1]):
+            logger.info(f"{name:25} | {seconds:.3f}s")
+        logger.info("-" * 40 + "\n")
+
+    def basic_data_overview(self, results: dict[str, QueryResult] | None = None) -> dict[str, any]:
         """Get basic overview of the dataset"""
         logger.info("Starting basic data overview analysis...")
         overview = {}
         
-        for query in ['rating_distribution', 'total_reviews', 'unique_products', 'unique_users', 'date_range', 'verified_vs_unverified']:
+        for query in OVERVIEW_QUERIES:
             try:
-                df = self.sql_query(analysis_sql_queries[query])
+                df = self._query_result(query, results)
                 overview[query] = df.to_dicts()
                 logger.info(f"Fetched {query}: {len(df)} records")
             except Exception as e:
@@ -30,23 +432,23 @@ class AmazonReviewsAnalysis(ClickHouseDB):
                 overview[query] = None
         return overview
     
-    def analyze_product_popularity(self) -> pl.DataFrame:
+    def analyze_product_popularity(self, results: dict[str, QueryResult] | None = None) -> pl.DataFrame:
         """Analyze product popularity and ratings"""
         logger.info("Starting product popularity analysis...")
         try:
-            df = self.sql_query(analysis_sql_queries['product_popularity'])
+            df = self._query_result('product_popularity', results)
             logger.info(f"Fetched product popularity data: {len(df)} records")
             return df
         except Exception as e:
             logger.error(f"Error occurred while executing product popularity query: {e}")
             return pl.DataFrame()
         
-    def analyze_temporal_trends(self) -> pl.DataFrame:
+    def analyze_temporal_trends(self, results: dict[str, QueryResult] | None = None) -> pl.DataFrame:
         """Analyze temporal trends in reviews"""
         logger.info("Analyzing temporal trends...")
         
         try:
-            df = self.sql_query(analysis_sql_queries['temporal_trends'])
+            df = self._query_result('temporal_trends', results)
             # Create date column
             df = df.with_columns([
                 pl.date(pl.col("year"), pl.col("month"), 1).alias("date")
@@ -57,12 +459,12 @@ class AmazonReviewsAnalysis(ClickHouseDB):
             logger.error(f"Error occurred while executing temporal trends query: {e}")
             return pl.DataFrame()
         
-    def analyze_user_behavior(self) -> pl.DataFrame:
+    def analyze_user_behavior(self, results: dict[str, QueryResult] | None = None) -> pl.DataFrame:
         """Analyze user review behavior"""
         logger.info("Analyzing user behavior...")
         
         try:
-            df = self.sql_query(analysis_sql_queries['user_behavior'])
+            df = self._query_result('user_behavior', results)
             # Calculate metrics
             df = df.with_columns([
                 (pl.col("verified_purchases") / pl.col("total_reviews")).alias("verified_ratio"),
@@ -76,131 +478,80 @@ class AmazonReviewsAnalysis(ClickHouseDB):
             return pl.DataFrame()
         
     def create_visualizations(self, data_dict: dict):
-        """Create visualizations from analyzed data"""
+        """Create visualizations from analyzed data, one figure per worker process"""
         logger.info("Creating visualizations...")
-        
-        plt.style.use('seaborn-v0_8')
-        fig_size = (12, 8)
-        
+        fmt = self.image_format
+        figures = []  # (name, render function, args)
+
         # 1. Rating Distribution
         if 'rating_distribution' in data_dict and data_dict['rating_distribution']:
             rating_data = pl.from_records(data_dict['rating_distribution'])
+            figures.append(('rating_distribution', plots.render_rating_distribution,
+                            (rating_data, self.output_dir / f'rating_distribution.{fmt}', self.dpi)))
 
-            logger.info("Creating rating distribution plot...")
-            
-            fig, ax = plt.subplots(figsize=fig_size)
-            ax.bar(rating_data['rating'], rating_data['count'])
-            ax.set_xlabel('Rating')
-            ax.set_ylabel('Number of Reviews')
-            ax.set_title('Distribution of Review Ratings')
-            plt.tight_layout()
-            plt.savefig(self.output_dir / 'rating_distribution.png', dpi=300)
-            plt.close()
-            
         # 2. Product Popularity Analysis
-        if 'product_popularity' in data_dict:
-            prod_df: pl.DataFrame = data_dict['product_popularity']
-            
-            # Top products by review count
-            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
-            
-            top_20 = prod_df.head(20)
-            ax1.barh(range(len(top_20)), top_20['review_count'])
-            ax1.set_xlabel('Number of Reviews')
-            ax1.set_title('Top 20 Products by Review Count')
-            ax1.set_yticks(range(len(top_20)))
-            ax1.set_yticklabels(top_20['asin'].to_list())
-            
-            # Rating vs Review Count scatter
-            sample_df = prod_df.sample(n=min(1000, len(prod_df)))
-            ax2.scatter(sample_df['review_count'], sample_df['avg_rating'], alpha=0.6)
-            ax2.set_xlabel('Number of Reviews')
-            ax2.set_ylabel('Average Rating')
-            ax2.set_title('Average Rating vs Review Count')
-            
-            plt.tight_layout()
-            plt.savefig(self.output_dir / 'product_analysis.png', dpi=300)
-            plt.close()
-            
+        if 'product_popularity' in data_dict and not data_dict['product_popularity'].is_empty():
+            figures.append(('product_popularity', plots.render_product_analysis,
+                            (data_dict['product_popularity'], self.output_dir / f'product_analysis.{fmt}', self.dpi,
+                             self.density_threshold)))
+
         # 3. Temporal Trends
-        if 'temporal_trends' in data_dict:
-            temp_df = data_dict['temporal_trends']
-            
-            fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(15, 10))
-            
-            # Review count over time
-            ax1.plot(temp_df['date'], temp_df['review_count'])
-            ax1.set_xlabel('Date')
-            ax1.set_ylabel('Number of Reviews')
-            ax1.set_title('Review Count Over Time')
-            ax1.tick_params(axis='x', rotation=45)
-            
-            # Average rating over time
-            ax2.plot(temp_df['date'], temp_df['avg_rating'], color='red')
-            ax2.set_xlabel('Date')
-            ax2.set_ylabel('Average Rating')
-            ax2.set_title('Average Rating Over Time')
-            ax2.tick_params(axis='x', rotation=45)
-            
-            plt.tight_layout()
-            plt.savefig(self.output_dir / 'temporal_trends.png', dpi=300)
-            plt.close()
-            
+        if 'temporal_trends' in data_dict and not data_dict['temporal_trends'].is_empty():
+            figures.append(('temporal_trends', plots.render_temporal_trends,
+                            (data_dict['temporal_trends'], self.output_dir / f'temporal_trends.{fmt}', self.dpi)))
+
         # 4. User Behavior Analysis
-        if 'user_behavior' in data_dict:
-            user_df = data_dict['user_behavior']
-            
-            fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(15, 12))
-            
-            # Distribution of reviews per user
-            ax1.hist(user_df['total_reviews'], bins=30, edgecolor='black')
-            ax1.set_xlabel('Number of Reviews per User')
-            ax1.set_ylabel('Frequency')
-            ax1.set_title('Distribution of Reviews per User')
-            ax1.set_yscale('log')
-            
-            # Average rating distribution
-            ax2.hist(user_df['avg_rating'], bins=20, edgecolor='black')
-            ax2.set_xlabel('Average Rating per User')
-            ax2.set_ylabel('Frequency')
-            ax2.set_title('Distribution of Average Ratings per User')
-            
-            # Verified purchase ratio
-            ax3.hist(user_df['verified_ratio'], bins=20, edgecolor='black')
-            ax3.set_xlabel('Verified Purchase Ratio')
-            ax3.set_ylabel('Frequency')
-            ax3.set_title('Distribution of Verified Purchase Ratios')
-            
-            # Helpfulness vs Activity
-            ax4.scatter(user_df['total_reviews'], user_df['helpfulness_ratio'], alpha=0.6)
-            ax4.set_xlabel('Total Reviews')
-            ax4.set_ylabel('Helpfulness Ratio')
-            ax4.set_title('User Activity vs Helpfulness')
-            
-            plt.tight_layout()
-            plt.savefig(self.output_dir / 'user_behavior.png', dpi=300)
-            plt.close()
-        
-        logger.info(f"Visualizations saved to {self.output_dir}")
-            
+        if 'user_behavior' in data_dict and not data_dict['user_behavior'].is_empty():
+            figures.append(('user_behavior', plots.render_user_behavior,
+                            (data_dict['user_behavior'], self.output_dir / f'user_behavior.{fmt}', self.dpi,
+                             self.density_threshold)))
+
+        start = time.perf_counter()
+        # starting processes only pays off with a core for each of them
+        workers = min(self.render_workers, len(figures), os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = {name: executor.submit(render, *args) for name, render, args in figures}
+                for name, future in futures.items():
+                    self._log_rendered(name, future)
+        else:
+            for name, render, args in figures:
+                try:
+                    logger.info(f"Rendered {name} to {render(*args)}")
+                except Exception as e:
+                    logger.error(f"Error occurred while rendering '{name}': {e}")
+
+        logger.info(f"Visualizations saved to {self.output_dir} in {time.perf_counter() - start:.1f}s")
+
+    @staticmethod
+    def _log_rendered(name: str, future: Future) -> None:
+        try:
+            logger.info(f"Rendered {name} to {future.result()}")
+        except Exception as e:
+            logger.error(f"Error occurred while rendering '{name}': {e}")
+
     def main(self) -> None:
         data_dict = {}
-        
+
+        # All queries are independent scans, so they run concurrently up front
+        results = self.run_queries(REPORT_QUERIES)
+        self._log_query_timings()
+
         # Basic overview
         logger.info("Step 1: Basic data overview")
-        data_dict['basic_overview'] = self.basic_data_overview()
+        data_dict['basic_overview'] = self.basic_data_overview(results)
         
         # Product analysis
         logger.info("Step 2: Product popularity analysis")
-        data_dict['product_popularity'] = self.analyze_product_popularity()
+        data_dict['product_popularity'] = self.analyze_product_popularity(results)
         
         # Temporal trends
         logger.info("Step 3: Temporal trends analysis")
-        data_dict['temporal_trends'] = self.analyze_temporal_trends()
+        data_dict['temporal_trends'] = self.analyze_temporal_trends(results)
         
         # User behavior
         logger.info("Step 4: User behavior analysis")
-        data_dict['user_behavior'] = self.analyze_user_behavior()
+        data_dict['user_behavior'] = self.analyze_user_behavior(results)
         
         # Extract rating distribution for visualizations
         if 'basic_overview' in data_dict and data_dict['basic_overview'].get('rating_distribution'):
@@ -1,25 +1,148 @@
-import json
 import gzip
+import json
+import multiprocessing
+import queue
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 from typing import Iterator, Dict, Any, List
 
 
+import numpy as np
 import polars as pl
 
 
 from config.config import logger, clickhouse_config
 from src.utils.clickhouse import ClickHouseDB
-from src.sql.create_schema import get_sql_query
+from src.sql.create_schema import (get_distributed_query, get_layout_query, get_rollup_queries,
+                                   get_schema_migrations, get_sorting_key, get_sql_query, get_table_columns,
+                                   get_version_column)
+from src.utils.pipeline import Pipeline
+from src.utils.gzip_segments import (iter_segment_chunks, iter_segment_frames, iter_segment_records,
+                                     load_segment_index, resegment_file)
+from src.utils.batching import AdaptiveBatchSizer, FrameBuffer
+from src.utils.dead_letter import DeadLetterSink, claim_dead_letter, parse_dead_letter_name, read_dead_letter
+from src.utils.key_index import KeyIndex, expected_false_positives, hash_keys, make_entries, row_versions
+from src.utils.jsonl import (PARSE_ERROR_COLUMN, RAW_LINE_COLUMN, decode_json_line, decode_review_line,
+                             iter_byte_chunks, iter_line_chunks, parse_jsonl_chunk, skip_lines)
+from src.utils.manifest import FileCheckpoint, IngestManifest, untracked_checkpoint
+from src.utils.metrics import MetricsExporter, metrics
+from src.utils.profiling import peak_rss_mb
+from src.utils.staging import STAGE_PART_BYTES, ParquetStaging
+from src.utils.transform import compile_table_plan
+from src.utils.validation import REJECT_REASON_COLUMN, compile_table_validator
+from src.utils.writers import shard_stats
+
+INGEST_MODES = ['columnar', 'pipelined', 'records']
+
+# position of a record in its batch, to find the source dicts of rejected rows in records mode
+_ROW_INDEX = '_row'
 
 class AmazonReviewsIngestion(ClickHouseDB):
-    def __init__(self, data_folder: str="./src/data", batch_size: int = 5000):
-        super().__init__()
+    def __init__(self, data_folder: str="./src/data", batch_size: int = 5000, ingest_mode: str = 'columnar',
+                 workers: int = 1, inflight_inserts: int = 2, queue_size: int = 4, decode_workers: int = 1,
+                 resegment: bool = False, writer: str | None = None, use_manifest: bool = True,
+                 batch_bytes: int | None = None, image_batch_bytes: int | None = None,
+                 image_batch_size: int | None = None, rollups: bool = False, key_index: bool = True,
+                 stage: bool = False, distributed: bool = False,
+                 metrics_file: str | None = None, metrics_port: int | None = None, metrics_interval: float = 5.0):
+        super().__init__(writer=writer)
+        if ingest_mode not in INGEST_MODES:
+            raise ValueError(f"ingest_mode must be one of {INGEST_MODES}, got '{ingest_mode}'")
         self.data_folder = data_folder
         self.schema = clickhouse_config['db_name']
         self.batch_size = batch_size  # number of records to process in each batch
+        # 'columnar' decodes whole batches with Polars, 'pipelined' does the same with decompression,
+        # parsing, transforms and inserts overlapping in threads, 'records' is the original per-record path
+        self.ingest_mode = ingest_mode
+        self.workers = workers  # number of processes ingesting whole files in parallel
+        self.inflight_inserts = inflight_inserts  # concurrent inserts in pipelined mode
+        self.queue_size = queue_size  # batches buffered in front of each pipelined stage
+        self._insert_connections: queue.Queue | None = None
+        # processes inflating/parsing segments of one file; needs a segment index (see gzip_segments.py)
+        self.decode_workers = decode_workers
+        self.resegment = resegment  # build missing segment indexes before reading a file
+        self.reviews_table = get_sql_query("create_reviews_table")['table_name']
+        self.images_table = get_sql_query("review_images_table")['table_name']
+        # processed-file manifest: skip finished files, resume partial ones after the last committed batch
+        self.manifest = IngestManifest(data_folder) if use_manifest else None
+        # byte-budgeted, latency-tuned batch sizes per table; without a budget batches are `batch_size` records
+        self.batch_bytes = batch_bytes
+        self.image_batch_bytes = image_batch_bytes
+        # review_images rows per insert without a byte budget; images are buffered across review batches
+        self.image_batch_size = image_batch_size or batch_size
+        self.batch_sizers: Dict[str, AdaptiveBatchSizer] = {}
+        if batch_bytes:
+            self.batch_sizers = {
+                self.reviews_table: AdaptiveBatchSizer(self.reviews_table, batch_bytes,
+                                                       max_rows=clickhouse_config['max_chunk']),
+                self.images_table: AdaptiveBatchSizer(self.images_table, image_batch_bytes or batch_bytes,
+                                                      max_rows=clickhouse_config['max_chunk']),
+            }
+        # live metrics while ingesting a folder: JSON stats file and/or Prometheus endpoint (see metrics.py)
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
+        self.metrics_interval = metrics_interval
+        # one vectorized transform plan per table, derived from create_schema.py
+        self.transform_plans = {
+            plan.table_name: plan
+            for plan in (compile_table_plan("create_reviews_table"), compile_table_plan("review_images_table"))
+        }
+        # batch validation derived from the same DDL; rejected rows go to <data_folder>/.dead_letter/
+        self.validators = {
+            validator.table_name: validator
+            for validator in (compile_table_validator("create_reviews_table"),
+                              compile_table_validator("review_images_table"))
+        }
+        self.dead_letters = DeadLetterSink(data_folder)
+        # create the report rollup tables and their materialized views along with the tables
+        self.rollups = rollups
+        # parsed copies of the source files as Parquet, read instead of the .jsonl.gz once they exist
+        # (see staging.py); records mode always decodes the JSON itself
+        if stage and ingest_mode == 'records':
+            logger.warning("Records mode does not read Parquet stages, decoding the source files")
+        # a stage part holds about one --batch_bytes batch before it is written
+        self.staging = (ParquetStaging(part_bytes=batch_bytes or STAGE_PART_BYTES)
+                        if stage and ingest_mode != 'records' else None)
+        # with the sharded writer, also create Distributed tables over the shards (CLICKHOUSE_CLUSTER)
+        self.distributed = distributed
+        # hashed sorting keys and versions of the rows already inserted, to drop rows ReplacingMergeTree
+        # would replace anyway before they reach ClickHouse (see key_index.py)
+        self.key_indexes: Dict[str, KeyIndex] = {}
+        if key_index:
+            for key in ("create_reviews_table", "review_images_table"):
+                table = get_sql_query(key)['table_name']
+                columns = get_table_columns(key)
+                names = {column['name'] for column in columns}
+                # plain columns only, e.g. not the cityHash64(user_id) of a sampling key
+                key_columns = [column for column in get_sorting_key(key) if column in names]
+                stamped = [column['name'] for column in columns if (column['default'] or '').lower() == 'now()']
+                self.key_indexes[table] = KeyIndex(data_folder, table, key_columns,
+                                                   version_column=get_version_column(key), ignore_columns=stamped)
     
+    def _worker_settings(self) -> Dict[str, Any]:
+        """Constructor arguments for the ingestion instance living in each worker process"""
+        return {
+            'data_folder': self.data_folder,
+            'batch_size': self.batch_size,
+            'ingest_mode': self.ingest_mode,
+            'inflight_inserts': self.inflight_inserts,
+            'queue_size': self.queue_size,
+            'decode_workers': self.decode_workers,
+            'resegment': self.resegment,
+            'writer': self.writer_name,
+            'use_manifest': self.manifest is not None,
+            'batch_bytes': self.batch_bytes,
+            'image_batch_bytes': self.image_batch_bytes,
+            'image_batch_size': self.image_batch_size,
+            'key_index': bool(self.key_indexes),
+            'stage': self.staging is not None,
+            # workers send their metrics back with each file's stats, only the parent exports them
+        }
+
     def create_table_if_not_exists(self, action_query: str) -> None:
         logger.info(f"Creating database 'amazon' if not exists")
         database_query = get_sql_query("create_database")
@@ -32,22 +155,273 @@ class AmazonReviewsIngestion(ClickHouseDB):
         self.sql_query(create_table_query['sql_create'])
         logger.info(f"Table '{create_table_query['table_name']}' is ready.")
         
-    def read_jsonl_gz_file(self, file_path: str) -> Iterator[Dict[str, Any]]:
-        """Read compressed JSONL file and yield records"""
+    def migrate_table(self, action_query: str) -> None:
+        """Apply the schema migrations of a table whose columns are missing (see create_schema.py)"""
+        migrations = get_schema_migrations(action_query)
+        if not migrations:
+            return
+        table_name = get_sql_query(action_query)['table_name']
+        existing = self.sql_query(
+            f"SELECT name FROM system.columns WHERE database = '{self.schema}' AND table = '{table_name}'"
+        )
+        columns = set(existing.get_column('name').to_list()) if 'name' in existing.columns else set()
+        for column, sql_migrate in migrations:
+            if column in columns:
+                continue
+            logger.info(f"Adding column '{column}' to table '{table_name}'")
+            self.sql_query(sql_migrate)
+
+    def create_shard_tables(self) -> None:
+        """Database and tables on every host of the sharded writer, which inserts into them directly.
+        Shards get the current DDL; the schema migrations only run on CLICKHOUSE_HOST."""
+        for key in ("create_database", "create_reviews_table", "review_images_table"):
+            query = get_sql_query(key)
+            logger.info(f"Creating {query['table_name'] if isinstance(query, dict) else 'database'} "
+                        f"on {len(self.writer.shards)} shards if not exists")
+            self.writer.execute(query['sql_create'] if isinstance(query, dict) else query)
+
+    def create_distributed_tables(self) -> None:
+        """`reviews_all` and `review_images_all` over the tables of every shard, for querying a sharded
+        ingest from any host of the cluster, CLICKHOUSE_HOST included"""
+        cluster = clickhouse_config['cluster']
+        if not cluster:
+            logger.error("Distributed tables need the cluster of the shards in CLICKHOUSE_CLUSTER")
+            raise ValueError("Distributed tables need the cluster of the shards in CLICKHOUSE_CLUSTER")
+        for key in ("create_reviews_table", "review_images_table"):
+            query = get_distributed_query(key, cluster, self.writer.shard_key)
+            logger.info(f"Creating distributed table '{query['table_name']}' on cluster '{cluster}' if not exists")
+            self.writer.execute(query['sql_create'])
+            self.sql_query(query['sql_create'])
+
+    def create_rollups(self) -> None:
+        """Rollup tables for the report and the materialized views feeding them on every insert"""
+        for rollup in get_rollup_queries().values():
+            logger.info(f"Creating rollup '{rollup['table_name']}' if not exists")
+            self.sql_query(rollup['sql_create'])
+            self.sql_query(rollup['sql_view'])
+
+    def backfill_rollups(self) -> None:
+        """Rebuild the rollups from the rows already in `reviews`.
+        Run it while nothing is ingesting: rows inserted during the rebuild can be counted twice."""
+        self.create_table_if_not_exists("create_reviews_table")
+        self.create_rollups()
+        for rollup in get_rollup_queries().values():
+            start = time.perf_counter()
+            logger.info(f"Backfilling rollup '{rollup['table_name']}'")
+            self.sql_query(rollup['sql_truncate'])
+            self.sql_query(rollup['sql_backfill'])
+            logger.info(f"Backfilled rollup '{rollup['table_name']}' in {time.perf_counter() - start:.1f}s")
+
+    def migrate_layout(self, profile: str) -> None:
+        """Rebuild reviews and review_images in a layout profile of create_schema.py.
+
+        Each table is copied into a new table with the profile's layout, which then swaps places with
+        the old one (EXCHANGE TABLES). The old data is kept as `<table>_before_<profile>_<time>` until
+        dropped by hand. Run it while nothing is ingesting: rows inserted during the copy stay in the
+        old table.
+        """
+        get_layout_query("create_reviews_table", profile)  # fail on an unknown profile before copying anything
+        suffix = datetime.now().strftime('%Y%m%d%H%M%S')
+        for key in ("create_reviews_table", "review_images_table"):
+            self.create_table_if_not_exists(key)
+            self.migrate_table(key)
+            table_name = get_sql_query(key)['table_name']
+            new_table = f"{table_name}_{profile}_layout"
+            columns = ', '.join(column['name'] for column in get_table_columns(key))
+            start = time.perf_counter()
+            logger.info(f"Copying '{table_name}' into the '{profile}' layout")
+            self.sql_query(f"DROP TABLE IF EXISTS {self.schema}.{new_table}")  # left over by an interrupted run
+            self.sql_query(get_layout_query(key, profile, new_table))
+            # no merges until the row counts are compared, they would collapse duplicates in the copy only
+            self.sql_query(f"SYSTEM STOP MERGES {self.schema}.{new_table}")
+            self.sql_query(
+                f"INSERT INTO {self.schema}.{new_table} ({columns}) SELECT {columns} FROM {self.schema}.{table_name}"
+            )
+            counts = self.sql_query(
+                f"SELECT (SELECT count() FROM {self.schema}.{table_name}) AS old_rows, "
+                f"(SELECT count() FROM {self.schema}.{new_table}) AS new_rows"
+            )
+            old_rows, new_rows = counts.row(0)
+            self.sql_query(f"SYSTEM START MERGES {self.schema}.{new_table}")
+            if old_rows != new_rows:
+                logger.error(f"Copy of '{table_name}' has {new_rows} rows instead of {old_rows}, keeping the old layout")
+                raise RuntimeError(f"Copy of '{table_name}' has {new_rows} rows instead of {old_rows}")
+            self.sql_query(f"EXCHANGE TABLES {self.schema}.{table_name} AND {self.schema}.{new_table}")
+            self.sql_query(f"RENAME TABLE {self.schema}.{new_table} TO {self.schema}.{table_name}_before_{profile}_{suffix}")
+            logger.info(f"Migrated {new_rows} rows of '{table_name}' to the '{profile}' layout in "
+                        f"{time.perf_counter() - start:.1f}s, old table kept as '{table_name}_before_{profile}_{suffix}'")
+        for key_index in self.key_indexes.values():
+            # the index belongs to the old tables, see check_key_indexes
+            key_index.clear()
+            key_index.table_uuid = None
+        if self.key_indexes:
+            logger.info("Cleared the key indexes, run build_key_index to index the migrated rows")
+        # the rollup views were attached to the old reviews table
+        live_views = self.sql_query(
+            f"SELECT name FROM system.tables WHERE database = '{self.schema}' AND engine = 'MaterializedView'"
+        )
+        views = set(live_views.get_column('name').to_list()) if 'name' in live_views.columns else set()
+        for rollup in get_rollup_queries().values():
+            if f"{rollup['table_name']}_mv" in views:
+                logger.info(f"Re-attaching rollup view '{rollup['table_name']}_mv' to the migrated reviews")
+                self.sql_query(f"DROP VIEW IF EXISTS {self.schema}.{rollup['table_name']}_mv")
+                self.sql_query(rollup['sql_view'])
+
+    def _table_identity(self, table: str) -> tuple[str | None, int | None]:
+        """UUID and row count of a table, (None, None) if it does not exist"""
+        df = self.sql_query(f"SELECT toString(uuid) AS uuid, total_rows FROM system.tables "
+                            f"WHERE database = '{self.schema}' AND name = '{table}'")
+        if df.is_empty() or 'uuid' not in df.columns:
+            return None, None
+        return df.get_column('uuid')[0], df.get_column('total_rows')[0]
+
+    def check_key_indexes(self) -> None:
+        """Start the key index of a table over when the table was recreated (new UUID) or emptied since
+        its rows were indexed; otherwise their next copy would be dropped and never reach the table"""
+        if self.writer_name == 'sharded':
+            return  # the rows are in the tables of the shards, not of CLICKHOUSE_HOST
+        for table, key_index in self.key_indexes.items():
+            uuid, rows = self._table_identity(table)
+            if uuid is None:
+                continue
+            indexed_uuid = key_index.table_uuid
+            if len(key_index) and ((indexed_uuid is not None and indexed_uuid != uuid) or rows == 0):
+                logger.warning(f"'{table}' was recreated or emptied since its key index was built, starting a new index")
+                key_index.clear()
+            if indexed_uuid != uuid:
+                key_index.table_uuid = uuid
+
+    def _segment_index(self, file_path: str) -> Dict[str, Any] | None:
+        """Segment index to read `file_path` with several decode workers, if that is enabled"""
+        if self.decode_workers <= 1:
+            return None
+        index = load_segment_index(file_path)
+        if index is None and self.resegment:
+            index = resegment_file(file_path, workers=self.decode_workers)
+        return index
+
+    def read_jsonl_gz_file(self, file_path: str, skip_records: int = 0) -> Iterator[Dict[str, Any]]:
+        """Read compressed JSONL file and yield records, starting after the first `skip_records`"""
         try:
+            index = self._segment_index(file_path)
+            if index:
+                yield from iter_segment_records(file_path, index, self.decode_workers, skip_records)
+                return
             with gzip.open(file_path, 'rt', encoding='utf-8') as f:
+                skip_lines(f, skip_records)
                 for line in f:
-                    yield json.loads(line)
+                    yield decode_review_line(line)
+        except Exception as e:
+            logger.error(f"Error reading file {file_path}: {e}")
+            raise
+
+    def _rows_per_batch(self) -> int:
+        sizer = self.batch_sizers.get(self.reviews_table)
+        return sizer.rows_hint() if sizer else self.batch_size
+
+    def read_jsonl_gz_chunks(self, file_path: str, skip_records: int = 0) -> Iterator[bytes]:
+        """Decompress a JSONL file and yield raw chunks of `batch_size` lines, or of the current
+        byte budget of the reviews table when batches are byte-budgeted"""
+        try:
+            index = self._segment_index(file_path)
+            if index:
+                chunks = iter_segment_chunks(file_path, index, self._rows_per_batch, self.decode_workers, skip_records)
+                yield from self._count_raw_bytes(chunks)
+                return
+            with gzip.open(file_path, 'rb') as f:
+                skip_lines(f, skip_records)
+                sizer = self.batch_sizers.get(self.reviews_table)
+                if sizer:
+                    chunks = iter_byte_chunks(f, sizer.raw_bytes_hint, sizer.max_rows)
+                else:
+                    chunks = iter_line_chunks(f, self.batch_size)
+                yield from self._count_raw_bytes(chunks)
         except Exception as e:
             logger.error(f"Error reading file {file_path}: {e}")
             raise
+
+    def _count_raw_bytes(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in metrics.timed_iter(chunks, 'ingest_stage_seconds', stage='decompress'):
+            metrics.inc('ingest_raw_bytes_total', len(chunk))
+            yield chunk
+
+    def parse_chunk(self, chunk: bytes) -> pl.DataFrame:
+        """Decode a chunk of raw JSON lines into a Polars frame"""
+        with metrics.timer('ingest_stage_seconds', stage='parse'):
+            df = parse_jsonl_chunk(chunk)
+        metrics.inc('ingest_records_read_total', len(df))
+        sizer = self.batch_sizers.get(self.reviews_table)
+        if sizer:
+            sizer.observe_input(len(chunk), df.estimated_size(), len(df))
+        return df
+
+    def read_jsonl_gz_batches(self, file_path: str, skip_records: int = 0) -> Iterator[pl.DataFrame]:
+        """Read compressed JSONL file and yield Polars frames of `batch_size` records"""
+        index = self._segment_index(file_path)
+        if index:
+            # segments are inflated and parsed in the decode worker processes, timed together as 'decode'
+            frames = iter_segment_frames(file_path, index, self._rows_per_batch, self.decode_workers, skip_records)
+            for df in metrics.timed_iter(frames, 'ingest_stage_seconds', stage='decode'):
+                metrics.inc('ingest_records_read_total', len(df))
+                yield df
+            return
+        for chunk in self.read_jsonl_gz_chunks(file_path, skip_records):
+            yield self.parse_chunk(chunk)
         
+    def read_source_batches(self, file_path: str, skip_records: int = 0) -> Iterator[pl.DataFrame]:
+        """Parsed frames of a source file: from its Parquet stage when staging is on and the stage
+        exists, otherwise decoded from the .jsonl.gz and, on a read from the start, staged on the way"""
+        if self.staging is None:
+            yield from self.read_jsonl_gz_batches(file_path, skip_records)
+            return
+        stage_dir = self.staging.find(file_path)
+        if stage_dir is not None:
+            logger.info(f"Reading {file_path} from its stage {stage_dir}")
+            yield from self.staging.iter_frames(stage_dir, self._rows_per_batch, skip_records)
+            return
+        if skip_records:
+            # a stage needs the whole file, it is written on the next full read
+            yield from self.read_jsonl_gz_batches(file_path, skip_records)
+            return
+        writer = self.staging.writer(file_path)
+        try:
+            for df in self.read_jsonl_gz_batches(file_path):
+                writer.write(df)
+                yield df
+        except BaseException:
+            # also when the consumer stops early, a partial stage is never used
+            writer.abort()
+            raise
+        writer.finish()
+
+    def stage_file(self, file_path: str) -> int:
+        """Write the Parquet stage of a source file without ingesting it; returns its record count"""
+        if self.staging.find(file_path) is not None:
+            logger.info(f"{file_path} is already staged")
+            return 0
+        return sum(len(df) for df in self.read_source_batches(file_path))
+
+    def stage_data_folder(self) -> None:
+        """Stage every source file of the data folder, `workers` files at a time"""
+        files = sorted(Path(self.data_folder).rglob('*.jsonl.gz'), key=lambda path: path.stat().st_size, reverse=True)
+        start = time.perf_counter()
+        if self.workers > 1 and len(files) > 1:
+            settings = self._worker_settings()
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(files)),
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_ingest_worker, initargs=(settings,)) as executor:
+                records = sum(executor.map(_stage_file_in_worker, [str(file_path) for file_path in files]))
+        else:
+            records = sum(self.stage_file(str(file_path)) for file_path in files)
+        logger.info(f"Staged {records} records from {len(files)} files in {time.perf_counter() - start:.1f}s")
+
     def _check_with_temp_table(self, batch_data: List[Dict[str, Any]], table: str) -> set:
         """Use temporary table approach for large batches"""
         # WARNING: This function is deprecated and not currently used.
         # It is kept here for reference and potential future use.
         # I switch the table design to ReplacingMergeTree to handle deduplication
         # instead of manually checking for existing records.
+        # Duplicates are now dropped before the insert by the key index (see src/utils/key_index.py).
         
         logger.info(f"Checking existing records using stg_pivot table for batch of size {len(batch_data)}")
         try:
@@ -97,13 +471,8 @@ class AmazonReviewsIngestion(ClickHouseDB):
             logger.error(f"Error in temp table check: {e}")
             raise
         
-    def date_format(self, date_int: int):
-        # convert "timestamp": 1598567408138 to datetime
-        return datetime.fromtimestamp(date_int / 1000)
-        
     def insert_batch(self, batch_data: List[Dict[str, Any]], table: str) -> int:
         """Insert a batch of records into the database"""
-        logger.info(f"Inserting batch of size {len(batch_data)} into '{table}'")
         if not batch_data:
             return 0
                 
@@ -126,139 +495,512 @@ class AmazonReviewsIngestion(ClickHouseDB):
             
             
             df = pl.DataFrame(batch_data)
-            new_records = len(batch_data)
             del batch_data  # free up memory
-            if table == 'reviews':
-                # Data type conversions
-                boolean_columns = ['verified_purchase']
-                for col in boolean_columns:
-                    if col in df.columns:
-                        df = df.with_columns(pl.col(col).cast(pl.Boolean))
-
-                if "rating" in df.columns:
-                    df = df.with_columns(pl.col("rating").cast(pl.UInt8))
-
-                if "helpful_vote" in df.columns:
-                    df = df.with_columns(
-                        pl.when(
-                            (pl.col("helpful_vote").cast(pl.Utf8).str.strip_chars() == "") |
-                            (pl.col("helpful_vote").cast(pl.Utf8).str.to_lowercase() == "null")
-                        )
-                        .then(None)
-                        .otherwise(pl.col("helpful_vote").cast(pl.Int64))
-                        .alias("helpful_vote")
-                    )
-    
-                # timestamp conversion
-                df = df.with_columns(
-                    pl.col('timestamp').map_elements(
-                        self.date_format, 
-                        return_dtype=pl.Datetime,
-                        skip_nulls=True  # optional: skip null values
-                    )
-                )
+            return self.insert_df(df, table)
             
-            # add ingest_ts column (referer to the date of ingestion)
-            df = df.with_columns(pl.lit(datetime.now()).alias('ingest_ts'))
+        except Exception as e:
+            logger.error(f"Error inserting batch: {e}")
+            raise
+
+    def insert_df(self, df: pl.DataFrame, table: str) -> int:
+        """Insert a batch of records already held in a Polars DataFrame"""
+        logger.info(f"Inserting batch of size {len(df)} into '{table}'")
+        if df.is_empty():
+            return 0
 
-            self.sql_write_df(df=df, table_name=table, schema=self.schema)
-            del df  # free up memory
-            logger.info(f"Inserted {new_records} new records into '{table}'.")
-            return new_records
+        try:
+            return self.write_df(self.transform_df(df, table), table)
             
         except Exception as e:
             logger.error(f"Error inserting batch: {e}")
             raise
+
+    def validate_df(self, df: pl.DataFrame, table: str, source: str,
+                    records: List[Dict[str, Any]] | None = None) -> tuple[pl.DataFrame, int]:
+        """Split off invalid rows into the dead-letter file of `source`; returns the valid rows
+        and how many were rejected. `records` are the dicts `df` was built from (records mode),
+        rejected ones are kept verbatim as JSON in `_raw` since their frame columns may be lossy."""
+        if records is not None:
+            df = df.with_row_index(_ROW_INDEX)
+        with metrics.timer('ingest_stage_seconds', stage='validate', table=table):
+            valid, rejected = self.validators[table].split(df)
+        if records is not None:
+            valid = valid.drop(_ROW_INDEX)
+            rejected = pl.DataFrame({
+                RAW_LINE_COLUMN: [records[i].get(RAW_LINE_COLUMN) or json.dumps(records[i], default=str)
+                                  for i in rejected.get_column(_ROW_INDEX)],
+                REJECT_REASON_COLUMN: rejected.get_column(REJECT_REASON_COLUMN),
+            }, schema={RAW_LINE_COLUMN: pl.Utf8, REJECT_REASON_COLUMN: pl.Utf8})
+        if rejected.is_empty():
+            return valid, 0
+        if PARSE_ERROR_COLUMN in rejected.columns:
+            rejected = rejected.drop(PARSE_ERROR_COLUMN)  # already part of the reject reason
+        self.dead_letters.write(source, table, rejected)
+        metrics.inc('ingest_rejected_total', len(rejected), table=table)
+        return valid, len(rejected)
+
+    def transform_df(self, df: pl.DataFrame, table: str) -> pl.DataFrame:
+        """Casts and epoch-millis -> UTC DateTime, compiled from the table DDL; ingest_ts is left to the server"""
+        with metrics.timer('ingest_stage_seconds', stage='transform', table=table):
+            return self.transform_plans[table].apply(df)
+
+    def write_df(self, df: pl.DataFrame, table: str, db: ClickHouseDB | None = None) -> int:
+        """Write an already transformed frame, optionally through another connection"""
+        if df.is_empty():
+            return 0
+        key_index = self.key_indexes.get(table)
+        if key_index is not None:
+            total = len(df)
+            df, entries = key_index.filter_new(df)
+            metrics.inc('ingest_key_lookups_total', total, table=table)
+            if len(df) < total:
+                metrics.inc('ingest_duplicates_total', total - len(df), table=table)
+                logger.info(f"Dropped {total - len(df)} rows already in '{table}'")
+            if df.is_empty():
+                return 0
+        new_records = len(df)
+        sizer = self.batch_sizers.get(table)
+        start = time.perf_counter()
+        # a byte-budgeted batch goes out as one insert (one part), the sizer already caps its rows
+        max_chunk = max(new_records, clickhouse_config['max_chunk']) if sizer else clickhouse_config['max_chunk']
+        try:
+            (db or self).sql_write_df(df=df, table_name=table, schema=self.schema, max_chunk=max_chunk)
+        except Exception:
+            metrics.inc('ingest_errors_total', stage='insert', table=table)
+            raise
+        if key_index is not None:
+            key_index.add(entries)  # only once the rows are in, a failed insert is retried in full
+        seconds = time.perf_counter() - start
+        frame_bytes = df.estimated_size()
+        metrics.observe('ingest_insert_seconds', seconds, table=table)
+        metrics.inc('ingest_rows_total', new_records, table=table)
+        metrics.inc('ingest_bytes_total', frame_bytes, table=table)
+        if sizer:
+            sizer.observe_insert(new_records, frame_bytes, seconds)
+        del df  # free up memory
+        logger.info(f"Inserted {new_records} new records into '{table}'.")
+        return new_records
+
+    def _acquire_insert_connection(self) -> ClickHouseDB:
+        """Connections for pipelined inserts; one per insert in flight, reused across files"""
+        if self.inflight_inserts <= 1 or self.writer.thread_safe:
+            # thread safe writers check out their own pooled connection per insert
+            return self
+        if self._insert_connections is None:
+            self._insert_connections = queue.Queue()
+            for _ in range(self.inflight_inserts):
+                self._insert_connections.put(ClickHouseDB(writer=self.writer_name))
+        return self._insert_connections.get()
+
+    def _release_insert_connection(self, db: ClickHouseDB) -> None:
+        if db is not self:
+            self._insert_connections.put(db)
         
-    def data_modeling(self, record: Dict[str, Any]) -> tuple:
+    def data_modeling(self, record: Dict[str, Any]) -> tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Split a record into its review and one review_images row per attachment"""
         logger.debug(f"Modeling record with asin: {record.get('asin', 'N/A')}")
-        images = record.pop('images', [])
-        if not images:
-            return record, None
-        images: dict = images[0]
-        record['text'] = record['text'].replace('<br /><br />', '\n')
-        images_data = {
-            'asin': record.get('asin', ''),
-            'parent_asin': record.get('parent_asin', ''),
-            'user_id': record.get('user_id', ''),
-            'small_image_url': images['small_image_url'],
-            'medium_image_url': images['medium_image_url'],
-            'large_image_url': images['large_image_url'],
-            'attachment_type': images['attachment_type']
-        }
-        logger.debug(f"Extracted image data for asin: {record.get('asin', 'N/A')}")
+        images = record.pop('images', None)
+        if isinstance(record.get('text'), str):
+            record['text'] = record['text'].replace('<br /><br />', '\n')
+        if not images or not isinstance(images, list):
+            return record, []
+        # missing fields stay None and are rejected by the batch validation
+        images_data = [
+            {
+                'asin': record.get('asin', ''),
+                'parent_asin': record.get('parent_asin', ''),
+                'user_id': record.get('user_id', ''),
+                'image_position': position,
+                'small_image_url': image.get('small_image_url'),
+                'medium_image_url': image.get('medium_image_url'),
+                'large_image_url': image.get('large_image_url'),
+                'attachment_type': image.get('attachment_type')
+            }
+            for position, image in enumerate(images)
+            if isinstance(image, dict)
+        ]
+        logger.debug(f"Extracted {len(images_data)} images for asin: {record.get('asin', 'N/A')}")
         return record, images_data
 
-    def ingest_file(self, file_path: str) -> Dict[str, int]:
-        """Ingest a single file"""
-        logger.info(f"Starting ingestion for file: {file_path}")
-        start_time = datetime.now()
-        stats = {
+    def model_batch(self, df: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame]:
+        """Columnar counterpart of `data_modeling` for a whole batch"""
+        with metrics.timer('ingest_stage_seconds', stage='data_modeling'):
+            # one row per attachment, numbered by its position in the review's images list
+            images_df = (
+                df.select('asin', 'parent_asin', 'user_id', 'images')
+                .filter(pl.col('images').list.len() > 0)
+                .with_columns(pl.int_ranges(pl.col('images').list.len()).alias('image_position'))
+                .explode('images', 'image_position')
+                .unnest('images')
+                .select('asin', 'parent_asin', 'user_id', 'image_position', pl.exclude('asin', 'parent_asin',
+                                                                                       'user_id', 'image_position'))
+            )
+            reviews_df = df.drop('images').with_columns(
+                pl.col('text').str.replace_all('<br /><br />', '\n', literal=True)
+            )
+        return reviews_df, images_df
+
+    def _log_file_stats(self, file_path: str, stats: Dict[str, Any], start_time: datetime) -> None:
+        end_time = datetime.now()
+        duration = (end_time - start_time).total_seconds()
+        stats['rows_per_sec'] = round(stats['total_processed'] / duration, 1) if duration > 0 else 0.0
+        stats['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        logger.info(f"Ingestion completed for {file_path}\n")
+        logger.info(f"Duration: {duration} seconds\n")
+        logger.info(f"Ingestion Stats ({self.ingest_mode} mode)")
+        logger.info("-" * 30)
+        for k, v in stats.items():
+            logger.info(f"{k:20} | {v}")
+        for table, sizer in self.batch_sizers.items():
+            logger.info(f"{table + ' batches':20} | " + ", ".join(f"{k}={v}" for k, v in sizer.to_dict().items()))
+        logger.info("-" * 30 + "\n")
+
+    def _new_file_stats(self) -> Dict[str, int]:
+        return {
             'total_processed': 0,
             'total_inserted': 0,
             'batches_processed': 0,
             'images_processed': 0,
+            'rejected': 0,
             'errors': 0
         }
-        reviews_table = get_sql_query("create_reviews_table")['table_name']
-        images_table = get_sql_query("review_images_table")['table_name']
-        
+
+    @staticmethod
+    def _source_name(file_path: str) -> str:
+        """File name without the .jsonl.gz suffix, names the dead-letter files of a source"""
+        return Path(file_path).name.removesuffix('.jsonl.gz')
+
+    def _file_checkpoint(self, file_path: str) -> FileCheckpoint:
+        tables = [self.reviews_table, self.images_table]
+        if self.manifest is None:
+            return untracked_checkpoint(file_path, tables)
+        return self.manifest.checkpoint(file_path, tables)
+
+    def ingest_file(self, file_path: str) -> Dict[str, int]:
+        """Ingest a single file, resuming after the last committed batch of a previous run"""
+        checkpoint = self._file_checkpoint(file_path)
+        for key_index in self.key_indexes.values():
+            key_index.refresh()  # keys inserted by the other workers so far
+        lookups, dropped = self._key_index_counters()
+        try:
+            if self.ingest_mode == 'columnar':
+                stats = self.ingest_file_columnar(file_path, checkpoint)
+            elif self.ingest_mode == 'pipelined':
+                stats = self.ingest_file_pipelined(file_path, checkpoint)
+            else:
+                stats = self.ingest_file_records(file_path, checkpoint)
+        finally:
+            for key_index in self.key_indexes.values():
+                key_index.flush()
+        stats['key_lookups'], stats['duplicates'] = (now - before for now, before in
+                                                     zip(self._key_index_counters(), (lookups, dropped)))
+
+        if stats.pop('failed', False):
+            # the manifest keeps the last committed offset, the next run resumes from there
+            checkpoint.fail(stats.pop('error', 'unknown error'))
+            metrics.inc('ingest_errors_total', stage='file')
+            metrics.inc('ingest_files_total', status='failed')
+        else:
+            checkpoint.finish()
+            metrics.inc('ingest_files_total', status='done')
+        return stats
+
+    def _key_index_counters(self) -> tuple[int, int]:
+        """Keys looked up and rows dropped as duplicates, over every table"""
+        return (sum(index.lookups for index in self.key_indexes.values()),
+                sum(index.dropped for index in self.key_indexes.values()))
+
+    def _log_shard_stats(self) -> None:
+        stats = shard_stats(metrics.snapshot())
+        if not stats:
+            return
+        logger.info(f"Shard Stats ({len(stats)} shards, routed by {self.writer.shard_key})")
+        logger.info("-" * 30)
+        for shard, shard_stat in sorted(stats.items()):
+            logger.info(f"{shard:24} | {shard_stat['rows']:>10} rows | {shard_stat['mb']:>8} MB | "
+                        f"{shard_stat['inserts']:>6} inserts | {shard_stat['mean_latency_s']:>7}s mean | "
+                        f"{shard_stat['rows_per_sec']:>10} rows/s | {shard_stat['errors']} errors")
+        rows = [shard_stat['rows'] for shard_stat in stats.values()]
+        mean_rows = sum(rows) / len(rows)
+        # 1.0 is a perfectly even spread, the slowest shard sets the pace of every insert
+        logger.info(f"{'balance':24} | max/mean rows = {max(rows) / mean_rows if mean_rows else 0.0:.2f}")
+        logger.info("-" * 30 + "\n")
+
+    def _log_key_index_stats(self, lookups: int) -> None:
+        logger.info("Key Index Stats")
+        logger.info("-" * 30)
+        for table, key_index in self.key_indexes.items():
+            stats = key_index.stats()
+            logger.info(f"{table:20} | keys={stats['keys']}, base_mb={stats['base_mb']}, "
+                        f"in_memory_mb={stats['in_memory_mb']}")
+        keys = sum(len(key_index) for key_index in self.key_indexes.values())
+        logger.info(f"{'false positives':20} | ~{expected_false_positives(lookups, keys)} expected "
+                    f"over {lookups} lookups")
+        logger.info("-" * 30 + "\n")
+
+    def build_key_index(self, chunks: int = 16) -> None:
+        """Rebuild the key indexes from the keys and versions already in ClickHouse, read in `chunks` parts.
+        The content of those rows is not read, so an identical copy of one is inserted once more.
+        Run it while nothing is ingesting."""
+        for table, key_index in self.key_indexes.items():
+            start = time.perf_counter()
+            columns = key_index.key_columns + ([key_index.version_column] if key_index.version_column else [])
+            entries = []
+            for part in range(chunks):
+                df = self.sql_query(f"SELECT {', '.join(columns)} FROM {self.schema}.{table} "
+                                    f"WHERE cityHash64({key_index.key_columns[0]}) % {chunks} = {part}")
+                if not df.is_empty():
+                    entries.append(make_entries(hash_keys(df, key_index.key_columns),
+                                                row_versions(df, key_index.version_column)))
+            key_index.replace(np.concatenate(entries) if entries else make_entries(np.empty(0, dtype=np.uint64)))
+            key_index.table_uuid = self._table_identity(table)[0]
+            logger.info(f"Built the key index of '{table}' with {len(key_index)} keys "
+                        f"in {time.perf_counter() - start:.1f}s")
+
+    def ingest_file_pipelined(self, file_path: str, checkpoint: FileCheckpoint) -> Dict[str, int]:
+        """Ingest a single file with decompression, parsing, transforms and inserts running as
+        concurrent stages, so ClickHouse round trips overlap with decoding the next batches"""
+        logger.info(f"Starting pipelined ingestion for file: {file_path}")
+        start_time = datetime.now()
+        stats = self._new_file_stats()
+        reviews_table, images_table = self.reviews_table, self.images_table
+        stats_lock = threading.Lock()
+        position = {'seq': 0, 'record': checkpoint.start_record}
+        source = self._source_name(file_path)
+
+        def parse(chunk: bytes | pl.DataFrame) -> tuple[int, pl.DataFrame]:
+            # single worker, so batches are numbered in file order here
+            raw_df = chunk if isinstance(chunk, pl.DataFrame) else self.parse_chunk(chunk)
+            seq = position['seq']
+            position['seq'] += 1
+            position['record'] += len(raw_df)
+            checkpoint.register(seq, position['record'])
+            valid_df, rejected = self.validate_df(raw_df, reviews_table, source)
+            with stats_lock:
+                stats['total_processed'] += len(raw_df)
+                stats['rejected'] += rejected
+            return seq, valid_df
+
+        # images are buffered across batches until their own budget is reached (single transform worker)
+        images_buffer = FrameBuffer(images_table, self.batch_sizers.get(images_table), self.image_batch_size)
+
+        def transform(item: tuple[int, pl.DataFrame]) -> List[tuple[str, List[int], pl.DataFrame]]:
+            seq, raw_df = item
+            reviews_df, images_df = self.model_batch(raw_df)
+            images_df, rejected = self.validate_df(images_df, images_table, source)
+            if rejected:
+                with stats_lock:
+                    stats['rejected'] += rejected
+            batches = [(reviews_table, [seq], self.transform_df(reviews_df, reviews_table))]
+            flushed = images_buffer.add(seq, self.transform_df(images_df, images_table))
+            if flushed:
+                batches.append((images_table, *flushed))
+            return batches
+
+        def flush_images() -> List[tuple[str, List[int], pl.DataFrame]]:
+            flushed = images_buffer.drain()
+            return [(images_table, *flushed)] if flushed else []
+
+        def insert(item: tuple[str, List[int], pl.DataFrame]) -> None:
+            table, seqs, df = item
+            db = self._acquire_insert_connection()
+            try:
+                inserted = self.write_df(df, table, db)
+                for seq in seqs:
+                    checkpoint.commit(seq, table)
+            finally:
+                self._release_insert_connection(db)
+            with stats_lock:
+                if table == images_table:
+                    stats['images_processed'] += inserted
+                    return
+                stats['total_inserted'] += inserted
+                stats['batches_processed'] += 1
+                metrics.inc('ingest_batches_total')
+                logger.info(f"Processed {stats['total_processed']} records ({stats['images_processed']} images)...")
+
+        if self.staging is not None:
+            # frames from the Parquet stage, or decoded in the source while it is written
+            read_source = lambda: self.read_source_batches(file_path, skip_records=checkpoint.start_record)
+        else:
+            read_source = lambda: self.read_jsonl_gz_chunks(file_path, skip_records=checkpoint.start_record)
+        pipeline = Pipeline(
+            source=read_source,
+            source_name='decompress',
+            stages=[
+                ('parse', parse, 1),
+                ('transform', transform, 1, flush_images),
+                ('insert', insert, self.inflight_inserts),
+            ],
+            queue_size=self.queue_size,
+        )
+        try:
+            stage_stats = pipeline.run()
+        except Exception as e:
+            logger.error(f"Error during ingestion of file {file_path}: {e}")
+            stats['errors'] += 1
+            stats.update(failed=True, error=str(e))
+            return stats
+
+        # input stall means a stage waited on the one before it, output stall that it waited on the one after
+        logger.info("Pipeline Stage Stats")
+        logger.info("-" * 30)
+        for stage, values in stage_stats.items():
+            logger.info(f"{stage:12} | " + ", ".join(f"{k}={v}" for k, v in values.items()))
+        self._log_file_stats(file_path, stats, start_time)
+        return stats
+
+    def ingest_file_columnar(self, file_path: str, checkpoint: FileCheckpoint) -> Dict[str, int]:
+        """Ingest a single file by decoding whole batches into Polars frames"""
+        logger.info(f"Starting columnar ingestion for file: {file_path}")
+        start_time = datetime.now()
+        stats = self._new_file_stats()
+        position = checkpoint.start_record
+        source = self._source_name(file_path)
+        images_table = self.images_table
+        images_buffer = FrameBuffer(images_table, self.batch_sizers.get(images_table), self.image_batch_size)
+
+        def flush_images(flushed: tuple[List[int], pl.DataFrame] | None) -> None:
+            if flushed:
+                seqs, images_df = flushed
+                stats['images_processed'] += self.write_df(images_df, images_table)
+                for seq in seqs:
+                    checkpoint.commit(seq, images_table)
+
+        try:
+            for seq, raw_df in enumerate(self.read_source_batches(file_path, skip_records=position)):
+                position += len(raw_df)
+                checkpoint.register(seq, position)
+                stats['total_processed'] += len(raw_df)
+                # bad rows go to the dead-letter file, the rest of the batch carries on
+                raw_df, rejected = self.validate_df(raw_df, self.reviews_table, source)
+                reviews_df, images_df = self.model_batch(raw_df)
+                del raw_df  # free up memory
+                images_df, rejected_images = self.validate_df(images_df, images_table, source)
+                stats['rejected'] += rejected + rejected_images
+
+                stats['total_inserted'] += self.insert_df(reviews_df, self.reviews_table)
+                checkpoint.commit(seq, self.reviews_table)
+                flush_images(images_buffer.add(seq, self.transform_df(images_df, images_table)))
+                stats['batches_processed'] += 1
+                metrics.inc('ingest_batches_total')
+                logger.info(f"Processed {stats['total_processed']} records ({stats['images_processed']} images)...")
+            flush_images(images_buffer.drain())
+
+            self._log_file_stats(file_path, stats, start_time)
+            return stats
+
+        except Exception as e:
+            logger.error(f"Error during ingestion of file {file_path}: {e}")
+            stats['errors'] += 1
+            stats.update(failed=True, error=str(e))
+            return stats
+
+    def ingest_file_records(self, file_path: str, checkpoint: FileCheckpoint) -> Dict[str, int]:
+        """Ingest a single file one record at a time (original fallback path)"""
+        logger.info(f"Starting ingestion for file: {file_path}")
+        start_time = datetime.now()
+        stats = self._new_file_stats()
+        reviews_table, images_table = self.reviews_table, self.images_table
+        position = checkpoint.start_record
+        source = self._source_name(file_path)
+        seq = 0
+        modeling_seconds = 0.0  # data_modeling runs per record, its time is reported per batch
+        # images have their own flush policy, a batch is committed for them once its images are written
+        images_buffer = FrameBuffer(images_table, self.batch_sizers.get(images_table), self.image_batch_size)
+
+        def flush_images(flushed: tuple[List[int], pl.DataFrame] | None) -> None:
+            if flushed:
+                seqs, images_df = flushed
+                stats['images_processed'] += self.write_df(images_df, images_table)
+                for seq in seqs:
+                    checkpoint.commit(seq, images_table)
+
+        def flush(batch_data: List[Dict[str, Any]], images_data: List[Dict[str, Any]]) -> None:
+            nonlocal seq, modeling_seconds
+            metrics.observe('ingest_stage_seconds', modeling_seconds, stage='data_modeling')
+            metrics.inc('ingest_records_read_total', len(batch_data))
+            modeling_seconds = 0.0
+            checkpoint.register(seq, position)
+            # values of the wrong type become nulls or strings here and are rejected by the validation.
+            # Images are validated on their own, those of a rejected review are still inserted and the
+            # review follows them when its dead-letter row is replayed.
+            reviews_df, rejected = self.validate_df(pl.DataFrame(batch_data, strict=False, infer_schema_length=None),
+                                                    reviews_table, source, records=batch_data)
+            images_df, rejected_images = self.validate_df(
+                pl.DataFrame(images_data, strict=False, infer_schema_length=None), images_table, source,
+                records=images_data)
+            stats['rejected'] += rejected + rejected_images
+            stats['total_inserted'] += self.insert_df(reviews_df, reviews_table)
+            checkpoint.commit(seq, reviews_table)
+            if not images_df.is_empty():
+                images_df = self.transform_df(images_df, images_table)
+            flush_images(images_buffer.add(seq, images_df))
+            stats['batches_processed'] += 1
+            metrics.inc('ingest_batches_total')
+            seq += 1
+
         try:
             batch_data = []
             images_data = []
             logger.info(f"Processing file: {file_path}")
-            for record in self.read_jsonl_gz_file(file_path):
-                try:
-                    record, image_record = self.data_modeling(record)
-                    if image_record:
-                        images_data.append(image_record)
-                        
-                    batch_data.append(record)
-                    stats['total_processed'] += 1
-                    
-                    if len(batch_data) >= self.batch_size:
-                        inserted_count = self.insert_batch(batch_data, reviews_table)
-                        if image_record:
-                            self.insert_batch(images_data, images_table)
-                            images_data = []  # Reset images batch
-                            inserted_count += len(images_data)
-                            stats['images_processed'] += len(images_data)
-                            
-                        stats['total_inserted'] += inserted_count
-                        stats['batches_processed'] += 1
-                        batch_data = []  # Reset batch
-                        logger.info(f"Processed {stats['total_processed']} combine with image record...")
-                except Exception as e:
-                    logger.error(f"Error processing record: {e}")
-                    stats['errors'] += 1
-                    continue
+            for record in self.read_jsonl_gz_file(file_path, skip_records=position):
+                position += 1
+                # no per-record error handling: bad values are caught by the batch validation in flush
+                start = time.perf_counter()
+                record, image_records = self.data_modeling(record)
+                modeling_seconds += time.perf_counter() - start
+                images_data.extend(image_records)
+
+                batch_data.append(record)
+                stats['total_processed'] += 1
+
+                if len(batch_data) >= self.batch_size:
+                    flush(batch_data, images_data)
+                    batch_data = []  # Reset batch
+                    images_data = []  # Reset images batch
+                    logger.info(f"Processed {stats['total_processed']} combine with image record...")
                 
             # Insert any remaining records
-            if batch_data:
-                inserted_count = self.insert_batch(batch_data, reviews_table)
-                stats['total_inserted'] += inserted_count
-                stats['batches_processed'] += 1
-                
-            if images_data:
-                self.insert_batch(images_data, images_table)
-                stats['images_processed'] += len(images_data)
+            if batch_data or images_data:
+                flush(batch_data, images_data)
+            flush_images(images_buffer.drain())
                 
-            end_time = datetime.now()
-            duration = (end_time - start_time).total_seconds()
-            logger.info(f"Ingestion completed for {file_path}\n")
-            # logger.info(f"Stats: {stats}")
-            logger.info(f"Duration: {duration} seconds\n")
-            logger.info("Ingestion Stats")
-            logger.info("-" * 30)
-            for k, v in stats.items():
-                logger.info(f"{k:20} | {v}")
-            logger.info("-" * 30 + "\n")
+            self._log_file_stats(file_path, stats, start_time)
             return stats
 
         except Exception as e:
             logger.error(f"Error during ingestion of file {file_path}: {e}")
+            stats['errors'] += 1
+            stats.update(failed=True, error=str(e))
             return stats
         
+    def _ingest_file_safely(self, file_path: Path) -> Dict[str, int] | None:
+        try:
+            return self.ingest_file(str(file_path))
+        except Exception as e:
+            logger.error(f"Error ingesting file {file_path}: {e}")
+            metrics.inc('ingest_errors_total', stage='file')
+            return None
+
+    def _ingest_files_parallel(self, files: List[Path]) -> Iterator[tuple[Path, Dict[str, int] | None]]:
+        """Ingest whole files in a pool of processes, each with its own ClickHouse connection"""
+        workers = min(self.workers, len(files))
+        logger.info(f"Ingesting {len(files)} files with {workers} worker processes")
+        # spawn rather than fork: the parent's connection and Polars thread pool must not be inherited
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_ingest_worker, initargs=(self._worker_settings(),)) as executor:
+            # the pool hands out tasks in submission order, i.e. largest file first
+            futures = {executor.submit(_ingest_file_in_worker, str(file_path)): file_path for file_path in files}
+            for future in as_completed(futures):
+                file_path = futures[future]
+                try:
+                    yield file_path, future.result()
+                except Exception as e:
+                    logger.error(f"Error ingesting file {file_path}: {e}")
+                    metrics.inc('ingest_errors_total', stage='file')
+                    yield file_path, None
+
     def ingest_data_folder(self) -> None:
         """Ingest all files from the data folder"""
         
@@ -276,42 +1018,164 @@ class AmazonReviewsIngestion(ClickHouseDB):
             return
         
         logger.info(f"Found {len(files)} files to ingest.")
+
+        if self.manifest is not None:
+            pending = [file_path for file_path in files if not self.manifest.is_done(str(file_path))]
+            if len(pending) < len(files):
+                logger.info(f"Skipping {len(files) - len(pending)} files already ingested according to the manifest.")
+            files = pending
+            if not files:
+                logger.info("Nothing new to ingest.")
+                return
+        elif self.key_indexes:
+            # every file goes in again from the start, so do the rows indexed by earlier runs
+            logger.info("Ignoring the manifest, starting the key indexes over")
+            for key_index in self.key_indexes.values():
+                key_index.clear()
         
         total_stats = {
             'total_processed': 0,
             'total_inserted': 0,
             'batches_processed': 0,
+            'rejected': 0,
+            'duplicates': 0,
             'errors': 0,
             'files_processed': 0
         }
-        
-        for file_path in files:
-            try:
-                file_stats = self.ingest_file(str(file_path))
+
+        # largest files first so a huge category doesn't end up running alone at the end
+        files.sort(key=lambda path: path.stat().st_size, reverse=True)
+
+        start_time = datetime.now()
+        peak_rss = 0.0
+        key_lookups = 0
+        pending = len(files)
+        metrics.set('ingest_files_pending', pending)
+        exporter = MetricsExporter(metrics, json_path=self.metrics_file, port=self.metrics_port,
+                                   interval=self.metrics_interval).start()
+        try:
+            if self.workers > 1:
+                file_results = self._ingest_files_parallel(files)
+            else:
+                file_results = ((file_path, self._ingest_file_safely(file_path)) for file_path in files)
+
+            for file_path, file_stats in file_results:
+                pending -= 1
+                metrics.set('ingest_files_pending', pending)
+                if file_stats is None:
+                    total_stats['errors'] += 1
+                    continue
+                if 'metrics' in file_stats:
+                    # snapshot taken in the worker process after the file
+                    metrics.merge(file_stats.pop('metrics'))
                 for key in total_stats:
                     total_stats[key] += file_stats.get(key, 0)
+                key_lookups += file_stats.get('key_lookups', 0)
                 total_stats['files_processed'] += 1
-            except Exception as e:
-                logger.error(f"Error ingesting file {file_path}: {e}")
-                total_stats['errors'] += 1
-                continue
-                    
-        logger.info("Final Ingestion Stats")
+                peak_rss = max(peak_rss, file_stats.get('peak_rss_mb', 0.0))
+        finally:
+            exporter.stop()
+
+        duration = (datetime.now() - start_time).total_seconds()
+        total_stats['rows_per_sec'] = round(total_stats['total_processed'] / duration, 1) if duration > 0 else 0.0
+        total_stats['peak_rss_mb'] = round(max(peak_rss, peak_rss_mb()), 1)
+
+        logger.info(f"Final Ingestion Stats ({self.ingest_mode} mode)")
         logger.info("-" * 30)
         for k, v in total_stats.items():
             logger.info(f"{k:20} | {v}")
         
         logger.info("-" * 30 + "\n")
+        if self.writer_name == 'sharded':
+            self._log_shard_stats()
+        if self.key_indexes:
+            # every worker is done, fold their delta files into one base per table
+            for key_index in self.key_indexes.values():
+                key_index.compact()
+            self._log_key_index_stats(key_lookups)
 
         logger.info("\n\nData ingestion process completed.")
         
+    def replay_rejected(self) -> Dict[str, int]:
+        """Re-validate and insert the rows of every dead-letter file, e.g. after fixing them by hand.
+        Rows that are still invalid end up in a fresh dead-letter file."""
+        stats = {'files_replayed': 0, 'replayed_rows': 0, 'total_inserted': 0, 'images_processed': 0, 'rejected': 0}
+        for path in self.dead_letters.files():
+            source, table = parse_dead_letter_name(path)
+            if table not in self.validators:
+                logger.warning(f"Skipping dead-letter file {path}: unknown table '{table}'")
+                continue
+            claimed = claim_dead_letter(path)
+            logger.info(f"Replaying {claimed}")
+            lines = read_dead_letter(claimed)
+            stats['replayed_rows'] += len(lines)
+            if not lines:
+                claimed.unlink()
+                continue
+
+            if table == self.reviews_table:
+                # same path as a fresh file: lines that still do not parse are rejected again
+                raw_df, rejected = self.validate_df(self.parse_chunk(('\n'.join(lines) + '\n').encode()), table, source)
+                reviews_df, images_df = self.model_batch(raw_df)
+                images_df, rejected_images = self.validate_df(images_df, self.images_table, source)
+                stats['rejected'] += rejected + rejected_images
+                stats['total_inserted'] += self.insert_df(reviews_df, table)
+                stats['images_processed'] += self.insert_df(images_df, self.images_table)
+            else:
+                records = [decode_json_line(line) for line in lines]
+                valid_df, rejected = self.validate_df(pl.DataFrame(records, strict=False, infer_schema_length=None),
+                                                      table, source, records=records)
+                stats['rejected'] += rejected
+                stats['images_processed'] += self.insert_df(valid_df, table)
+            claimed.unlink()
+            stats['files_replayed'] += 1
+        for key_index in self.key_indexes.values():
+            key_index.compact()
+
+        logger.info("Dead-letter Replay Stats")
+        logger.info("-" * 30)
+        for k, v in stats.items():
+            logger.info(f"{k:20} | {v}")
+        logger.info("-" * 30 + "\n")
+        return stats
+
     def main(self):
         # Ensure tables exist
         self.create_table_if_not_exists("create_reviews_table")
         self.create_table_if_not_exists("review_images_table")
+        self.migrate_table("review_images_table")
+        self.check_key_indexes()
+        if self.writer_name == 'sharded':
+            self.create_shard_tables()
+            if self.distributed:
+                self.create_distributed_tables()
+        elif self.distributed:
+            logger.warning("--distributed only applies to the sharded writer, not creating distributed tables")
+        if self.rollups:
+            self.create_rollups()
         # Ingest data from folder
         self.ingest_data_folder()
     
+# Each worker process builds one ingestion instance (and connection) and reuses it for every file it gets
+_worker_ingestion: AmazonReviewsIngestion | None = None
+
+
+def _init_ingest_worker(settings: Dict[str, Any]) -> None:
+    global _worker_ingestion
+    _worker_ingestion = AmazonReviewsIngestion(**settings)
+
+
+def _stage_file_in_worker(file_path: str) -> int:
+    return _worker_ingestion.stage_file(file_path)
+
+
+def _ingest_file_in_worker(file_path: str) -> Dict[str, Any]:
+    stats = _worker_ingestion.ingest_file(file_path)
+    # hand this file's metrics to the parent; if the file raised they go out with the next one
+    stats['metrics'] = metrics.drain()
+    return stats
+
+
 if __name__ == "__main__":
     ingestion = AmazonReviewsIngestion(batch_size=20000)
     
@@ -90,3 +90,166 @@ queries = {
         LIMIT 1000
         """
 }
+
+# The same reports read from the rollups in create_schema.py (-Merge of the stored states),
+# used instead of the queries above when their rollup table exists
+rollup_tables = {
+    'product_popularity': 'rollup_product_stats',
+    'user_behavior': 'rollup_user_stats',
+    'temporal_trends': 'rollup_monthly_stats',
+    'rating_distribution': 'rollup_rating_stats',
+    'total_reviews': 'rollup_overview_stats',
+    'unique_products': 'rollup_overview_stats',
+    'unique_users': 'rollup_overview_stats',
+    'date_range': 'rollup_overview_stats',
+    'verified_vs_unverified': 'rollup_overview_stats',
+}
+
+rollup_queries = {
+    'total_reviews': f"SELECT countMerge(review_count) as count FROM {clickhouse_config['db_name']}.rollup_overview_stats",
+    'unique_products': f"SELECT uniqExactMerge(unique_products) as count "
+                       f"FROM {clickhouse_config['db_name']}.rollup_overview_stats",
+    'unique_users': f"SELECT uniqExactMerge(unique_users) as count FROM {clickhouse_config['db_name']}.rollup_overview_stats",
+    'date_range': f"SELECT minMerge(min_date) as min_date, maxMerge(max_date) as max_date "
+                  f"FROM {clickhouse_config['db_name']}.rollup_overview_stats",
+    "verified_vs_unverified": f"""
+        SELECT
+            verified_purchase,
+            countMerge(review_count) AS count,
+            avgMerge(avg_rating) AS avg_rating
+        FROM {clickhouse_config['db_name']}.rollup_overview_stats
+        GROUP BY verified_purchase;
+        """,
+    'rating_distribution': f"""
+        SELECT
+            rating,
+            countMerge(review_count) as count,
+            countMerge(review_count) * 100.0 / (
+                SELECT countMerge(review_count) FROM {clickhouse_config['db_name']}.rollup_rating_stats
+            ) as percentage
+        FROM {clickhouse_config['db_name']}.rollup_rating_stats
+        GROUP BY rating
+        ORDER BY rating;
+        """,
+    "product_popularity": f"""
+        SELECT
+            asin,
+            countMerge(review_count) as review_count,
+            avgMerge(avg_rating) as avg_rating,
+            minMerge(min_rating) as min_rating,
+            maxMerge(max_rating) as max_rating,
+            sumMerge(total_helpful_votes) as total_helpful_votes,
+            sumMerge(total_negative_votes) as total_negative_votes,
+            uniqExactMerge(unique_reviewers) as unique_reviewers
+        FROM {clickhouse_config['db_name']}.rollup_product_stats
+        GROUP BY asin
+        HAVING review_count >= 5
+        ORDER BY review_count DESC
+        LIMIT 100;
+        """,
+    "temporal_trends": f"""
+        SELECT
+            year,
+            month,
+            countMerge(review_count) as review_count,
+            avgMerge(avg_rating) as avg_rating,
+            uniqExactMerge(unique_products) as unique_products,
+            uniqExactMerge(unique_users) as unique_users
+        FROM {clickhouse_config['db_name']}.rollup_monthly_stats
+        GROUP BY year, month
+        ORDER BY year, month
+        LIMIT 1000;
+        """,
+    "user_behavior": f"""
+        SELECT
+            user_id,
+            countMerge(total_reviews) as total_reviews,
+            avgMerge(avg_rating) as avg_rating,
+            minMerge(min_rating) as min_rating,
+            maxMerge(max_rating) as max_rating,
+            uniqExactMerge(unique_products) as unique_products,
+            sumMerge(total_helpful_votes) as total_helpful_votes,
+            sumMerge(total_negative_votes) as total_negative_votes,
+            sumMerge(verified_purchases) as verified_purchases
+        FROM {clickhouse_config['db_name']}.rollup_user_stats
+        GROUP BY user_id
+        HAVING total_reviews >= 3
+        ORDER BY total_reviews DESC
+        LIMIT 1000
+        """
+}
+
+# Fast approximate reports (`generate_report --approx`): uniqCombined sketches instead of exact
+# distinct counts, and `SAMPLE` on reviews when the table has a sampling key on user_id.
+# `{sample}` becomes the SAMPLE clause (or nothing) and `{scale}` the factor that scales sampled
+# counts back up. Queries that count distinct asins are never sampled, sampling by user would
+# undercount them. `metrics` lists the estimated columns and how, for their error bounds.
+approx_queries = {
+    'total_reviews': {
+        'sql': f"SELECT round(COUNT(*) * {{scale}}) as count FROM {clickhouse_config['db_name']}.reviews {{sample}}",
+        'sampled': True,
+        'metrics': {'count': 'count'},
+    },
+    'unique_users': {
+        'sql': f"SELECT round(uniqCombined(user_id) * {{scale}}) as count "
+               f"FROM {clickhouse_config['db_name']}.reviews {{sample}}",
+        'sampled': True,
+        'metrics': {'count': 'uniq'},
+    },
+    'unique_products': {
+        'sql': f"SELECT uniqCombined(asin) as count FROM {clickhouse_config['db_name']}.reviews",
+        'sampled': False,
+        'metrics': {'count': 'uniq'},
+    },
+    'rating_distribution': {
+        'sql': f"""
+        SELECT
+            rating,
+            round(COUNT(*) * {{scale}}) as count,
+            COUNT(*) * 100.0 / (SELECT COUNT(*) FROM {clickhouse_config['db_name']}.reviews {{sample}}) as percentage
+        FROM {clickhouse_config['db_name']}.reviews {{sample}}
+        GROUP BY rating
+        ORDER BY rating;
+        """,
+        'sampled': True,
+        'metrics': {'count': 'count'},
+    },
+    'temporal_trends': {
+        'sql': f"""
+        SELECT
+            toYear(toDateTime(timestamp)) as year,
+            toMonth(toDateTime(timestamp)) as month,
+            COUNT(*) as review_count,
+            AVG(rating) as avg_rating,
+            uniqCombined(asin) as unique_products,
+            uniqCombined(user_id) as unique_users
+        FROM {clickhouse_config['db_name']}.reviews
+        WHERE timestamp IS NOT NULL
+        GROUP BY year, month
+        ORDER BY year, month
+        LIMIT 1000;
+        """,
+        'sampled': False,
+        'metrics': {'unique_products': 'uniq', 'unique_users': 'uniq'},
+    },
+    'product_popularity': {
+        'sql': f"""
+        SELECT
+            asin,
+            round(COUNT(*) * {{scale}}) as review_count,
+            AVG(rating) as avg_rating,
+            MIN(rating) as min_rating,
+            MAX(rating) as max_rating,
+            round(SUM(if(helpful_vote > 0, helpful_vote, 0)) * {{scale}}) as total_helpful_votes,
+            round(SUM(if(helpful_vote < 0, helpful_vote, 0)) * {{scale}}) as total_negative_votes,
+            round(uniqCombined(user_id) * {{scale}}) as unique_reviewers
+        FROM {clickhouse_config['db_name']}.reviews {{sample}}
+        GROUP BY asin
+        HAVING review_count >= 5
+        ORDER BY review_count DESC
+        LIMIT 100;
+        """,
+        'sampled': True,
+        'metrics': {'review_count': 'count', 'unique_reviewers': 'uniq'},
+    },
+}
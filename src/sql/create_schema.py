@@ -1,11 +1,15 @@
+import re
+
 from config.config import clickhouse_config
 
-sql_queries = {
-    "create_database": f"CREATE DATABASE IF NOT EXISTS {clickhouse_config['db_name']};",
-    "create_reviews_table": {
-        "table_name": "reviews",
-        "sql_create":f"""
-        CREATE TABLE IF NOT EXISTS {clickhouse_config['db_name']}.reviews
+# Storage layouts of the tables, selected with CLICKHOUSE_LAYOUT (see `get_layout_query` and
+# `ingest --migrate_layout`). Every profile has the same columns, so ingestion works on any of them.
+# `{table}` is the table name, letting a migration build the new layout next to the live table.
+layout_profiles = {
+    # the original layout
+    "default": {
+        "create_reviews_table": f"""
+        CREATE TABLE IF NOT EXISTS {clickhouse_config['db_name']}.{{table}}
         (
             user_id String,
             parent_asin String,
@@ -20,16 +24,14 @@ sql_queries = {
         )
         ENGINE = ReplacingMergeTree(timestamp) -- Use ReplacingMergeTree for deduplication
         ORDER BY (asin, user_id, parent_asin);
-"""},
-
-    "review_images_table": {
-        "table_name": "review_images",
-        "sql_create": f"""
-        CREATE TABLE IF NOT EXISTS {clickhouse_config['db_name']}.review_images
+""",
+        "review_images_table": f"""
+        CREATE TABLE IF NOT EXISTS {clickhouse_config['db_name']}.{{table}}
         (
             asin String,
             parent_asin String,
             user_id String,
+            image_position UInt8, -- index of the attachment in the review's images list
             small_image_url String,
             medium_image_url String,
             large_image_url String,
@@ -37,9 +39,216 @@ sql_queries = {
             ingest_ts DateTime DEFAULT now()
         )
         ENGINE = ReplacingMergeTree -- Use ReplacingMergeTree for deduplication
-        ORDER BY (asin, user_id, parent_asin);
-"""
+        ORDER BY (asin, user_id, parent_asin, image_position);
+""",
+    },
+    # For the report: the skip indexes let per-user lookups and `ingest_ts` ranges (incremental report)
+    # skip granules, and the sampling key enables `--approx` sampling. cityHash64(user_id) is derived
+    # from user_id, so it does not change which rows ReplacingMergeTree deduplicates. There is no
+    # PARTITION BY: duplicates only collapse within a partition, and a partition on `timestamp` (the
+    # version) would keep both versions of a review edited in another month.
+    "optimized": {
+        "create_reviews_table": f"""
+        CREATE TABLE IF NOT EXISTS {clickhouse_config['db_name']}.{{table}}
+        (
+            user_id String CODEC(ZSTD(3)),
+            parent_asin String CODEC(ZSTD(3)),
+            asin String CODEC(ZSTD(3)),
+            title String CODEC(ZSTD(3)),
+            text String CODEC(ZSTD(3)),
+            rating UInt8 CODEC(ZSTD(1)),
+            helpful_vote Nullable(Int64) CODEC(ZSTD(1)),
+            verified_purchase Bool,
+            timestamp DateTime CODEC(Delta, ZSTD(1)),
+            ingest_ts DateTime DEFAULT now() CODEC(Delta, ZSTD(1)), -- ascending within an insert
+            INDEX user_id_bloom user_id TYPE bloom_filter(0.01) GRANULARITY 4,
+            INDEX ingest_ts_minmax ingest_ts TYPE minmax GRANULARITY 1
+        )
+        ENGINE = ReplacingMergeTree(timestamp)
+        ORDER BY (asin, user_id, parent_asin, cityHash64(user_id))
+        SAMPLE BY cityHash64(user_id);
+""",
+        "review_images_table": f"""
+        CREATE TABLE IF NOT EXISTS {clickhouse_config['db_name']}.{{table}}
+        (
+            asin String CODEC(ZSTD(3)),
+            parent_asin String CODEC(ZSTD(3)),
+            user_id String CODEC(ZSTD(3)),
+            image_position UInt8, -- index of the attachment in the review's images list
+            small_image_url String CODEC(ZSTD(3)),
+            medium_image_url String CODEC(ZSTD(3)),
+            large_image_url String CODEC(ZSTD(3)),
+            attachment_type LowCardinality(String), -- a handful of values
+            ingest_ts DateTime DEFAULT now() CODEC(Delta, ZSTD(1)),
+            INDEX user_id_bloom user_id TYPE bloom_filter(0.01) GRANULARITY 4
+        )
+        ENGINE = ReplacingMergeTree
+        ORDER BY (asin, user_id, parent_asin, image_position);
+""",
+    },
 }
+
+_table_names = {"create_reviews_table": "reviews", "review_images_table": "review_images"}
+
+
+def get_layout_query(key: str, profile: str, table_name: str | None = None) -> str:
+    """CREATE TABLE query of a table in a layout profile, optionally under another name"""
+    if profile not in layout_profiles:
+        raise ValueError(f"Unknown layout profile '{profile}', expected one of {sorted(layout_profiles)}")
+    return layout_profiles[profile][key].format(table=table_name or _table_names[key])
+
+
+sql_queries = {
+    "create_database": f"CREATE DATABASE IF NOT EXISTS {clickhouse_config['db_name']};",
+    **{
+        key: {"table_name": table_name, "sql_create": get_layout_query(key, clickhouse_config['layout_profile'])}
+        for key, table_name in _table_names.items()
+    },
+}
+
+# Pre-aggregated rollups of `reviews` for the standard report, fed by materialized views on insert.
+# Optional: created by `ingest --rollups` or `backfill_rollups`; the report falls back to `reviews` without them.
+# The SELECT is shared by the view, the backfill and the incremental report refresh so all of them
+# produce the same states; `{where}` restricts it to a range of rows.
+_db = clickhouse_config['db_name']
+_rollups = {
+    "rollup_product_stats": {
+        "columns": """
+            asin String,
+            review_count AggregateFunction(count),
+            avg_rating AggregateFunction(avg, UInt8),
+            min_rating AggregateFunction(min, UInt8),
+            max_rating AggregateFunction(max, UInt8),
+            total_helpful_votes AggregateFunction(sum, Int64),
+            total_negative_votes AggregateFunction(sum, Int64),
+            unique_reviewers AggregateFunction(uniqExact, String)""",
+        "order_by": "asin",
+        "select": f"""
+        SELECT
+            asin,
+            countState() AS review_count,
+            avgState(rating) AS avg_rating,
+            minState(rating) AS min_rating,
+            maxState(rating) AS max_rating,
+            sumState(toInt64(greatest(ifNull(helpful_vote, 0), 0))) AS total_helpful_votes,
+            sumState(toInt64(least(ifNull(helpful_vote, 0), 0))) AS total_negative_votes,
+            uniqExactState(user_id) AS unique_reviewers
+        FROM {_db}.reviews{{where}}
+        GROUP BY asin""",
+    },
+    "rollup_user_stats": {
+        "columns": """
+            user_id String,
+            total_reviews AggregateFunction(count),
+            avg_rating AggregateFunction(avg, UInt8),
+            min_rating AggregateFunction(min, UInt8),
+            max_rating AggregateFunction(max, UInt8),
+            unique_products AggregateFunction(uniqExact, String),
+            total_helpful_votes AggregateFunction(sum, Int64),
+            total_negative_votes AggregateFunction(sum, Int64),
+            verified_purchases AggregateFunction(sum, UInt64)""",
+        "order_by": "user_id",
+        "select": f"""
+        SELECT
+            user_id,
+            countState() AS total_reviews,
+            avgState(rating) AS avg_rating,
+            minState(rating) AS min_rating,
+            maxState(rating) AS max_rating,
+            uniqExactState(asin) AS unique_products,
+            sumState(toInt64(greatest(ifNull(helpful_vote, 0), 0))) AS total_helpful_votes,
+            sumState(toInt64(least(ifNull(helpful_vote, 0), 0))) AS total_negative_votes,
+            sumState(toUInt64(verified_purchase)) AS verified_purchases
+        FROM {_db}.reviews{{where}}
+        GROUP BY user_id""",
+    },
+    "rollup_monthly_stats": {
+        "columns": """
+            year UInt16,
+            month UInt8,
+            review_count AggregateFunction(count),
+            avg_rating AggregateFunction(avg, UInt8),
+            unique_products AggregateFunction(uniqExact, String),
+            unique_users AggregateFunction(uniqExact, String)""",
+        "order_by": "(year, month)",
+        "select": f"""
+        SELECT
+            toYear(timestamp) AS year,
+            toMonth(timestamp) AS month,
+            countState() AS review_count,
+            avgState(rating) AS avg_rating,
+            uniqExactState(asin) AS unique_products,
+            uniqExactState(user_id) AS unique_users
+        FROM {_db}.reviews{{where}}
+        GROUP BY year, month""",
+    },
+    "rollup_overview_stats": {
+        "columns": """
+            verified_purchase Bool,
+            review_count AggregateFunction(count),
+            avg_rating AggregateFunction(avg, UInt8),
+            min_date AggregateFunction(min, DateTime),
+            max_date AggregateFunction(max, DateTime),
+            unique_products AggregateFunction(uniqExact, String),
+            unique_users AggregateFunction(uniqExact, String)""",
+        "order_by": "verified_purchase",
+        "select": f"""
+        SELECT
+            verified_purchase,
+            countState() AS review_count,
+            avgState(rating) AS avg_rating,
+            minState(timestamp) AS min_date,
+            maxState(timestamp) AS max_date,
+            uniqExactState(asin) AS unique_products,
+            uniqExactState(user_id) AS unique_users
+        FROM {_db}.reviews{{where}}
+        GROUP BY verified_purchase""",
+    },
+    "rollup_rating_stats": {
+        "columns": """
+            rating UInt8,
+            review_count AggregateFunction(count)""",
+        "order_by": "rating",
+        "select": f"""
+        SELECT
+            rating,
+            countState() AS review_count
+        FROM {_db}.reviews{{where}}
+        GROUP BY rating""",
+    },
+}
+rollup_queries = {
+    name: {
+        "table_name": name,
+        "sql_create": f"""
+        CREATE TABLE IF NOT EXISTS {_db}.{name}
+        ({rollup['columns']}
+        )
+        ENGINE = AggregatingMergeTree
+        ORDER BY {rollup['order_by']};
+""",
+        "sql_view": f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {_db}.{name}_mv TO {_db}.{name} AS{rollup['select'].format(where='')};
+""",
+        "sql_truncate": f"TRUNCATE TABLE IF EXISTS {_db}.{name};",
+        "sql_backfill": f"INSERT INTO {_db}.{name}{rollup['select'].format(where='')};",
+        "sql_select": rollup['select'],
+    }
+    for name, rollup in _rollups.items()
+}
+
+# Columns added to existing tables after their first release, as (column, ALTER query) per table key.
+# Each query runs once when its column is missing (see AmazonReviewsIngestion.migrate_table).
+schema_migrations = {
+    "review_images_table": [
+        # older tables only held images[0] of each review, which is position 0. The position joins the
+        # sorting key so ReplacingMergeTree no longer collapses the images of one review.
+        ("image_position", f"""
+        ALTER TABLE {clickhouse_config['db_name']}.review_images
+            ADD COLUMN IF NOT EXISTS image_position UInt8 DEFAULT 0 AFTER user_id,
+            MODIFY ORDER BY (asin, user_id, parent_asin, image_position);
+"""),
+    ],
 }
 
 def get_sql_query(key: str) -> str | dict:
@@ -47,3 +256,109 @@ def get_sql_query(key: str) -> str | dict:
         return sql_queries[key]
     except KeyError as e:
         raise e
+
+
+def get_rollup_queries() -> dict[str, dict]:
+    return rollup_queries
+
+
+def get_schema_migrations(key: str) -> list[tuple[str, str]]:
+    return schema_migrations.get(key, [])
+
+
+def get_distributed_query(key: str, cluster: str, shard_key: str) -> dict:
+    """`<table>_all` over the local tables of every shard of `cluster`. Its sharding key is the
+    routing of the sharded writer (writers.shard_of), so inserts through it land on the same shards."""
+    table_name = _table_names[key]
+    return {
+        "table_name": f"{table_name}_all",
+        "sql_create": f"CREATE TABLE IF NOT EXISTS {_db}.{table_name}_all AS {_db}.{table_name} "
+                      f"ENGINE = Distributed('{cluster}', '{_db}', '{table_name}', CRC32({shard_key}));",
+    }
+
+
+# Keywords that end the type part of a column definition
+_COLUMN_MODIFIERS = ('DEFAULT', 'MATERIALIZED', 'ALIAS', 'EPHEMERAL', 'CODEC', 'COMMENT', 'TTL')
+# Table elements that are not columns
+_NON_COLUMN_ELEMENTS = ('INDEX', 'PROJECTION', 'CONSTRAINT')
+
+
+def _split_top_level(text: str, sep: str = ',') -> list[str]:
+    """Split on `sep` while ignoring separators nested inside parentheses"""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == sep and depth == 0:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append(''.join(current))
+    return parts
+
+
+def get_table_columns(key: str) -> list[dict]:
+    """Parse the column definitions (name, type, default) out of a CREATE TABLE query"""
+    sql_create = get_sql_query(key)['sql_create']
+    # drop SQL comments before looking for the column list
+    sql_create = '\n'.join(line.split('--')[0] for line in sql_create.splitlines())
+
+    start = sql_create.index('(')
+    depth = 0
+    for end in range(start, len(sql_create)):
+        if sql_create[end] == '(':
+            depth += 1
+        elif sql_create[end] == ')':
+            depth -= 1
+            if depth == 0:
+                break
+    body = sql_create[start + 1:end]
+
+    columns = []
+    for element in _split_top_level(body):
+        element = ' '.join(element.split())
+        if not element or element.split(' ')[0].upper() in _NON_COLUMN_ELEMENTS:
+            continue
+        name, *tokens = _split_top_level(element, ' ')
+        # CODEC(...) carries its arguments in the same token
+        modifiers = [i for i, token in enumerate(tokens) if token.split('(')[0].upper() in _COLUMN_MODIFIERS]
+        type_end = modifiers[0] if modifiers else len(tokens)
+        default = None
+        for position, i in enumerate(modifiers):
+            if tokens[i].upper() == 'DEFAULT':
+                default_end = modifiers[position + 1] if position + 1 < len(modifiers) else len(tokens)
+                default = ' '.join(tokens[i + 1:default_end])
+        column_type = ' '.join(tokens[:type_end])
+        columns.append({'name': name.strip('`'), 'type': column_type, 'default': default})
+    return columns
+
+
+def get_version_column(key: str) -> str | None:
+    """Version column of a ReplacingMergeTree table, e.g. 'timestamp'; None when the last insert wins"""
+    sql_create = get_sql_query(key)['sql_create']
+    match = re.search(r'ReplacingMergeTree\(\s*`?(\w+)`?', sql_create)
+    return match.group(1) if match else None
+
+
+def get_sorting_key(key: str) -> list[str]:
+    """Columns of the ORDER BY clause of a CREATE TABLE query, e.g. ['asin', 'user_id', 'parent_asin']"""
+    sql_create = get_sql_query(key)['sql_create']
+    sql_create = '\n'.join(line.split('--')[0] for line in sql_create.splitlines())
+    match = re.search(r'ORDER\s+BY\s+', sql_create, re.IGNORECASE)
+    if match is None:
+        return []
+    rest = sql_create[match.end():]
+    if rest.startswith('('):
+        # the tuple may hold function calls, so find its matching parenthesis
+        depth = 0
+        for end, char in enumerate(rest):
+            depth += {'(': 1, ')': -1}.get(char, 0)
+            if depth == 0:
+                break
+        expression = rest[1:end]
+    else:
+        expression = re.split(r'[\s;]', rest, maxsplit=1)[0]
+    return [column.strip().strip('`') for column in _split_top_level(expression) if column.strip()]
@@ -0,0 +1,104 @@
+"""Query fusion for analysis queries that aggregate a whole table into a few rows.
+
+Each fusable query is described by a FusedPart: the aggregates it needs and how to
+turn them back into the rows its standalone query returns. Parts over the same
+table are answered by one SELECT, i.e. one scan, instead of one scan each. A query
+opts in by adding its part to `fusable_queries`.
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+import polars as pl
+
+from config.config import clickhouse_config
+from src.utils.validation import VALUE_RANGES
+
+# Ratings are validated to this range on ingest, so per-rating counts can be conditional aggregates.
+# Rows loaded before the validation may hold others; they are counted apart and make the query run alone.
+RATINGS = range(VALUE_RANGES['rating'][0], VALUE_RANGES['rating'][1] + 1)
+
+# separates the query name from the aggregate alias in the fused result columns
+_SEPARATOR = '__'
+
+
+class FusionFallback(Exception):
+    """The fused aggregates cannot reproduce the rows of a query, which has to run on its own"""
+
+
+@dataclass
+class FusedPart:
+    name: str
+    table: str
+    aggregates: Dict[str, str]  # alias -> aggregate expression over `table`
+    split: Callable[[Dict[str, Any]], List[Dict[str, Any]]]  # aggregates -> rows of the standalone query
+
+
+def fuse_sql(parts: List[FusedPart]) -> str:
+    """One SELECT computing the aggregates of every part in a single scan"""
+    tables = {part.table for part in parts}
+    if len(tables) != 1:
+        raise ValueError(f"Only queries over the same table can be fused, got {sorted(tables)}")
+    columns = ',\n            '.join(f"{expression} AS {part.name}{_SEPARATOR}{alias}"
+                                    for part in parts for alias, expression in part.aggregates.items())
+    return f"""
+        SELECT
+            {columns}
+        FROM {tables.pop()}
+        """
+
+
+def split_fused(df: pl.DataFrame, parts: List[FusedPart]) -> Dict[str, pl.DataFrame | FusionFallback]:
+    """Result of each part from the single row of a fused query, or the FusionFallback of a part
+    whose standalone query has to run instead"""
+    row = df.row(0, named=True)
+    results = {}
+    for part in parts:
+        values = {alias: row[f"{part.name}{_SEPARATOR}{alias}"] for alias in part.aggregates}
+        try:
+            results[part.name] = pl.DataFrame(part.split(values))
+        except FusionFallback as e:
+            results[part.name] = e
+    return results
+
+
+def _rating_rows(values: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if values['rating_other']:
+        # the GROUP BY of the standalone query has a row for every rating value there is
+        raise FusionFallback(f"{values['rating_other']} reviews rated outside {RATINGS.start}-{RATINGS.stop - 1}")
+    total = values['total']
+    return [
+        {'rating': rating, 'count': values[f"rating_{rating}"],
+         'percentage': values[f"rating_{rating}"] * 100.0 / total}
+        for rating in RATINGS if values[f"rating_{rating}"]
+    ]
+
+
+def _verified_rows(values: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {'verified_purchase': verified, 'count': values[f"{prefix}_count"], 'avg_rating': values[f"{prefix}_avg"]}
+        for verified, prefix in ((False, 'unverified'), (True, 'verified')) if values[f"{prefix}_count"]
+    ]
+
+
+_reviews = f"{clickhouse_config['db_name']}.reviews"
+
+# The overview queries of analysis.py, answered together by one scan of reviews
+fusable_queries = {
+    part.name: part for part in [
+        FusedPart('total_reviews', _reviews, {'count': 'count()'}, lambda v: [{'count': v['count']}]),
+        FusedPart('unique_products', _reviews, {'count': 'uniqExact(asin)'}, lambda v: [{'count': v['count']}]),
+        FusedPart('unique_users', _reviews, {'count': 'uniqExact(user_id)'}, lambda v: [{'count': v['count']}]),
+        FusedPart('date_range', _reviews, {'min_date': 'min(timestamp)', 'max_date': 'max(timestamp)'},
+                  lambda v: [{'min_date': v['min_date'], 'max_date': v['max_date']}]),
+        FusedPart('rating_distribution', _reviews,
+                  {'total': 'count()', **{f"rating_{rating}": f"countIf(rating = {rating})" for rating in RATINGS},
+                   'rating_other': f"countIf(rating NOT BETWEEN {RATINGS.start} AND {RATINGS.stop - 1})"},
+                  _rating_rows),
+        FusedPart('verified_vs_unverified', _reviews,
+                  {'verified_count': 'countIf(verified_purchase)',
+                   'verified_avg': 'avgIf(rating, verified_purchase)',
+                   'unverified_count': 'countIf(NOT verified_purchase)',
+                   'unverified_avg': 'avgIf(rating, NOT verified_purchase)'},
+                  _verified_rows),
+    ]
+}
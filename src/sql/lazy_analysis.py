@@ -0,0 +1,106 @@
+"""The report queries of analysis.py as Polars lazy queries, for the local report backend.
+
+Each entry takes a LazyFrame shaped like the `reviews` table (see report_backends.scan_reviews)
+and returns the same columns, types and order as the ClickHouse query of the same name. Rows
+that tie on the ORDER BY of the SQL come in an unspecified order from ClickHouse; here they are
+ordered by their key so the result is stable.
+"""
+from typing import Callable, Dict
+
+import polars as pl
+
+# ClickHouse returns COUNT(*), COUNT(DISTINCT) and SUM of a Bool as UInt64
+_COUNT = pl.UInt64
+
+
+def _count() -> pl.Expr:
+    return pl.len().cast(_COUNT)
+
+
+def _positive_votes() -> pl.Expr:
+    # CASE WHEN helpful_vote > 0 THEN helpful_vote ELSE 0 END, NULL votes count as 0
+    return pl.when(pl.col('helpful_vote') > 0).then(pl.col('helpful_vote')).otherwise(0).sum()
+
+
+def _negative_votes() -> pl.Expr:
+    return pl.when(pl.col('helpful_vote') < 0).then(pl.col('helpful_vote')).otherwise(0).sum()
+
+
+def _rating_distribution(reviews: pl.LazyFrame) -> pl.LazyFrame:
+    return (
+        reviews.group_by('rating')
+        .agg(_count().alias('count'))
+        .with_columns((pl.col('count') * 100.0 / pl.col('count').sum()).alias('percentage'))
+        .sort('rating')
+    )
+
+
+def _product_popularity(reviews: pl.LazyFrame) -> pl.LazyFrame:
+    return (
+        reviews.group_by('asin')
+        .agg(
+            _count().alias('review_count'),
+            pl.col('rating').mean().alias('avg_rating'),
+            pl.col('rating').min().alias('min_rating'),
+            pl.col('rating').max().alias('max_rating'),
+            _positive_votes().alias('total_helpful_votes'),
+            _negative_votes().alias('total_negative_votes'),
+            pl.col('user_id').n_unique().cast(_COUNT).alias('unique_reviewers'),
+        )
+        .filter(pl.col('review_count') >= 5)
+        .sort(['review_count', 'asin'], descending=[True, False])
+        .head(100)
+    )
+
+
+def _temporal_trends(reviews: pl.LazyFrame) -> pl.LazyFrame:
+    return (
+        reviews.filter(pl.col('timestamp').is_not_null())
+        .group_by(pl.col('timestamp').dt.year().cast(pl.UInt16).alias('year'),
+                  pl.col('timestamp').dt.month().cast(pl.UInt8).alias('month'))
+        .agg(
+            _count().alias('review_count'),
+            pl.col('rating').mean().alias('avg_rating'),
+            pl.col('asin').n_unique().cast(_COUNT).alias('unique_products'),
+            pl.col('user_id').n_unique().cast(_COUNT).alias('unique_users'),
+        )
+        .sort(['year', 'month'])
+        .head(1000)
+    )
+
+
+def _user_behavior(reviews: pl.LazyFrame) -> pl.LazyFrame:
+    return (
+        reviews.group_by('user_id')
+        .agg(
+            _count().alias('total_reviews'),
+            pl.col('rating').mean().alias('avg_rating'),
+            pl.col('rating').min().alias('min_rating'),
+            pl.col('rating').max().alias('max_rating'),
+            pl.col('asin').n_unique().cast(_COUNT).alias('unique_products'),
+            _positive_votes().alias('total_helpful_votes'),
+            _negative_votes().alias('total_negative_votes'),
+            pl.col('verified_purchase').sum().cast(_COUNT).alias('verified_purchases'),
+        )
+        .filter(pl.col('total_reviews') >= 3)
+        .sort(['total_reviews', 'user_id'], descending=[True, False])
+        .head(1000)
+    )
+
+
+lazy_queries: Dict[str, Callable[[pl.LazyFrame], pl.LazyFrame]] = {
+    'total_reviews': lambda reviews: reviews.select(_count().alias('count')),
+    'unique_products': lambda reviews: reviews.select(pl.col('asin').n_unique().cast(_COUNT).alias('count')),
+    'unique_users': lambda reviews: reviews.select(pl.col('user_id').n_unique().cast(_COUNT).alias('count')),
+    'date_range': lambda reviews: reviews.select(pl.col('timestamp').min().alias('min_date'),
+                                                 pl.col('timestamp').max().alias('max_date')),
+    'rating_distribution': _rating_distribution,
+    'verified_vs_unverified': lambda reviews: (
+        reviews.group_by('verified_purchase')
+        .agg(_count().alias('count'), pl.col('rating').mean().alias('avg_rating'))
+        .sort('verified_purchase')
+    ),
+    'product_popularity': _product_popularity,
+    'temporal_trends': _temporal_trends,
+    'user_behavior': _user_behavior,
+}
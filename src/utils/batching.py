@@ -0,0 +1,120 @@
+import threading
+from typing import Any, Dict, List
+
+import polars as pl
+
+from config.config import logger
+
+
+class AdaptiveBatchSizer:
+    """Byte-budgeted batch size for one table, tuned from the observed insert latency.
+
+    The budget is the in-memory size of a batch (`DataFrame.estimated_size()`), so long-text
+    categories get fewer rows per batch instead of more memory. After every insert the budget
+    is adjusted AIMD style: it shrinks when an insert takes longer than `max_latency`, and it
+    grows while inserts are fast and throughput (bytes/sec) keeps up with the best seen so far.
+    The result stays close to the fewest and largest parts ClickHouse can absorb without stalling.
+    """
+
+    GROW = 1.25
+    SHRINK = 0.7
+
+    def __init__(self, table: str, budget_bytes: int, min_bytes: int | None = None, max_bytes: int | None = None,
+                 max_latency: float = 2.0, max_rows: int = 50000):
+        self.table = table
+        self.budget_bytes = budget_bytes
+        self.min_bytes = min_bytes or max(budget_bytes // 16, 1024 * 1024)
+        self.max_bytes = max_bytes or budget_bytes * 8
+        self.max_latency = max_latency
+        self.max_rows = max_rows
+        # running estimates used to turn the budget into reader hints
+        self.raw_bytes_per_frame_byte = 1.0
+        self.frame_bytes_per_row = 1024.0
+        self.best_throughput = 0.0
+        self.inserts = 0
+        self._lock = threading.Lock()
+
+    def observe_input(self, raw_bytes: int, frame_bytes: int, rows: int) -> None:
+        """Learn how raw JSON bytes relate to frame bytes and rows after a chunk is parsed"""
+        if not rows or not frame_bytes:
+            return
+        with self._lock:
+            self.raw_bytes_per_frame_byte = 0.8 * self.raw_bytes_per_frame_byte + 0.2 * raw_bytes / frame_bytes
+            self.frame_bytes_per_row = 0.8 * self.frame_bytes_per_row + 0.2 * frame_bytes / rows
+
+    def observe_insert(self, rows: int, frame_bytes: int, seconds: float) -> None:
+        """Adjust the budget from one insert"""
+        with self._lock:
+            self.inserts += 1
+            if rows:
+                self.frame_bytes_per_row = 0.8 * self.frame_bytes_per_row + 0.2 * frame_bytes / rows
+            throughput = frame_bytes / max(seconds, 1e-6)
+            if seconds > self.max_latency:
+                factor = self.SHRINK
+            elif seconds < self.max_latency / 2 and throughput >= 0.9 * self.best_throughput:
+                factor = self.GROW
+            else:
+                factor = 1.0
+            # the best throughput decays slowly so a single lucky insert doesn't pin the budget
+            self.best_throughput = max(0.98 * self.best_throughput, throughput)
+            budget = min(max(int(self.budget_bytes * factor), self.min_bytes), self.max_bytes)
+            if budget != self.budget_bytes:
+                logger.debug(f"Batch budget for '{self.table}': {self.budget_bytes} -> {budget} bytes "
+                             f"(insert took {seconds:.2f}s)")
+            self.budget_bytes = budget
+
+    def raw_bytes_hint(self) -> int:
+        """Raw JSONL bytes to read for one batch"""
+        return max(int(self.budget_bytes * self.raw_bytes_per_frame_byte), 1)
+
+    def rows_hint(self) -> int:
+        """Rows in one batch, for readers that can only cut by line count"""
+        return max(min(int(self.budget_bytes / self.frame_bytes_per_row), self.max_rows), 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'budget_mb': round(self.budget_bytes / (1024 * 1024), 1),
+            'rows_hint': self.rows_hint(),
+            'inserts': self.inserts,
+            'best_mb_per_sec': round(self.best_throughput / (1024 * 1024), 1),
+        }
+
+
+class FrameBuffer:
+    """Accumulates the frames of one table across source batches until its own budget is reached.
+
+    Each frame is tagged with the sequence number of the source batch it came from, so the
+    checkpoint can be told which batches are committed once the buffer is flushed. Without a
+    sizer the buffer flushes at `max_rows` rows, or on every frame when that is not set either.
+    """
+
+    def __init__(self, table: str, sizer: AdaptiveBatchSizer | None = None, max_rows: int | None = None):
+        self.table = table
+        self.sizer = sizer
+        self.max_rows = sizer.max_rows if sizer else max_rows
+        self._seqs: List[int] = []
+        self._frames: List[pl.DataFrame] = []
+        self._bytes = 0
+        self._rows = 0
+
+    def add(self, seq: int, df: pl.DataFrame) -> tuple[List[int], pl.DataFrame] | None:
+        """Buffer a frame; returns (seqs, frame) to flush once the budget or the row cap is reached"""
+        self._seqs.append(seq)
+        if not df.is_empty():
+            self._frames.append(df)
+            self._bytes += df.estimated_size()
+            self._rows += len(df)
+        if self.max_rows is None or self._rows >= self.max_rows:
+            return self.drain()
+        if self.sizer is not None and self._bytes >= self.sizer.budget_bytes:
+            return self.drain()
+        return None
+
+    def drain(self) -> tuple[List[int], pl.DataFrame] | None:
+        """Everything buffered so far, or None if nothing is pending"""
+        if not self._seqs:
+            return None
+        seqs = self._seqs
+        df = pl.concat(self._frames, how='vertical_relaxed') if self._frames else pl.DataFrame()
+        self._seqs, self._frames, self._bytes, self._rows = [], [], 0, 0
+        return seqs, df
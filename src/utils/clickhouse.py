@@ -1,27 +1,69 @@
-from dbutils import Query
+import threading
+
 import polars as pl
 
-from config.config import clickhouse_config, logger
+from config.config import clickhouse_config, logger, missing_clickhouse_settings
+from src.utils.writers import make_writer
+
+# dbutils.Query, imported with the first connection of the process (see _query_class)
+Query = None
+
+
+def _query_class():
+    global Query
+    if Query is None:
+        from dbutils import Query as DbutilsQuery
+        Query = DbutilsQuery
+    return Query
+
 
 class ClickHouseDB:
-    def __init__(self):
+    """ClickHouse connection that is opened by the first query or write and reused afterwards,
+    so commands that end up not touching the server never pay for it"""
+
+    def __init__(self, writer: str | None = None):
+        self._q = None
+        self._writer = None
+        # backend used by sql_write_df, see src/utils/writers.py
+        self.writer_name = writer or clickhouse_config['writer']
+        self._connect_lock = threading.Lock()
+
+    @property
+    def q(self):
+        if self._q is None:
+            with self._connect_lock:
+                if self._q is None:
+                    self._q = self._connect()
+        return self._q
+
+    def _connect(self):
+        missing = missing_clickhouse_settings()
+        if missing:
+            logger.error(f"Missing ClickHouse settings: {', '.join(missing)} (see .env.example)")
+            raise ValueError(f"Missing ClickHouse settings: {', '.join(missing)} (see .env.example)")
         logger.info("Connecting to ClickHouse...")
-        self.q = Query(
-            db_type=clickhouse_config['db_type'],
-            db=clickhouse_config['db_name'],
-            db_user=clickhouse_config['db_user'],
-            db_pass=clickhouse_config['db_pass'],
-            db_host=clickhouse_config['db_host'],
-            db_port=str(clickhouse_config['db_port'])
-        )
-        # check connection
         try:
-            self.q.sql_query("SELECT 1 AS test")
-            logger.info(f"Successfully Connected to ClickHouse database: {clickhouse_config['db_name']}")
+            q = _query_class()(
+                db_type=clickhouse_config['db_type'],
+                db=clickhouse_config['db_name'],
+                db_user=clickhouse_config['db_user'],
+                db_pass=clickhouse_config['db_pass'],
+                db_host=clickhouse_config['db_host'],
+                db_port=str(clickhouse_config['db_port'])
+            )
         except Exception as e:
             logger.error("Failed to connect to ClickHouse")
             raise e
-        
+        # no round trip to check it, the first real query reports an unreachable server
+        logger.info(f"Connected to ClickHouse database: {clickhouse_config['db_name']}")
+        return q
+
+    @property
+    def writer(self):
+        if self._writer is None:
+            # the dbutils writer inserts through the connection, the http one has its own pool
+            self._writer = make_writer(self.writer_name, self.q if self.writer_name == 'dbutils' else None)
+        return self._writer
 
     def sql_query(self, sql: str) -> pl.DataFrame:
         logger.info(f"Executing SQL query")
@@ -35,13 +77,11 @@ class ClickHouseDB:
 
         if type(df) is not pl.DataFrame:
             raise ValueError("df must be a Polars DataFrame")
-        
-        self.q.sql_write(
+
+        self.writer.write(
             df=df,
             schema=schema,
             table_name=table_name,
             max_chunk=max_chunk
             )
         logger.info(f"Successfully wrote DataFrame to table {table_name}.")
-
-
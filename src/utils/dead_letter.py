@@ -0,0 +1,88 @@
+import gzip
+import io
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+import polars as pl
+
+from config.config import logger
+from src.utils.jsonl import RAW_LINE_COLUMN, decode_json_line
+from src.utils.validation import REJECT_REASON_COLUMN
+
+DEAD_LETTER_DIR = '.dead_letter'
+DEAD_LETTER_SUFFIX = '.rejected.ndjson.gz'
+
+
+class DeadLetterSink:
+    """Rejected rows, kept per source file and table in `<data_folder>/.dead_letter/`.
+
+    Files are named `<source>.<table>.rejected.ndjson.gz`, so the ingest glob for
+    `*.jsonl.gz` never picks them up. Every write appends a gzip member, which keeps
+    the file valid after a crash and across resumed runs. Each row carries its
+    `_reject_reason`, and unparseable lines keep their original text in `_raw`.
+    """
+
+    def __init__(self, data_folder: str):
+        self.root = Path(data_folder) / DEAD_LETTER_DIR
+        self._lock = threading.Lock()
+
+    def path(self, source: str, table: str) -> Path:
+        return self.root / f"{source}.{table}{DEAD_LETTER_SUFFIX}"
+
+    def write(self, source: str, table: str, rejected: pl.DataFrame) -> None:
+        buffer = io.BytesIO()
+        rejected.write_ndjson(buffer)
+        path = self.path(source, table)
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with gzip.open(path, 'ab') as f:
+                f.write(buffer.getvalue())
+        reasons = rejected.get_column(REJECT_REASON_COLUMN).value_counts(sort=True).head(3).rows()
+        logger.warning(f"Rejected {len(rejected)} rows for '{table}' from {source} into {path} "
+                       f"(top reasons: {', '.join(f'{reason} x{count}' for reason, count in reasons)})")
+
+    def files(self) -> List[Path]:
+        """Dead-letter files to replay, including ones a previous replay claimed but did not finish"""
+        if not self.root.exists():
+            return []
+        return sorted(self.root.glob(f"*{DEAD_LETTER_SUFFIX}*"))
+
+
+def parse_dead_letter_name(path: Path) -> tuple[str, str]:
+    """(source, table) from a dead-letter file name"""
+    stem = path.name.split(DEAD_LETTER_SUFFIX)[0]
+    source, table = stem.rsplit('.', 1)
+    return source, table
+
+
+def read_dead_letter(path: Path) -> List[str]:
+    """The rejected rows of a dead-letter file as JSON lines in their input layout.
+
+    Lines that could not be decoded come back as their original text, other rows
+    without the `_reject_reason` and helper columns. Hand-edited rows are read
+    as text, so a value of the wrong type does not fail the whole file.
+    """
+    lines = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = decode_json_line(line)
+            if row.get(RAW_LINE_COLUMN) is not None:
+                lines.append(row[RAW_LINE_COLUMN])
+            else:
+                lines.append(json.dumps({k: v for k, v in row.items() if not k.startswith('_')}))
+    return lines
+
+
+def claim_dead_letter(path: Path) -> Path:
+    """Move a dead-letter file aside before replaying it, so rows rejected again start a fresh file"""
+    if not path.name.endswith(DEAD_LETTER_SUFFIX):
+        return path  # already claimed by a replay that did not finish
+    claimed = path.with_name(f"{path.name}.{time.time_ns()}.replaying")
+    os.replace(path, claimed)
+    return claimed
@@ -0,0 +1,187 @@
+import gzip
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+import polars as pl
+
+from config.config import logger
+from src.utils.jsonl import decode_review_line, parse_jsonl_chunk
+
+# A plain .jsonl.gz can only be inflated front to back on one thread. The one-time
+# pre-pass below rewrites it as a multi-member gzip file: every member holds a
+# newline-aligned segment of about `segment_bytes` uncompressed bytes and can be
+# inflated on its own. A sidecar index stores the byte range of each member, so
+# segments can be decompressed and parsed by a pool of processes. The segmented
+# file is still a valid gzip stream with exactly the same lines as the source.
+#
+# Neither sidecar matches '*.jsonl.gz', so `ingest_data_folder` never picks them up.
+SEGMENTS_SUFFIX = '.segments'
+INDEX_SUFFIX = '.segments.json'
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+
+
+def segmented_path(file_path: str) -> Path:
+    return Path(f"{file_path}{SEGMENTS_SUFFIX}")
+
+
+def index_path(file_path: str) -> Path:
+    return Path(f"{file_path}{INDEX_SUFFIX}")
+
+
+def _source_signature(file_path: str) -> Dict[str, int]:
+    stat = os.stat(file_path)
+    return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def load_segment_index(file_path: str) -> Dict[str, Any] | None:
+    """Return the segment index of a file, or None if it is missing or the source changed since"""
+    path = index_path(file_path)
+    if not path.exists() or not segmented_path(file_path).exists():
+        return None
+    with open(path) as f:
+        index = json.load(f)
+    signature = _source_signature(file_path)
+    if any(index.get(key) != value for key, value in signature.items()):
+        logger.warning(f"Segment index for {file_path} is stale, ignoring it")
+        return None
+    return index
+
+
+def _ordered_map(executor: Executor, func: Callable, items: Iterable, window: int) -> Iterator[Any]:
+    """Like executor.map, but keeps at most `window` tasks in flight so memory stays bounded"""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn rather than fork so the Polars thread pool of the parent is not inherited
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _compress_segment(args: tuple[bytes, int]) -> tuple[bytes, int]:
+    data, compresslevel = args
+    records = data.count(b'\n') + (0 if data.endswith(b'\n') else 1)
+    return gzip.compress(data, compresslevel=compresslevel), records
+
+
+def resegment_file(file_path: str, segment_bytes: int = DEFAULT_SEGMENT_BYTES, workers: int = 1,
+                   compresslevel: int = 6) -> Dict[str, Any]:
+    """Rewrite a .jsonl.gz file into independently compressed, newline-aligned segments.
+
+    Reading the source is sequential, but the segments are compressed by `workers` processes.
+    """
+    output_path = segmented_path(file_path)
+    tmp_path = output_path.with_name(output_path.name + '.tmp')
+    logger.info(f"Re-segmenting {file_path} into ~{segment_bytes // (1024 * 1024)} MB segments")
+
+    def raw_segments() -> Iterator[tuple[bytes, int]]:
+        with gzip.open(file_path, 'rb') as f:
+            while True:
+                # readlines(hint) stops at the first line end after `hint` bytes
+                lines = f.readlines(segment_bytes)
+                if not lines:
+                    break
+                yield b''.join(lines), compresslevel
+
+    segments = []
+    offset = 0
+    with open(tmp_path, 'wb') as out:
+        if workers > 1:
+            with _process_pool(workers) as executor:
+                compressed = _ordered_map(executor, _compress_segment, raw_segments(), window=workers * 2)
+                for member, records in compressed:
+                    out.write(member)
+                    segments.append({'offset': offset, 'length': len(member), 'records': records})
+                    offset += len(member)
+        else:
+            for member, records in map(_compress_segment, raw_segments()):
+                out.write(member)
+                segments.append({'offset': offset, 'length': len(member), 'records': records})
+                offset += len(member)
+    os.replace(tmp_path, output_path)
+
+    index = {
+        **_source_signature(file_path),
+        'segment_bytes': segment_bytes,
+        'records': sum(segment['records'] for segment in segments),
+        'segments': segments,
+    }
+    with open(index_path(file_path), 'w') as f:
+        json.dump(index, f)
+    logger.info(f"Wrote {len(segments)} segments ({index['records']} records) for {file_path}")
+    return index
+
+
+def _read_segment(path: str, offset: int, length: int) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return gzip.decompress(f.read(length))
+
+
+def _segment_lines(path: str, offset: int, length: int, skip: int) -> List[bytes]:
+    return _read_segment(path, offset, length).splitlines(keepends=True)[skip:]
+
+
+def _segment_chunks(args: tuple[str, int, int, int, int]) -> List[bytes]:
+    path, offset, length, batch_size, skip = args
+    lines = _segment_lines(path, offset, length, skip)
+    return [b''.join(lines[i:i + batch_size]) for i in range(0, len(lines), batch_size)]
+
+
+def _segment_frames(args: tuple[str, int, int, int, int]) -> List[pl.DataFrame]:
+    return [parse_jsonl_chunk(chunk) for chunk in _segment_chunks(args)]
+
+
+def _segment_records(args: tuple[str, int, int, int, int]) -> List[Dict[str, Any]]:
+    path, offset, length, _, skip = args
+    return [decode_review_line(line) for line in _segment_lines(path, offset, length, skip)]
+
+
+def _iter_segments(file_path: str, index: Dict[str, Any], func: Callable, batch_size: int | Callable[[], int],
+                   workers: int, skip_records: int) -> Iterator[Any]:
+    path = str(segmented_path(file_path))
+    # a callable batch size is asked again for every segment, e.g. by an adaptive batch sizer
+    rows = batch_size if callable(batch_size) else lambda: batch_size
+
+    def tasks() -> Iterator[tuple]:
+        # whole segments before `skip_records` are never read, the first one read may be cut
+        remaining = skip_records
+        for segment in index['segments']:
+            if remaining >= segment['records']:
+                remaining -= segment['records']
+                continue
+            yield path, segment['offset'], segment['length'], rows(), remaining
+            remaining = 0
+
+    with _process_pool(workers) as executor:
+        for results in _ordered_map(executor, func, tasks(), window=workers * 2):
+            yield from results
+
+
+def iter_segment_chunks(file_path: str, index: Dict[str, Any], batch_size: int | Callable[[], int], workers: int,
+                        skip_records: int = 0) -> Iterator[bytes]:
+    """Raw chunks of `batch_size` lines, inflated in parallel. A batch never spans two segments."""
+    return _iter_segments(file_path, index, _segment_chunks, batch_size, workers, skip_records)
+
+
+def iter_segment_frames(file_path: str, index: Dict[str, Any], batch_size: int | Callable[[], int], workers: int,
+                        skip_records: int = 0) -> Iterator[pl.DataFrame]:
+    """Polars frames of up to `batch_size` records, inflated and parsed in parallel"""
+    return _iter_segments(file_path, index, _segment_frames, batch_size, workers, skip_records)
+
+
+def iter_segment_records(file_path: str, index: Dict[str, Any], workers: int,
+                         skip_records: int = 0) -> Iterator[Dict[str, Any]]:
+    """Same record stream as `AmazonReviewsIngestion.read_jsonl_gz_file`, inflated and decoded in parallel"""
+    return _iter_segments(file_path, index, _segment_records, 0, workers, skip_records)
@@ -0,0 +1,86 @@
+"""Dry run of `ingest`: what a run would read and how, without connecting to ClickHouse.
+
+Record counts come from what earlier runs left behind: the manifest entry of a finished
+file, the Parquet stage (staging.py, only with `stage` like the ingest itself) or the segment
+index (gzip_segments.py) of the file. Other files are only counted with `count_records`, which
+decompresses them.
+"""
+import gzip
+import json
+import math
+import os
+from pathlib import Path
+from typing import Any, Dict, List
+
+from config.config import logger
+from src.utils.gzip_segments import load_segment_index
+from src.utils.manifest import MANIFEST_DIR, IngestManifest, file_checksum
+
+
+def _count_lines(file_path: str) -> int:
+    lines = 0
+    with gzip.open(file_path, 'rb') as f:
+        while block := f.read(16 * 1024 * 1024):
+            lines += block.count(b'\n')
+    return lines
+
+
+def plan_ingest(data_folder: str, batch_size: int, use_manifest: bool = True, stage: bool = False,
+                count_records: bool = False) -> List[Dict[str, Any]]:
+    """One entry per .jsonl.gz under `data_folder`, largest first like the ingest itself"""
+    files = sorted(Path(data_folder).rglob('*.jsonl.gz'), key=lambda path: path.stat().st_size, reverse=True)
+    # read the manifest only if there is one, a dry run creates nothing
+    manifest = IngestManifest(data_folder) if use_manifest and (Path(data_folder) / MANIFEST_DIR).exists() else None
+    if stage:
+        # staging pulls in the stage writer and metrics, a plan without --stage never reads a stage
+        from src.utils.staging import STAGE_META_FILE, ParquetStaging
+        staging = ParquetStaging()
+    plan = []
+    for path in files:
+        file_path = str(path)
+        size = os.path.getsize(file_path)
+        entry = manifest.get(file_path) if manifest else None
+        if entry and (entry['size'] != size or entry['checksum'] != file_checksum(file_path)):
+            status, skip = 'changed', 0
+        elif entry:
+            status, skip = entry['status'], entry['records_committed']
+        else:
+            status, skip = 'new', 0
+        stage_dir = staging.find(file_path) if stage else None
+        index = load_segment_index(file_path)
+        if status == 'done':
+            records = entry['records_committed']
+        elif stage_dir is not None:
+            records = json.loads((stage_dir / STAGE_META_FILE).read_text())['rows']
+        elif index is not None:
+            records = index['records']
+        else:
+            records = _count_lines(file_path) if count_records else None
+        remaining = 0 if status == 'done' else (records - skip if records is not None else None)
+        plan.append({
+            'file': file_path,
+            'size_mb': round(size / (1024 * 1024), 1),
+            'status': status,
+            'records': records,
+            'skip_records': skip,
+            'batches': math.ceil(remaining / batch_size) if remaining is not None else None,
+            # where the records are read from
+            'source': 'stage' if stage_dir is not None else ('segments' if index else 'gzip'),
+        })
+    return plan
+
+
+def log_plan(plan: List[Dict[str, Any]], batch_size: int) -> None:
+    logger.info(f"Ingest plan ({len(plan)} files, batches of {batch_size} records)")
+    logger.info("-" * 30)
+    for item in plan:
+        records = item['records'] if item['records'] is not None else '?'
+        batches = item['batches'] if item['batches'] is not None else '?'
+        logger.info(f"{Path(item['file']).name:40} | {item['size_mb']:>9} MB | {item['status']:11} | "
+                    f"{records:>10} records | from {item['skip_records']:>9} | {batches:>6} batches | "
+                    f"{item['source']}")
+    pending = [item for item in plan if item['status'] != 'done']
+    batches = [item['batches'] for item in pending]
+    total = f"{sum(batches)} batches" if None not in batches else "unknown batches (pass --count_records)"
+    logger.info("-" * 30)
+    logger.info(f"{len(pending)} files to ingest, {total}")
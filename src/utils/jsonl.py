@@ -0,0 +1,137 @@
+import io
+import json
+from collections import deque
+from itertools import islice
+from typing import Any, BinaryIO, Callable, Dict, IO, Iterator, List
+
+import polars as pl
+
+# Layout of one Amazon Reviews 2023 JSONL record. Passing it to the ndjson reader
+# avoids re-inferring the schema on every chunk.
+RAW_REVIEW_SCHEMA = {
+    'rating': pl.Float64,
+    'title': pl.Utf8,
+    'text': pl.Utf8,
+    'images': pl.List(pl.Struct({
+        'small_image_url': pl.Utf8,
+        'medium_image_url': pl.Utf8,
+        'large_image_url': pl.Utf8,
+        'attachment_type': pl.Utf8,
+    })),
+    'asin': pl.Utf8,
+    'parent_asin': pl.Utf8,
+    'user_id': pl.Utf8,
+    'timestamp': pl.Int64,
+    'helpful_vote': pl.Int64,
+    'verified_purchase': pl.Boolean,
+}
+
+
+def skip_lines(f: IO, count: int) -> None:
+    """Advance a file object past its first `count` lines without decoding them"""
+    if count:
+        deque(islice(f, count), maxlen=0)
+
+
+def iter_line_chunks(f: BinaryIO, batch_size: int) -> Iterator[bytes]:
+    """Yield raw chunks of `batch_size` lines from a binary file object"""
+    while True:
+        # raw lines are only sliced here, the JSON decoding happens in Polars
+        lines = list(islice(f, batch_size))
+        if not lines:
+            break
+        yield b''.join(lines)
+
+
+# Extra columns for lines that could not be decoded: the line itself and why it failed
+RAW_LINE_COLUMN = '_raw'
+PARSE_ERROR_COLUMN = '_parse_error'
+
+
+def decode_json_line(line: str | bytes) -> Dict[str, Any]:
+    """json.loads for the per-record path; an undecodable line becomes a record holding
+    only `_raw` and `_parse_error`, which the batch validation rejects"""
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        return {RAW_LINE_COLUMN: line.rstrip('\r\n'), PARSE_ERROR_COLUMN: str(e)}
+
+
+def _type_error(value: Any, dtype: pl.DataType) -> str | None:
+    """Why the ndjson reader would refuse `value` for a column of `dtype`, or None if it takes it"""
+    if value is None or dtype == pl.Utf8:  # the reader turns any scalar into text
+        return None
+    if dtype == pl.Boolean:
+        valid = isinstance(value, bool)
+    elif dtype == pl.Int64:
+        valid = isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63
+    elif dtype == pl.Float64:
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+    else:
+        valid = isinstance(value, list)
+    return None if valid else f"cannot parse {json.dumps(value)[:100]} ({type(value).__name__}) as {dtype}"
+
+
+def decode_review_line(line: str | bytes) -> Dict[str, Any]:
+    """`decode_json_line` for a raw review line, with the type checks of RAW_REVIEW_SCHEMA. A value
+    the columnar reader would refuse, e.g. a timestamp or boolean written as a string, turns the
+    line into a `_parse_error` record like a malformed one, so every ingest mode rejects it"""
+    record = decode_json_line(line)
+    if not isinstance(record, dict):
+        error = 'not a JSON object'
+    elif PARSE_ERROR_COLUMN in record:
+        return record
+    else:
+        error = next((f"{name}: {error}" for name, dtype in RAW_REVIEW_SCHEMA.items()
+                      if (error := _type_error(record.get(name), dtype))), None)
+        if error is None:
+            return record
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    return {RAW_LINE_COLUMN: line.rstrip('\r\n'), PARSE_ERROR_COLUMN: error}
+
+
+def _unparsed_line(line: bytes, error: Exception) -> pl.DataFrame:
+    return pl.DataFrame({
+        RAW_LINE_COLUMN: [line.decode('utf-8', errors='replace').rstrip('\r\n')],
+        PARSE_ERROR_COLUMN: [str(error).splitlines()[0][:200]],
+    })
+
+
+def _parse_lines(lines: List[bytes]) -> List[pl.DataFrame]:
+    """Bisect a failing chunk: good halves are still decoded in bulk, bad lines end up alone"""
+    try:
+        return [pl.read_ndjson(io.BytesIO(b''.join(lines)), schema=RAW_REVIEW_SCHEMA)]
+    except pl.exceptions.PolarsError as e:
+        if len(lines) == 1:
+            return [_unparsed_line(lines[0], e)]
+        middle = len(lines) // 2
+        return _parse_lines(lines[:middle]) + _parse_lines(lines[middle:])
+
+
+def parse_jsonl_chunk(chunk: bytes) -> pl.DataFrame:
+    """Decode a chunk of raw JSON lines into a Polars frame.
+
+    A malformed line or a value of the wrong type makes the ndjson reader fail the
+    whole chunk; the chunk is then re-read in halves so only the offending lines are
+    lost. They come back as rows with only `_raw` and `_parse_error` set, in file order,
+    so the frame still has one row per line.
+    """
+    try:
+        return pl.read_ndjson(io.BytesIO(chunk), schema=RAW_REVIEW_SCHEMA)
+    except pl.exceptions.PolarsError:
+        lines = [line + b'\n' for line in chunk.split(b'\n') if line.strip()]
+        return pl.concat(_parse_lines(lines), how='diagonal_relaxed')
+
+
+def iter_byte_chunks(f: BinaryIO, budget: Callable[[], int], max_rows: int) -> Iterator[bytes]:
+    """Yield raw chunks of about `budget()` bytes (asked again for every chunk), at most `max_rows` lines each"""
+    while True:
+        # readlines(hint) stops at the first line end after `hint` bytes
+        lines = f.readlines(budget())
+        if not lines:
+            break
+        for i in range(0, len(lines), max_rows):
+            yield b''.join(lines[i:i + max_rows])
@@ -0,0 +1,303 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import polars as pl
+
+from config.config import logger
+
+KEY_INDEX_DIR = '.key_index'
+BASE_FILE = 'base.npy'
+DELTA_PREFIX = 'delta-'
+META_FILE = 'meta.json'
+# layout of the index files, a different one starts a new index
+INDEX_FORMAT = 2
+
+# separates the key columns before hashing, so ('ab', 'c') and ('a', 'bc') differ
+_KEY_SEPARATOR = '\x1f'
+_HASH_SEED = 0x5EED
+_CONTENT_SEED = 0xC0DE
+
+# one entry per indexed key: hash of the key, version of the row (ReplacingMergeTree's version column,
+# 0 without one) and hash of the rest of the row. Arrays of entries are sorted by key, one entry per key.
+ENTRY_DTYPE = np.dtype([('key', '<u8'), ('version', '<i8'), ('content', '<u8')])
+# content of rows indexed from ClickHouse by build_key_index, it matches no row so their next copy is inserted
+UNKNOWN_CONTENT = 0
+_NO_VERSION = np.iinfo(np.int64).min
+
+
+def hash_keys(df: pl.DataFrame, key_columns: List[str]) -> np.ndarray:
+    """64-bit hash of the key columns of every row"""
+    return (df.select(pl.concat_str([pl.col(column).cast(pl.Utf8) for column in key_columns],
+                                    separator=_KEY_SEPARATOR).hash(seed=_HASH_SEED))
+            .to_series().to_numpy().astype(np.uint64, copy=False))
+
+
+def hash_contents(df: pl.DataFrame, columns: List[str]) -> np.ndarray:
+    """64-bit hash of `columns` of every row, nulls included"""
+    if not columns:
+        return np.zeros(len(df), dtype=np.uint64)
+    return (df.select(pl.struct(columns).hash(seed=_CONTENT_SEED))
+            .to_series().to_numpy().astype(np.uint64, copy=False))
+
+
+def row_versions(df: pl.DataFrame, version_column: str | None) -> np.ndarray:
+    """Version of every row as ReplacingMergeTree compares it: DateTime in whole seconds, 0 without a column"""
+    if version_column is None or version_column not in df.columns:
+        return np.zeros(len(df), dtype=np.int64)
+    versions = df.get_column(version_column)
+    if versions.dtype.is_temporal():
+        versions = versions.dt.epoch('s')
+    return versions.cast(pl.Int64).fill_null(_NO_VERSION).to_numpy().astype(np.int64, copy=False)
+
+
+def make_entries(hashes: np.ndarray, versions: np.ndarray | None = None,
+                 contents: np.ndarray | None = None) -> np.ndarray:
+    """Sorted entries, one per key: the one ReplacingMergeTree keeps, the highest version and of those the last"""
+    entries = np.empty(len(hashes), dtype=ENTRY_DTYPE)
+    entries['key'] = hashes
+    entries['version'] = 0 if versions is None else versions
+    entries['content'] = UNKNOWN_CONTENT if contents is None else contents
+    return merge_entries([entries])
+
+
+def merge_entries(arrays: List[np.ndarray]) -> np.ndarray:
+    """Merge arrays of entries given oldest first; per key the highest version wins, the newest on a tie"""
+    arrays = [array for array in arrays if len(array)]
+    if not arrays:
+        return np.empty(0, dtype=ENTRY_DTYPE)
+    entries = np.concatenate(arrays)
+    order = np.lexsort((np.arange(len(entries)), entries['version'], entries['key']))
+    entries = entries[order]
+    last_of_key = np.append(entries['key'][1:] != entries['key'][:-1], True)
+    return entries[last_of_key]
+
+
+def expected_false_positives(lookups: int, keys: int) -> float:
+    """New keys expected to collide with one of `keys` indexed hashes over `lookups` lookups"""
+    return float(f"{lookups * keys / 2 ** 64:.3g}")
+
+
+def _sorted_lookup(entries: np.ndarray, hashes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Whether each hash is in the (non-empty) `entries`, and its position there"""
+    keys = entries['key']
+    positions = np.searchsorted(keys, hashes).clip(max=len(entries) - 1)
+    return keys[positions] == hashes, positions
+
+
+class KeyIndex:
+    """Sorting keys of the rows already inserted into one table, in `<data_folder>/.key_index/<table>/`.
+
+    Every key is kept as a 64-bit hash with the version of its row and a hash of the row's other
+    columns (24 bytes per key), in arrays sorted by key and looked up with a binary search. A row
+    is only dropped when the table would not keep it anyway: its version is lower than the indexed
+    one, or the same with the same content. So an updated review (newer `timestamp`) or an edited
+    one is still inserted, and ReplacingMergeTree keeps it over the old row. Tables without a
+    version column compare the content only.
+
+    The compacted `base.npy` is memory mapped, so worker processes share its pages. Entries added
+    since are held in a few sorted runs merged like an LSM tree, and written as `delta-*.npy` files
+    after every file; other processes pick these up before their next file. Compaction folds the
+    deltas into a new base once no worker is running.
+
+    Two different keys only collide with probability ~ keys / 2^64 per lookup, which is what
+    `stats()` reports as expected false positives. A false positive drops a new row.
+    """
+
+    def __init__(self, data_folder: str, table: str, key_columns: List[str], version_column: str | None = None,
+                 ignore_columns: List[str] = ()):
+        self.table = table
+        self.key_columns = key_columns
+        self.version_column = version_column
+        # left out of the content hash besides the key and version, e.g. ingest_ts stamped per batch
+        self.ignore_columns = set(ignore_columns)
+        self.root = Path(data_folder) / KEY_INDEX_DIR / table
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._runs: List[np.ndarray] = []  # sorted entries not in the base, oldest first
+        self._unflushed: List[np.ndarray] = []  # entries added by this process since its last delta file
+        self._seen_deltas: set[str] = set()
+        self.lookups = 0
+        self.dropped = 0
+        self._check_meta()
+        self.base = self._load_base()
+        self.refresh()
+
+    def _meta(self) -> Dict[str, Any]:
+        # Polars does not promise the same hash across versions
+        return {'table': self.table, 'key_columns': self.key_columns, 'version_column': self.version_column,
+                'format': INDEX_FORMAT, 'polars_version': pl.__version__}
+
+    def _read_meta(self) -> Dict[str, Any] | None:
+        path = self.root / META_FILE
+        return json.loads(path.read_text()) if path.exists() else None
+
+    def _write_meta(self, **extra) -> None:
+        tmp_path = self.root / f"{META_FILE}.tmp"
+        tmp_path.write_text(json.dumps({**self._meta(), **extra}, indent=2))
+        os.replace(tmp_path, self.root / META_FILE)
+
+    def _check_meta(self) -> None:
+        meta = self._read_meta()
+        if meta is not None and {key: meta.get(key) for key in self._meta()} == self._meta():
+            return
+        if meta is not None:
+            logger.warning(f"Key index of '{self.table}' was built with {meta}, starting a new one. "
+                           f"Run build_key_index to cover the rows already in the table.")
+            for stale in self.root.glob('*.npy'):
+                stale.unlink()
+        self._write_meta()
+
+    @property
+    def table_uuid(self) -> str | None:
+        """UUID of the table the indexed rows went into, see `AmazonReviewsIngestion.check_key_indexes`"""
+        return (self._read_meta() or {}).get('table_uuid')
+
+    @table_uuid.setter
+    def table_uuid(self, uuid: str | None) -> None:
+        self._write_meta(table_uuid=uuid)
+
+    def _load_base(self) -> np.ndarray:
+        path = self.root / BASE_FILE
+        if not path.exists():
+            return np.empty(0, dtype=ENTRY_DTYPE)
+        return np.load(path, mmap_mode='r')
+
+    def _add_run(self, entries: np.ndarray) -> None:
+        """Add sorted entries, merging runs of similar size so lookups only search a few arrays"""
+        self._runs.append(entries)
+        while len(self._runs) > 1 and len(self._runs[-1]) * 2 >= len(self._runs[-2]):
+            newer = self._runs.pop()
+            self._runs[-1] = merge_entries([self._runs[-1], newer])
+
+    def refresh(self) -> None:
+        """Load the delta files other processes wrote since the last refresh"""
+        with self._lock:
+            for path in sorted(self.root.glob(f"{DELTA_PREFIX}*.npy")):
+                if path.name in self._seen_deltas:
+                    continue
+                self._seen_deltas.add(path.name)
+                self._add_run(np.load(path))
+
+    def lookup(self, hashes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Whether each key is indexed, and the version and content of its indexed row"""
+        found = np.zeros(len(hashes), dtype=bool)
+        versions = np.full(len(hashes), _NO_VERSION, dtype=np.int64)
+        contents = np.zeros(len(hashes), dtype=np.uint64)
+        with self._lock:
+            # oldest first, a later entry replaces an earlier one unless its version is lower
+            for entries in [self.base, *self._runs]:
+                if len(entries) == 0:
+                    continue
+                in_entries, positions = _sorted_lookup(entries, hashes)
+                matched = entries[positions]
+                replace = in_entries & (~found | (matched['version'] >= versions))
+                found |= in_entries
+                versions = np.where(replace, matched['version'], versions)
+                contents = np.where(replace, matched['content'], contents)
+        return found, versions, contents
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        return self.lookup(hashes)[0]
+
+    def filter_new(self, df: pl.DataFrame) -> tuple[pl.DataFrame, np.ndarray]:
+        """Rows of `df` the table would keep over what is indexed, the winning one per key within the
+        batch, and their entries to `add` once they are inserted"""
+        hashes = hash_keys(df, self.key_columns)
+        versions = row_versions(df, self.version_column)
+        skip = set(self.key_columns) | self.ignore_columns | {self.version_column}
+        contents = hash_contents(df, [column for column in df.columns if column not in skip])
+        # within the batch: the highest version of a key, the last row on a tie, like the merge would keep
+        order = np.lexsort((np.arange(len(hashes)), versions, hashes))
+        keep = np.zeros(len(hashes), dtype=bool)
+        keep[order[np.append(hashes[order][1:] != hashes[order][:-1], True)]] = True
+        found, indexed_versions, indexed_contents = self.lookup(hashes)
+        stale = found & ((versions < indexed_versions)
+                         | ((versions == indexed_versions) & (contents == indexed_contents)))
+        keep &= ~stale
+        dropped = len(hashes) - int(keep.sum())
+        with self._lock:
+            self.lookups += len(hashes)
+            self.dropped += dropped
+        entries = make_entries(hashes[keep], versions[keep], contents[keep])
+        if dropped == 0:
+            return df, entries
+        return df.filter(pl.Series(keep)), entries
+
+    def add(self, entries: np.ndarray) -> None:
+        """Record the entries of rows that were inserted"""
+        if len(entries) == 0:
+            return
+        with self._lock:
+            self._add_run(entries)
+            self._unflushed.append(entries)
+
+    def _save(self, name: str, entries: np.ndarray) -> None:
+        tmp_path = self.root / f"{name}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, entries)
+        os.replace(tmp_path, self.root / name)
+
+    def flush(self) -> None:
+        """Write the entries added since the last flush as a delta file for the other processes"""
+        with self._lock:
+            if not self._unflushed:
+                return
+            entries = merge_entries(self._unflushed)
+            self._unflushed = []
+            name = f"{DELTA_PREFIX}{time.time_ns()}-{os.getpid()}.npy"
+            self._save(name, entries)
+            self._seen_deltas.add(name)
+
+    def compact(self) -> None:
+        """Merge the base and every delta file into a new base; only while no other process is ingesting"""
+        self.flush()
+        self.refresh()
+        with self._lock:
+            deltas = [self.root / name for name in self._seen_deltas if (self.root / name).exists()]
+            if not deltas:
+                return
+            self._save(BASE_FILE, merge_entries([np.asarray(self.base), *self._runs]))
+            for path in deltas:
+                path.unlink(missing_ok=True)
+            self._seen_deltas.clear()
+            self._runs = []
+            self.base = self._load_base()
+        logger.info(f"Compacted the key index of '{self.table}' to {len(self.base)} keys")
+
+    def replace(self, entries: np.ndarray) -> None:
+        """Make the index hold exactly `entries`, e.g. the keys read back from ClickHouse (see make_entries)"""
+        with self._lock:
+            self._save(BASE_FILE, merge_entries([entries]))
+            for path in self.root.glob(f"{DELTA_PREFIX}*.npy"):
+                path.unlink(missing_ok=True)
+            self._seen_deltas.clear()
+            self._runs = []
+            self._unflushed = []
+            self.base = self._load_base()
+
+    def clear(self) -> None:
+        """Forget every key, e.g. when the table was emptied or recreated"""
+        self.replace(np.empty(0, dtype=ENTRY_DTYPE))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.base) + sum(len(run) for run in self._runs)
+
+    def stats(self) -> Dict[str, Any]:
+        keys = len(self)
+        with self._lock:
+            in_memory = sum(run.nbytes for run in self._runs)
+            return {
+                'keys': keys,
+                'base_mb': round(self.base.nbytes / (1024 * 1024), 1),  # memory mapped, shared between processes
+                'in_memory_mb': round(in_memory / (1024 * 1024), 1),
+                'lookups': self.lookups,
+                'duplicates_dropped': self.dropped,
+                # chance that a new key hashes to one already indexed, summed over the lookups
+                'expected_false_positives': expected_false_positives(self.lookups, keys),
+            }
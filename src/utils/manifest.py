@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable
+
+from config.config import logger
+
+MANIFEST_DIR = '.ingest_manifest'
+
+# bytes hashed at each end of the file for the checksum
+CHECKSUM_SAMPLE_BYTES = 1024 * 1024
+
+
+def file_checksum(file_path: str, sample_bytes: int = CHECKSUM_SAMPLE_BYTES) -> str:
+    """Fast content fingerprint: sha256 over the size plus the first and last `sample_bytes`.
+
+    Hashing a whole 20 GB category would cost as much as decompressing it; the size and both
+    ends are enough to tell a re-downloaded or appended file from the one we ingested.
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(sample_bytes))
+        if size > sample_bytes:
+            f.seek(max(size - sample_bytes, sample_bytes))
+            digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+class IngestManifest:
+    """Processed-file manifest kept in `<data_folder>/.ingest_manifest/`.
+
+    There is one small JSON file per source file, so worker processes ingesting
+    different files never write to the same manifest file.
+    """
+
+    def __init__(self, data_folder: str):
+        self.root = Path(data_folder) / MANIFEST_DIR
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, file_path: str) -> Path:
+        key = hashlib.sha1(str(Path(file_path).resolve()).encode()).hexdigest()[:16]
+        return self.root / f"{key}.json"
+
+    def get(self, file_path: str) -> Dict[str, Any] | None:
+        path = self._entry_path(file_path)
+        if not path.exists():
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save(self, entry: Dict[str, Any]) -> None:
+        entry['updated_at'] = _now()
+        path = self._entry_path(entry['file_path'])
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, path)  # atomic, a crash never leaves a half written entry
+
+    def is_done(self, file_path: str) -> bool:
+        """True if the file was fully ingested and has not changed since"""
+        entry = self.get(file_path)
+        return bool(entry) and entry['status'] == 'done' \
+            and entry['size'] == os.path.getsize(file_path) and entry['checksum'] == file_checksum(file_path)
+
+    def checkpoint(self, file_path: str, tables: Iterable[str]) -> 'FileCheckpoint':
+        """Checkpoint for ingesting `file_path`, resuming a previous partial run of the same content"""
+        size = os.path.getsize(file_path)
+        checksum = file_checksum(file_path)
+        entry = self.get(file_path)
+        if entry and entry['size'] == size and entry['checksum'] == checksum and entry['status'] != 'done':
+            logger.info(f"Resuming {file_path} from record {entry['records_committed']} "
+                        f"(batch {entry['batches_committed']})")
+        else:
+            if entry and entry['status'] == 'done':
+                logger.info(f"{file_path} changed since it was ingested, starting over")
+            entry = {
+                'file_path': str(Path(file_path).resolve()),
+                'size': size,
+                'checksum': checksum,
+                'records_committed': 0,
+                'batches_committed': 0,
+                'status': 'in_progress',
+                'started_at': _now(),
+            }
+            self.save(entry)
+        return FileCheckpoint(self, entry, tables)
+
+
+class FileCheckpoint:
+    """Tracks which batches of one file have been written to every table.
+
+    Batches are numbered in file order and registered with the record offset they end at.
+    The committed offset only moves forward over a contiguous run of batches whose inserts
+    all succeeded, so out-of-order inserts (pipelined mode) or an image buffer that is
+    flushed later never let the manifest skip rows that are not in ClickHouse yet.
+    """
+
+    def __init__(self, manifest: IngestManifest | None, entry: Dict[str, Any], tables: Iterable[str]):
+        self.manifest = manifest
+        self.entry = entry
+        self.tables = set(tables)
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._next_seq = 0
+        self._lock = threading.Lock()
+
+    @property
+    def start_record(self) -> int:
+        """Records already committed by a previous run, to be skipped when reading"""
+        return self.entry['records_committed']
+
+    def register(self, seq: int, end_record: int, tables: Iterable[str] | None = None) -> None:
+        """Declare batch `seq` (0-based in this run) covering the file up to `end_record`"""
+        with self._lock:
+            waiting = set(self.tables if tables is None else tables)
+            self._pending[seq] = {'end_record': end_record, 'waiting': waiting}
+            self._advance()
+
+    def commit(self, seq: int, table: str) -> None:
+        """Mark the insert of batch `seq` into `table` as done"""
+        with self._lock:
+            self._pending[seq]['waiting'].discard(table)
+            self._advance()
+
+    def _advance(self) -> None:
+        moved = False
+        while self._next_seq in self._pending and not self._pending[self._next_seq]['waiting']:
+            batch = self._pending.pop(self._next_seq)
+            self.entry['records_committed'] = batch['end_record']
+            self.entry['batches_committed'] += 1
+            self._next_seq += 1
+            moved = True
+        if moved and self.manifest:
+            self.manifest.save(self.entry)
+
+    def finish(self) -> None:
+        with self._lock:
+            if self._pending:
+                raise RuntimeError(f"{len(self._pending)} batches of {self.entry['file_path']} were never committed")
+            self.entry['status'] = 'done'
+            self.entry.pop('last_error', None)
+            if self.manifest:
+                self.manifest.save(self.entry)
+
+    def fail(self, error: Exception) -> None:
+        with self._lock:
+            self.entry['last_error'] = str(error)
+            if self.manifest:
+                self.manifest.save(self.entry)
+
+
+def untracked_checkpoint(file_path: str, tables: Iterable[str]) -> FileCheckpoint:
+    """Checkpoint that is never persisted, used when the manifest is disabled"""
+    entry = {'file_path': str(file_path), 'records_committed': 0, 'batches_committed': 0, 'status': 'in_progress'}
+    return FileCheckpoint(None, entry, tables)
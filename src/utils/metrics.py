@@ -0,0 +1,256 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+from config.config import logger
+
+# upper bounds in seconds, from a fast parse of a small batch to a slow insert under merge pressure
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _key(name: str, labels: Labels) -> str:
+    """`name{a="1",b="2"}`, the Prometheus series name, also used as the key in snapshots"""
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def parse_key(key: str) -> Tuple[str, Labels]:
+    """`name{a="1",b="2"}` -> ('name', (('a', '1'), ('b', '2'))), the inverse of the snapshot keys"""
+    if '{' not in key:
+        return key, ()
+    name, rest = key.split('{', 1)
+    pairs = [pair.split('=', 1) for pair in rest.rstrip('}').split(',')]
+    return name, tuple((label, value.strip('"')) for label, value in pairs)
+
+
+class MetricsRegistry:
+    """Counters, gauges and latency histograms shared by every thread of the process.
+
+    Snapshots are plain dicts, so worker processes can send theirs back with
+    their file stats and the parent merges them into its own registry.
+    """
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started = time.time()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            histogram['buckets'][bisect_left(self.buckets, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Observe the duration of the block into histogram `name`, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed_iter(self, iterable: Iterable, name: str, **labels) -> Iterator:
+        """Yield from `iterable`, observing how long each item took to produce"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - start, **labels)
+            yield item
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'counters': {_key(*key): value for key, value in self._counters.items()},
+                'gauges': {_key(*key): value for key, value in self._gauges.items()},
+                'histograms': {_key(*key): {**value, 'buckets': list(value['buckets'])}
+                               for key, value in self._histograms.items()},
+            }
+
+    def drain(self) -> Dict[str, Any]:
+        """Snapshot of the counters and histograms, which are then reset; gauges are kept"""
+        snapshot = self.snapshot()
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+        return snapshot
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """Add a snapshot from another process (see `drain`)"""
+        with self._lock:
+            for key, value in snapshot['counters'].items():
+                parsed = parse_key(key)
+                self._counters[parsed] = self._counters.get(parsed, 0) + value
+            for key, value in snapshot['histograms'].items():
+                parsed = parse_key(key)
+                histogram = self._histograms.setdefault(
+                    parsed, {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0})
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], value['buckets'])]
+                histogram['sum'] += value['sum']
+                histogram['count'] += value['count']
+
+    def to_json(self) -> Dict[str, Any]:
+        """Snapshot plus per-second rates of every counter and mean latencies, for the stats file"""
+        snapshot = self.snapshot()
+        uptime = max(time.time() - self.started, 1e-6)
+        return {
+            'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'uptime_s': round(uptime, 1),
+            'rates_per_sec': {key: round(value / uptime, 1) for key, value in snapshot['counters'].items()},
+            'mean_latency_s': {key: round(value['sum'] / value['count'], 4)
+                               for key, value in snapshot['histograms'].items() if value['count']},
+            **snapshot,
+            'bucket_bounds': list(self.buckets),
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+
+        def header(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for kind, series in (('counter', snapshot['counters']), ('gauge', snapshot['gauges'])):
+            for key, value in sorted(series.items()):
+                header(parse_key(key)[0], kind)
+                lines.append(f"{key} {value}")
+        for key, value in sorted(snapshot['histograms'].items()):
+            name, labels = parse_key(key)
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), value['buckets']):
+                cumulative += count
+                lines.append(f"{_key(name + '_bucket', labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{_key(name + '_sum', labels)} {value['sum']}")
+            lines.append(f"{_key(name + '_count', labels)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+# one registry per process; ingestion code records into it directly
+metrics = MetricsRegistry()
+
+
+class _PrometheusHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = metrics
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.to_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"metrics endpoint: {format % args}")
+
+
+class MetricsExporter:
+    """Writes the registry to a JSON stats file every `interval` seconds and optionally serves
+    it in Prometheus text format on `port`, while the job runs"""
+
+    def __init__(self, registry: MetricsRegistry = metrics, json_path: str | None = None, port: int | None = None,
+                 interval: float = 5.0, host: str = '0.0.0.0'):
+        self.registry = registry
+        self.json_path = Path(json_path) if json_path else None
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._server: ThreadingHTTPServer | None = None
+        self._last: Tuple[float, Dict[str, float]] | None = None
+
+    def write_json(self) -> None:
+        if self.json_path is None:
+            return
+        stats = self.registry.to_json()
+        # rates since the previous write show current throughput, not the average since start
+        now = time.perf_counter()
+        if self._last is not None:
+            last_time, last_counters = self._last
+            elapsed = max(now - last_time, 1e-6)
+            stats['recent_rates_per_sec'] = {key: round((value - last_counters.get(key, 0)) / elapsed, 1)
+                                             for key, value in stats['counters'].items()}
+        self._last = (now, stats['counters'])
+        self.json_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.json_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f, indent=2)
+        os.replace(tmp_path, self.json_path)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write_json()
+            except OSError as e:
+                logger.warning(f"Could not write metrics to {self.json_path}: {e}")
+
+    def start(self) -> 'MetricsExporter':
+        self._last = (time.perf_counter(), self.registry.snapshot()['counters'])
+        if self.port is not None:
+            handler = type('PrometheusHandler', (_PrometheusHandler,), {'registry': self.registry})
+            self._server = ThreadingHTTPServer((self.host, self.port), handler)
+            self.port = self._server.server_address[1]
+            threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+            logger.info(f"Serving Prometheus metrics on http://{self.host}:{self.port}/metrics")
+        if self.json_path is not None:
+            self._thread = threading.Thread(target=self._loop, name='metrics-json', daemon=True)
+            self._thread.start()
+            logger.info(f"Writing ingest metrics to {self.json_path} every {self.interval:g}s")
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write_json()  # final numbers
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self) -> 'MetricsExporter':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,192 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List
+
+from config.config import logger
+
+# marks the end of the stream on a stage's input queue
+_END = object()
+
+
+class PipelineAborted(Exception):
+    """Raised inside stage threads once another stage has failed"""
+
+
+class StageStats:
+    """Counters for one stage: how long it worked, waited for input and waited on a full output queue"""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.input_stall_seconds = 0.0   # starved: upstream is slower
+        self.output_stall_seconds = 0.0  # blocked: downstream is slower
+        self.queue_max_depth = 0
+        self._queue_depth_sum = 0
+        self._queue_samples = 0
+        self._lock = threading.Lock()
+
+    def record_queue_depth(self, depth: int) -> None:
+        with self._lock:
+            self.queue_max_depth = max(self.queue_max_depth, depth)
+            self._queue_depth_sum += depth
+            self._queue_samples += 1
+
+    def add(self, items: int = 0, busy: float = 0.0, input_stall: float = 0.0, output_stall: float = 0.0) -> None:
+        with self._lock:
+            self.items += items
+            self.busy_seconds += busy
+            self.input_stall_seconds += input_stall
+            self.output_stall_seconds += output_stall
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'busy_s': round(self.busy_seconds, 3),
+            'input_stall_s': round(self.input_stall_seconds, 3),
+            'output_stall_s': round(self.output_stall_seconds, 3),
+            'queue_max_depth': self.queue_max_depth,
+            'queue_avg_depth': round(self._queue_depth_sum / self._queue_samples, 2) if self._queue_samples else 0.0,
+        }
+
+
+class Pipeline:
+    """Runs a source iterator and a chain of stages in threads connected by bounded queues.
+
+    Every stage gets its own input queue of `queue_size` items, so at most
+    `queue_size` batches wait in front of each stage and memory stays capped.
+    A stage with several workers (e.g. inserts in flight) processes items out of order.
+    """
+
+    def __init__(self, source: Callable[[], Iterator[Any]], stages: List[tuple], queue_size: int = 4,
+                 source_name: str = 'source'):
+        self.source = source
+        # stages are (name, func, workers) or (name, func, workers, on_end) tuples. func returns the
+        # item for the next stage, or a list of items to fan out. on_end is called by a worker once the
+        # input is exhausted and returns a list of last items, e.g. a buffer that still has to be flushed.
+        self.stages = [tuple(stage) + (None,) * (4 - len(stage)) for stage in stages]
+        self.queue_size = queue_size
+        self.stats = [StageStats(source_name, 1)] + [StageStats(name, workers) for name, _, workers, _ in self.stages]
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in self.stages]
+        self._abort = threading.Event()
+        self._errors: List[BaseException] = []
+        self._remaining = [workers for _, _, workers, _ in self.stages]
+        self._lock = threading.Lock()
+
+    def _put(self, index: int, item: Any) -> float:
+        """Put into the input queue of stage `index`, returns the time spent blocked"""
+        start = time.perf_counter()
+        while True:
+            # checked before every attempt, a stage that keeps getting room must still stop
+            if self._abort.is_set():
+                raise PipelineAborted()
+            try:
+                self._queues[index].put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        if item is not _END:
+            self.stats[index + 1].record_queue_depth(self._queues[index].qsize())
+        return time.perf_counter() - start
+
+    def _get(self, index: int) -> tuple[Any, float]:
+        start = time.perf_counter()
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted()
+            try:
+                item = self._queues[index].get(timeout=0.1)
+                return item, time.perf_counter() - start
+            except queue.Empty:
+                pass
+
+    def _fail(self, error: BaseException) -> None:
+        if not isinstance(error, PipelineAborted):
+            with self._lock:
+                self._errors.append(error)
+        self._abort.set()
+        # drop the batches still queued so their memory goes now, nothing will process them
+        for stage_queue in self._queues:
+            while True:
+                try:
+                    stage_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _close_stage(self, index: int) -> None:
+        """Called when stage `index` (-1 for the source) is done; the last worker signals the next stage"""
+        if index >= 0:
+            with self._lock:
+                self._remaining[index] -= 1
+                if self._remaining[index] > 0:
+                    return
+        if index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1][2]):
+                self._put(index + 1, _END)
+
+    def _run_source(self) -> None:
+        stats = self.stats[0]
+        try:
+            iterator = iter(self.source())
+            while True:
+                if self._abort.is_set():
+                    raise PipelineAborted()
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats.add(items=1, busy=time.perf_counter() - start)
+                stats.add(output_stall=self._put(0, item))
+            self._close_stage(-1)
+        except BaseException as e:
+            self._fail(e)
+
+    def _forward(self, index: int, result: Any) -> None:
+        if index == len(self.stages) - 1:
+            return
+        for item in (result if isinstance(result, list) else [result]):
+            self.stats[index + 1].add(output_stall=self._put(index + 1, item))
+
+    def _run_stage(self, index: int) -> None:
+        _, func, _, on_end = self.stages[index]
+        stats = self.stats[index + 1]
+        try:
+            while True:
+                item, waited = self._get(index)
+                stats.add(input_stall=waited)
+                if item is _END:
+                    break
+                # an item taken just before another stage failed is dropped, not processed
+                if self._abort.is_set():
+                    raise PipelineAborted()
+                start = time.perf_counter()
+                result = func(item)
+                stats.add(items=1, busy=time.perf_counter() - start)
+                self._forward(index, result)
+            if on_end is not None and not self._abort.is_set():
+                self._forward(index, on_end())
+            self._close_stage(index)
+        except BaseException as e:
+            self._fail(e)
+
+    def run(self) -> Dict[str, Dict[str, Any]]:
+        """Run the pipeline to completion and return per-stage stats; re-raises the first stage error"""
+        threads = [threading.Thread(target=self._run_source, name=f"pipeline-{self.stats[0].name}", daemon=True)]
+        for index, (name, _, workers, _) in enumerate(self.stages):
+            for worker in range(workers):
+                threads.append(threading.Thread(target=self._run_stage, args=(index,),
+                                                name=f"pipeline-{name}-{worker}", daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stage_stats = {stats.name: stats.to_dict() for stats in self.stats}
+        if self._errors:
+            logger.error(f"Pipeline aborted after {len(self._errors)} stage error(s)")
+            raise self._errors[0]
+        return stage_stats
@@ -0,0 +1,136 @@
+"""Report figures, one function per figure so each can be rendered in its own process.
+
+Every function takes plain data (Polars frames / lists) and writes a single file,
+which keeps them picklable for a spawned process pool. matplotlib is imported by the
+first figure drawn, importing it takes longer than most reports spend on their queries.
+"""
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+FIG_SIZE = (12, 8)
+STYLE = 'seaborn-v0_8'
+
+# scatters with more points than this are drawn as a pre-binned 2D histogram
+DENSITY_THRESHOLD = 5000
+DENSITY_BINS = 200
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')  # no display in worker processes
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def scatter_or_density(ax, x: pl.Series, y: pl.Series, threshold: int = DENSITY_THRESHOLD,
+                       bins: int = DENSITY_BINS, **scatter_kwargs) -> None:
+    """Scatter for small series, a log-scaled 2D histogram of all points for large ones"""
+    x_values = x.cast(pl.Float64).to_numpy()
+    y_values = y.cast(pl.Float64).to_numpy()
+    finite = np.isfinite(x_values) & np.isfinite(y_values)
+    x_values, y_values = x_values[finite], y_values[finite]
+    if len(x_values) <= threshold:
+        ax.scatter(x_values, y_values, **scatter_kwargs)
+        return
+    from matplotlib.colors import LogNorm
+    counts, x_edges, y_edges = np.histogram2d(x_values, y_values, bins=bins)
+    # empty bins stay blank instead of taking the lowest color
+    mesh = ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0), norm=LogNorm(), cmap='viridis',
+                         rasterized=True)  # one image instead of bins*bins paths in svg/pdf
+    ax.figure.colorbar(mesh, ax=ax, label='Points per bin')
+
+
+def _save(fig, out_path: Path, dpi: int) -> str:
+    fig.tight_layout()
+    fig.savefig(out_path, dpi=dpi)
+    _pyplot().close(fig)
+    return str(out_path)
+
+
+def render_rating_distribution(rating_data: pl.DataFrame, out_path: Path, dpi: int) -> str:
+    plt = _pyplot()
+    plt.style.use(STYLE)
+    fig, ax = plt.subplots(figsize=FIG_SIZE)
+    ax.bar(rating_data['rating'], rating_data['count'])
+    ax.set_xlabel('Rating')
+    ax.set_ylabel('Number of Reviews')
+    ax.set_title('Distribution of Review Ratings')
+    return _save(fig, out_path, dpi)
+
+
+def render_product_analysis(prod_df: pl.DataFrame, out_path: Path, dpi: int,
+                            density_threshold: int = DENSITY_THRESHOLD) -> str:
+    plt = _pyplot()
+    plt.style.use(STYLE)
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
+
+    # Top products by review count
+    top_20 = prod_df.head(20)
+    ax1.barh(range(len(top_20)), top_20['review_count'])
+    ax1.set_xlabel('Number of Reviews')
+    ax1.set_title('Top 20 Products by Review Count')
+    ax1.set_yticks(range(len(top_20)))
+    ax1.set_yticklabels(top_20['asin'].to_list())
+
+    # Rating vs Review Count
+    scatter_or_density(ax2, prod_df['review_count'], prod_df['avg_rating'], density_threshold, alpha=0.6)
+    ax2.set_xlabel('Number of Reviews')
+    ax2.set_ylabel('Average Rating')
+    ax2.set_title('Average Rating vs Review Count')
+    return _save(fig, out_path, dpi)
+
+
+def render_temporal_trends(temp_df: pl.DataFrame, out_path: Path, dpi: int) -> str:
+    plt = _pyplot()
+    plt.style.use(STYLE)
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(15, 10))
+
+    # Review count over time
+    ax1.plot(temp_df['date'], temp_df['review_count'])
+    ax1.set_xlabel('Date')
+    ax1.set_ylabel('Number of Reviews')
+    ax1.set_title('Review Count Over Time')
+    ax1.tick_params(axis='x', rotation=45)
+
+    # Average rating over time
+    ax2.plot(temp_df['date'], temp_df['avg_rating'], color='red')
+    ax2.set_xlabel('Date')
+    ax2.set_ylabel('Average Rating')
+    ax2.set_title('Average Rating Over Time')
+    ax2.tick_params(axis='x', rotation=45)
+    return _save(fig, out_path, dpi)
+
+
+def render_user_behavior(user_df: pl.DataFrame, out_path: Path, dpi: int,
+                         density_threshold: int = DENSITY_THRESHOLD) -> str:
+    plt = _pyplot()
+    plt.style.use(STYLE)
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(15, 12))
+
+    # Distribution of reviews per user
+    ax1.hist(user_df['total_reviews'].to_numpy(), bins=30, edgecolor='black')
+    ax1.set_xlabel('Number of Reviews per User')
+    ax1.set_ylabel('Frequency')
+    ax1.set_title('Distribution of Reviews per User')
+    ax1.set_yscale('log')
+
+    # Average rating distribution
+    ax2.hist(user_df['avg_rating'].to_numpy(), bins=20, edgecolor='black')
+    ax2.set_xlabel('Average Rating per User')
+    ax2.set_ylabel('Frequency')
+    ax2.set_title('Distribution of Average Ratings per User')
+
+    # Verified purchase ratio
+    ax3.hist(user_df['verified_ratio'].to_numpy(), bins=20, edgecolor='black')
+    ax3.set_xlabel('Verified Purchase Ratio')
+    ax3.set_ylabel('Frequency')
+    ax3.set_title('Distribution of Verified Purchase Ratios')
+
+    # Helpfulness vs Activity
+    scatter_or_density(ax4, user_df['total_reviews'], user_df['helpfulness_ratio'], density_threshold, alpha=0.6)
+    ax4.set_xlabel('Total Reviews')
+    ax4.set_ylabel('Helpfulness Ratio')
+    ax4.set_title('User Activity vs Helpfulness')
+    return _save(fig, out_path, dpi)
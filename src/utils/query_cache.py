@@ -0,0 +1,112 @@
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import polars as pl
+
+from config.config import logger
+
+CACHE_SUFFIX = '.parquet'
+
+# `db.table` references in a query, to find the tables whose version goes into the key
+_TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+`?(\w+)`?\.`?(\w+)`?', re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    """Whitespace and a trailing semicolon do not change a query"""
+    return ' '.join(sql.split()).rstrip(';').strip()
+
+
+def referenced_tables(sql: str) -> List[str]:
+    return sorted({f"{db}.{table}" for db, table in _TABLE_REFERENCE.findall(sql)})
+
+
+def data_versions_sql(database: str) -> str:
+    """Data version per table from its active parts.
+
+    Row count and the highest block number change with every insert, truncate and
+    deduplicating merge, but not with merges that leave the rows as they are.
+    """
+    return f"""
+        SELECT
+            table,
+            sum(rows) AS rows,
+            max(max_block_number) AS max_block
+        FROM system.parts
+        WHERE database = '{database}' AND active
+        GROUP BY table
+    """
+
+
+class QueryCache:
+    """Query results as Parquet files, keyed by normalized SQL plus the data version of its tables.
+
+    A new insert changes the version, so stale results are never read; they simply age out.
+    Files are evicted least recently used first (by mtime, refreshed on every hit) once the
+    cache is over `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: str | Path, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, sql: str, versions: Dict[str, str]) -> str | None:
+        """Cache key of a query, or None when the version of one of its tables is unknown"""
+        tables = referenced_tables(sql)
+        if not tables or any(table not in versions for table in tables):
+            return None
+        fingerprint = '|'.join(f"{table}={versions[table]}" for table in tables)
+        return hashlib.sha256(f"{normalize_sql(sql)}\n{fingerprint}".encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{CACHE_SUFFIX}"
+
+    def get(self, key: str) -> pl.DataFrame | None:
+        path = self.path(key)
+        try:
+            df = pl.read_parquet(path)
+            os.utime(path)  # most recently used
+        except (OSError, pl.exceptions.PolarsError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return df
+
+    def put(self, key: str, df: pl.DataFrame) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            df.write_parquet(tmp_path, compression='zstd')
+            os.replace(tmp_path, path)
+        except (OSError, pl.exceptions.PolarsError) as e:
+            logger.warning(f"Could not cache query result in {path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Drop the least recently used files until the cache fits in `max_bytes`"""
+        with self._lock:
+            files = []
+            for path in self.cache_dir.glob(f"*{CACHE_SUFFIX}"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                logger.debug(f"Evicted cached query result {path.name}")
@@ -0,0 +1,163 @@
+"""Engines the report queries run on.
+
+`clickhouse` is the server the data was ingested into; `AmazonReviewsAnalysis` talks to it
+itself (rollups, result cache, fused scans). `polars` runs the queries of
+src/sql/lazy_analysis.py as Polars lazy queries over local files instead, with no server.
+"""
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import polars as pl
+
+from config.config import logger
+from src.sql.create_schema import get_sorting_key, get_table_columns
+from src.sql.lazy_analysis import lazy_queries
+from src.utils.jsonl import PARSE_ERROR_COLUMN, RAW_REVIEW_SCHEMA
+from src.utils.staging import ParquetStaging
+from src.utils.transform import compile_table_plan
+from src.utils.validation import MAX_TIMESTAMP_COLUMN, compile_table_validator, timestamp_bound
+
+REPORT_BACKENDS = ['clickhouse', 'polars']
+
+_REVIEWS_KEY = 'create_reviews_table'
+# columns of reviews the report reads; the scan only decodes these
+REPORT_COLUMNS = ['user_id', 'parent_asin', 'asin', 'rating', 'helpful_vote', 'verified_purchase', 'timestamp']
+_JSONL_SUFFIXES = ('.jsonl', '.jsonl.gz', '.ndjson')
+
+
+def find_sources(path: str) -> List[Path]:
+    """Review files under `path`: Parquet (stages, exports of `reviews`) and JSONL, plain or gzipped.
+    Hidden folders are skipped, staged .jsonl.gz files are read from their stage instead."""
+    root = Path(path)
+    if root.is_file():
+        return [root]
+    return sorted(
+        file for file in root.rglob('*')
+        if file.is_file() and not any(part.startswith('.') for part in file.relative_to(root).parts)
+        and (file.suffix == '.parquet' or file.name.endswith(_JSONL_SUFFIXES))
+    )
+
+
+def _scan_file(file: Path, staging: ParquetStaging) -> pl.LazyFrame:
+    if file.suffix == '.parquet':
+        return pl.scan_parquet(file)
+    stage_dir = staging.find(str(file)) if file.name.endswith('.jsonl.gz') else None
+    if stage_dir is not None:
+        logger.info(f"Reading {file.name} from its stage {stage_dir}")
+        parts = sorted(str(part) for part in stage_dir.glob('*.parquet'))
+        return pl.scan_parquet(parts).select([*RAW_REVIEW_SCHEMA, PARSE_ERROR_COLUMN])
+    # gzipped files are decompressed as a whole, `python main.py stage` first keeps the memory bounded
+    return pl.scan_ndjson(file, schema=RAW_REVIEW_SCHEMA, ignore_errors=True)
+
+
+def _as_reviews(lf: pl.LazyFrame) -> tuple[pl.LazyFrame, pl.LazyFrame]:
+    """Rows of a raw or already transformed source as they would land in `reviews`: the ingest
+    validation drops bad rows, the transform casts the rest to the table's column types. Also
+    returns the number of dropped rows, which include the lines `scan_ndjson` could not decode."""
+    schema = lf.collect_schema()
+    validator = compile_table_validator(_REVIEWS_KEY)
+    rules = validator.compile(schema)
+    lf = lf.with_columns(timestamp_bound())
+    is_bad = pl.any_horizontal([is_bad.fill_null(False) for is_bad, _ in rules]) if rules else pl.lit(False)
+    skipped = lf.select(is_bad.sum().cast(pl.UInt64).alias('skipped'))
+    plan = compile_table_plan(_REVIEWS_KEY).compile(schema)
+    # DEFAULT now() columns (ingest_ts) are stamped by the server, the plan leaves them out
+    reviews = (lf.filter(~is_bad).drop(MAX_TIMESTAMP_COLUMN).select(plan).select(REPORT_COLUMNS)
+               .with_columns(pl.col('timestamp').dt.truncate('1s')))  # a ClickHouse DateTime holds whole seconds
+    return reviews, skipped
+
+
+def scan_sources(path: str) -> tuple[pl.LazyFrame, pl.LazyFrame]:
+    """Lazy rows of every review file under `path` as they would land in `reviews`, not
+    deduplicated, and a one-row frame with the number of invalid or undecodable rows skipped"""
+    files = find_sources(path)
+    if not files:
+        logger.error(f"No review files (.parquet, .jsonl, .jsonl.gz) found in {path}")
+        raise FileNotFoundError(f"No review files (.parquet, .jsonl, .jsonl.gz) found in {path}")
+    staging = ParquetStaging()
+    scans = [_as_reviews(_scan_file(file, staging)) for file in files]
+    reviews = pl.concat([reviews for reviews, _ in scans], how='vertical')
+    skipped = pl.concat([skipped for _, skipped in scans], how='vertical').select(pl.col('skipped').sum())
+    return reviews, skipped
+
+
+def dedupe_reviews(reviews: pl.LazyFrame) -> pl.LazyFrame:
+    """Rows sharing a sorting key count once, keeping the one with the newest `timestamp` like
+    ReplacingMergeTree(timestamp) after its merges.
+
+    The newest timestamp of every key is found on the key columns alone, and the rows holding it
+    are then picked from a second pass over the sources, so only keys and timestamps are held in
+    memory, not whole rows. Of rows tied on key and timestamp, any one is kept.
+    """
+    columns = {column['name'] for column in get_table_columns(_REVIEWS_KEY)}
+    key_columns = [column for column in get_sorting_key(_REVIEWS_KEY) if column in columns]
+    latest = reviews.group_by(key_columns).agg(pl.col('timestamp').max())
+    return (reviews.join(latest, on=[*key_columns, 'timestamp'], how='semi', nulls_equal=True)
+            .unique(subset=key_columns, keep='any'))
+
+
+def scan_reviews(path: str, dedupe: bool = True) -> pl.LazyFrame:
+    """Lazy `reviews` table over the files under `path`, deduplicated with `dedupe` (see
+    dedupe_reviews); without it every row of the files is counted."""
+    reviews, _ = scan_sources(path)
+    return dedupe_reviews(reviews) if dedupe else reviews
+
+
+class PolarsReportBackend:
+    """Report queries as Polars lazy queries over local review files, no ClickHouse needed.
+
+    Every query of a report is planned on the same scan and collected with `pl.collect_all`,
+    so the files are read and deduplicated once and the queries run on Polars' thread pool
+    (POLARS_MAX_THREADS). The streaming engine processes the files in batches instead of
+    loading them whole.
+    """
+    name = 'polars'
+
+    def __init__(self, source: str, dedupe: bool = True, engine: str = 'streaming'):
+        self.source = source
+        self.dedupe = dedupe
+        self.engine = engine
+        self._reviews: pl.LazyFrame | None = None
+        self._skipped: pl.LazyFrame | None = None
+        if not Path(source).exists():
+            logger.error(f"Local report source {source} does not exist")
+            raise FileNotFoundError(f"Local report source {source} does not exist")
+
+    @property
+    def reviews(self) -> pl.LazyFrame:
+        if self._reviews is None:
+            reviews, self._skipped = scan_sources(self.source)
+            self._reviews = dedupe_reviews(reviews) if self.dedupe else reviews
+        return self._reviews
+
+    def _log_skipped(self, skipped: int) -> None:
+        if skipped:
+            logger.warning(f"Skipped {skipped} invalid or undecodable rows in {self.source}; "
+                           f"the ingest writes them to its dead-letter files instead of `reviews`")
+
+    def plan(self, name: str) -> pl.LazyFrame:
+        if name not in lazy_queries:
+            logger.error(f"Unknown analysis query: {name}")
+            raise ValueError(f"Unknown analysis query: {name}")
+        return lazy_queries[name](self.reviews)
+
+    def fetch(self, name: str) -> pl.DataFrame:
+        df = self.plan(name).collect(engine=self.engine)
+        logger.info(f"Query returned {len(df)} rows")
+        return df
+
+    def run_queries(self, names: List[str]) -> Dict[str, tuple[pl.DataFrame | Exception, float]]:
+        """Result and wall time of every query, collected together; a failure fails them all"""
+        logger.info(f"Collecting {len(names)} report queries over {self.source} with Polars ({self.engine})...")
+        start = time.perf_counter()
+        try:
+            plans = [self.plan(name) for name in names]
+            # the skipped rows are counted on the same scan as the queries
+            *frames, skipped = pl.collect_all([*plans, self._skipped], engine=self.engine)
+            results = dict(zip(names, frames))
+            self._log_skipped(skipped.item())
+        except Exception as e:
+            results = {name: e for name in names}
+        seconds = time.perf_counter() - start
+        return {name: (results[name], seconds) for name in names}
@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List
+
+import polars as pl
+
+from config.config import logger
+from src.utils.jsonl import PARSE_ERROR_COLUMN, RAW_LINE_COLUMN, RAW_REVIEW_SCHEMA
+from src.utils.manifest import file_checksum
+from src.utils.metrics import metrics
+
+STAGING_DIR = '.staging'
+STAGE_META_FILE = 'stage.json'
+# limits of one Parquet file of a stage, whichever is reached first; the frames of a part are held in
+# memory until it is written. A resumed read skips whole files before slicing into one.
+STAGE_PART_ROWS = 500_000
+STAGE_PART_BYTES = 64 * 1024 * 1024
+
+# every part has the same columns, whether or not its lines all parsed
+STAGE_SCHEMA = {**RAW_REVIEW_SCHEMA, RAW_LINE_COLUMN: pl.Utf8, PARSE_ERROR_COLUMN: pl.Utf8}
+
+
+def _stage_name(file_path: str) -> str:
+    return Path(file_path).name.removesuffix('.jsonl.gz')
+
+
+class StageWriter:
+    """Writes the parsed frames of one source file as Parquet parts into a temporary directory,
+    which becomes the stage only when `finish` is called after the whole file was read."""
+
+    def __init__(self, stage_dir: Path, source: str, checksum: str, part_rows: int = STAGE_PART_ROWS,
+                 part_bytes: int = STAGE_PART_BYTES):
+        self.stage_dir = stage_dir
+        self.tmp_dir = stage_dir.with_name(f"{stage_dir.name}.{os.getpid()}.tmp")
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.tmp_dir.mkdir(parents=True)
+        self.source = source
+        self.checksum = checksum
+        self.part_rows = part_rows
+        self.part_bytes = part_bytes
+        self.parts: List[Dict[str, Any]] = []
+        self._frames: List[pl.DataFrame] = []
+        self._rows = 0
+        self._bytes = 0
+
+    def write(self, df: pl.DataFrame) -> None:
+        self._frames.append(df)
+        self._rows += len(df)
+        # long review texts make rows uneven, so the in-memory size bounds a part as well
+        self._bytes += df.estimated_size()
+        if self._rows >= self.part_rows or self._bytes >= self.part_bytes:
+            self._write_part()
+
+    def _write_part(self) -> None:
+        if not self._rows:
+            return
+        df = pl.concat(self._frames, how='diagonal_relaxed')
+        df = df.select([
+            (pl.col(name) if name in df.columns else pl.lit(None)).cast(dtype).alias(name)
+            for name, dtype in STAGE_SCHEMA.items()
+        ])
+        name = f"part-{len(self.parts):05d}.parquet"
+        with metrics.timer('ingest_stage_seconds', stage='stage_write'):
+            df.write_parquet(self.tmp_dir / name, compression='zstd', statistics=False)
+        bad_lines = df.get_column(PARSE_ERROR_COLUMN).is_not_null().sum()
+        self.parts.append({'file': name, 'rows': len(df), 'bad_lines': bad_lines})
+        self._frames, self._rows, self._bytes = [], 0, 0
+
+    def finish(self) -> Path:
+        self._write_part()
+        meta = {'source': self.source, 'checksum': self.checksum, 'rows': sum(part['rows'] for part in self.parts),
+                'parts': self.parts, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        (self.tmp_dir / STAGE_META_FILE).write_text(json.dumps(meta, indent=2))
+        shutil.rmtree(self.stage_dir, ignore_errors=True)
+        os.replace(self.tmp_dir, self.stage_dir)
+        # stages of earlier versions of the file
+        for stale in self.stage_dir.parent.glob(f"{self.source}.*"):
+            if stale != self.stage_dir and stale.name.rsplit('.', 1)[0] == self.source:
+                logger.info(f"Removing outdated stage {stale}")
+                shutil.rmtree(stale, ignore_errors=True)
+        logger.info(f"Staged {meta['rows']} records of {self.source} as {len(self.parts)} Parquet parts "
+                    f"in {self.stage_dir}")
+        return self.stage_dir
+
+    def abort(self) -> None:
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class ParquetStaging:
+    """Parsed source files as ZSTD Parquet, in a `.staging/` folder next to each `.jsonl.gz`.
+
+    A stage is named `<source>.<checksum>` after the content fingerprint of its file (see
+    manifest.file_checksum), so a re-downloaded file gets a new stage and the old one is
+    removed once the new one is complete. Stages hold the frames exactly as parsed, unparseable
+    lines included, so reading one replaces gunzip and JSON decoding and nothing else.
+    """
+
+    def __init__(self, part_rows: int = STAGE_PART_ROWS, part_bytes: int = STAGE_PART_BYTES):
+        self.part_rows = part_rows
+        self.part_bytes = part_bytes
+
+    def stage_dir(self, file_path: str, checksum: str) -> Path:
+        return Path(file_path).parent / STAGING_DIR / f"{_stage_name(file_path)}.{checksum[:16]}"
+
+    def find(self, file_path: str) -> Path | None:
+        """The complete stage of the current content of `file_path`, if there is one"""
+        stage_dir = self.stage_dir(file_path, file_checksum(file_path))
+        return stage_dir if (stage_dir / STAGE_META_FILE).exists() else None
+
+    def writer(self, file_path: str) -> StageWriter:
+        checksum = file_checksum(file_path)
+        return StageWriter(self.stage_dir(file_path, checksum), _stage_name(file_path), checksum, self.part_rows,
+                           self.part_bytes)
+
+    @staticmethod
+    def iter_frames(stage_dir: Path, rows_per_batch: Callable[[], int], skip_records: int = 0,
+                    columns: List[str] | None = None) -> Iterator[pl.DataFrame]:
+        """Batches of a stage, memory mapped and projected on `columns` (all raw columns by default).
+        The helper columns of unparseable lines are only read from parts that have such lines."""
+        meta = json.loads((stage_dir / STAGE_META_FILE).read_text())
+        columns = columns or list(RAW_REVIEW_SCHEMA)
+        for part in meta['parts']:
+            if skip_records >= part['rows']:
+                skip_records -= part['rows']
+                continue
+            part_columns = columns + ([RAW_LINE_COLUMN, PARSE_ERROR_COLUMN] if part['bad_lines'] else [])
+            with metrics.timer('ingest_stage_seconds', stage='stage_read'):
+                df = pl.read_parquet(stage_dir / part['file'], columns=part_columns, memory_map=True)
+            offset, skip_records = skip_records, 0
+            while offset < len(df):
+                batch = df.slice(offset, rows_per_batch())
+                offset += len(batch)
+                metrics.inc('ingest_records_read_total', len(batch))
+                yield batch
@@ -0,0 +1,118 @@
+import io
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from urllib.parse import parse_qs, urlparse
+
+import polars as pl
+
+from config.config import logger
+
+
+@dataclass
+class ReceivedBlock:
+    query: str
+    block_format: str
+    nbytes: int
+    frame: pl.DataFrame
+    client_port: int
+
+    @property
+    def table_name(self) -> str:
+        # "INSERT INTO db.table (...) FORMAT X" -> "db.table"
+        return self.query.split()[2]
+
+
+_DECODERS = {
+    'Parquet': lambda body: pl.read_parquet(io.BytesIO(body)),
+    'ArrowStream': lambda body: pl.read_ipc_stream(io.BytesIO(body)),
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is observable
+
+    def _reply(self, status: int, body: bytes = b'') -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self._reply(200, b'Ok.\n')
+
+    def do_POST(self) -> None:
+        server: 'StandInClickHouseServer' = self.server.standin
+        query = parse_qs(urlparse(self.path).query).get('query', [''])[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        # handler threads run concurrently, so each countdown is claimed under the lock
+        with server.lock:
+            drop = server.drop_next > 0
+            fail = not drop and server.fail_next > 0
+            server.drop_next -= drop
+            server.fail_next -= fail
+        if drop:
+            self.close_connection = True  # hang up without a reply, like a server closing an idle keep-alive
+            return
+        if fail:
+            self._reply(500, b'Code: 999. DB::Exception: simulated failure')
+            return
+
+        block_format = query.rsplit('FORMAT', 1)[-1].strip() if 'FORMAT' in query else ''
+        if block_format in _DECODERS:
+            block = ReceivedBlock(query, block_format, len(body), _DECODERS[block_format](body), self.client_address[1])
+            with server.lock:
+                server.blocks.append(block)
+        else:
+            with server.lock:
+                server.queries.append(query)
+        self._reply(200)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"stand-in ClickHouse: {format % args}")
+
+
+class StandInClickHouseServer:
+    """Local HTTP endpoint that accepts ClickHouse inserts and records the decoded blocks.
+
+    Used to exercise the HTTP writer (and sharded routing) without a running ClickHouse:
+
+        with StandInClickHouseServer() as server:
+            writer = HttpBlockWriter('127.0.0.1', server.port, 'user', 'pass')
+            writer.write(df, 'reviews', 'amazon', max_chunk=50000)
+            assert server.rows('amazon.reviews') == len(df)
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.standin = self
+        self.host, self.port = self.httpd.server_address[:2]
+        self.blocks: List[ReceivedBlock] = []
+        self.queries: List[str] = []
+        self.fail_next = 0  # number of upcoming requests answered with an error
+        self.drop_next = 0  # number of upcoming requests whose connection is closed without a reply
+        self.lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> 'StandInClickHouseServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'StandInClickHouseServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def rows(self, table_name: str | None = None) -> int:
+        return sum(len(block.frame) for block in self.blocks if table_name in (None, block.table_name))
+
+    def client_connections(self) -> int:
+        """Distinct client sockets seen, i.e. how many connections the writer opened"""
+        return len({block.client_port for block in self.blocks})
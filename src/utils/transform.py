@@ -0,0 +1,114 @@
+import polars as pl
+
+from config.config import logger
+from src.sql.create_schema import get_sql_query, get_table_columns
+
+# ClickHouse column types mapped to the Polars dtype we hand to the writer
+CLICKHOUSE_TO_POLARS = {
+    'String': pl.Utf8,
+    'FixedString': pl.Utf8,
+    'UInt8': pl.UInt8,
+    'UInt16': pl.UInt16,
+    'UInt32': pl.UInt32,
+    'UInt64': pl.UInt64,
+    'Int8': pl.Int8,
+    'Int16': pl.Int16,
+    'Int32': pl.Int32,
+    'Int64': pl.Int64,
+    'Float32': pl.Float32,
+    'Float64': pl.Float64,
+    'Bool': pl.Boolean,
+    'Date': pl.Date,
+    'DateTime': pl.Datetime('ms', 'UTC'),
+    'DateTime64': pl.Datetime('ms', 'UTC'),
+}
+
+# String values treated as NULL when a text column feeds a numeric one
+NULL_TOKENS = ['', 'null', 'none']
+
+
+def _unwrap_type(column_type: str) -> tuple[str, bool]:
+    """Strip Nullable()/LowCardinality() wrappers and type arguments, e.g. Nullable(Int64) -> ('Int64', True)"""
+    nullable = False
+    while True:
+        for wrapper in ('Nullable', 'LowCardinality'):
+            if column_type.startswith(f"{wrapper}("):
+                nullable = nullable or wrapper == 'Nullable'
+                column_type = column_type[len(wrapper) + 1:-1]
+                break
+        else:
+            break
+    return column_type.split('(')[0], nullable
+
+
+def _cast_expr(name: str, source: pl.DataType, base_type: str) -> pl.Expr:
+    """Vectorized conversion of one input column into its ClickHouse type"""
+    target = CLICKHOUSE_TO_POLARS[base_type]
+    col = pl.col(name)
+
+    if base_type in ('DateTime', 'DateTime64'):
+        if isinstance(source, pl.Datetime):
+            if source.time_zone is None:
+                return col.dt.replace_time_zone('UTC').cast(target)
+            return col.dt.convert_time_zone('UTC').cast(target)
+        # source timestamps are epoch millis, e.g. 1598567408138; the validation rejects the rest
+        return pl.from_epoch(col.cast(pl.Int64, strict=False), time_unit='ms').dt.replace_time_zone('UTC').cast(target).alias(name)
+
+    if base_type == 'Bool':
+        if source == pl.Utf8:
+            return col.str.strip_chars().str.to_lowercase().is_in(['true', '1']).alias(name)
+        return col.cast(pl.Boolean)
+
+    if base_type in ('String', 'FixedString'):
+        return col.cast(pl.Utf8)
+
+    if source == pl.Utf8:
+        cleaned = col.str.strip_chars()
+        return (
+            pl.when(cleaned.str.to_lowercase().is_in(NULL_TOKENS))
+            .then(None)
+            .otherwise(cleaned)
+            .cast(target)
+            .alias(name)
+        )
+    return col.cast(target)
+
+
+class TablePlan:
+    """Vectorized transform plan for one table, derived from its CREATE TABLE query"""
+
+    def __init__(self, table_name: str, columns: list[dict]):
+        self.table_name = table_name
+        self.columns = columns
+        self._compiled: dict[tuple, list] = {}
+
+    def compile(self, schema: pl.Schema) -> list:
+        """Build the select list for an input schema, an expression per column of the insert"""
+        plan = []
+        for column in self.columns:
+            name = column['name']
+            base_type, nullable = _unwrap_type(column['type'])
+            if base_type not in CLICKHOUSE_TO_POLARS:
+                raise ValueError(f"Unsupported ClickHouse type '{column['type']}' for column '{self.table_name}.{name}'")
+
+            if name in schema:
+                plan.append(_cast_expr(name, schema[name], base_type))
+            elif nullable:
+                plan.append(pl.lit(None, dtype=CLICKHOUSE_TO_POLARS[base_type]).alias(name))
+            # otherwise leave the column out of the insert and let ClickHouse fill it; DEFAULT now()
+            # columns (ingest_ts) then hold the time the insert ran, not when the batch was transformed
+        logger.debug(f"Compiled transform plan for '{self.table_name}' with {len(plan)} columns")
+        return plan
+
+    def apply(self, df: pl.DataFrame) -> pl.DataFrame:
+        """Run a batch through the plan, compiling it once per distinct input schema"""
+        key = tuple(df.schema.items())
+        plan = self._compiled.get(key)
+        if plan is None:
+            plan = self._compiled[key] = self.compile(df.schema)
+        return df.select(plan)
+
+
+def compile_table_plan(key: str) -> TablePlan:
+    """Create the transform plan for a table defined in create_schema.py"""
+    return TablePlan(get_sql_query(key)['table_name'], get_table_columns(key))
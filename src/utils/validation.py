@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+
+from config.config import logger
+from src.sql.create_schema import get_sql_query, get_sorting_key, get_table_columns
+from src.utils.jsonl import PARSE_ERROR_COLUMN, RAW_LINE_COLUMN
+from src.utils.transform import CLICKHOUSE_TO_POLARS, _unwrap_type
+
+# Column added to rejected rows
+REJECT_REASON_COLUMN = '_reject_reason'
+# Latest accepted epoch millis, added while the rules are evaluated (see timestamp_bound)
+MAX_TIMESTAMP_COLUMN = '_max_timestamp_ms'
+
+# Domain limits on top of what the column type allows
+VALUE_RANGES = {
+    'rating': (1, 5),
+    'helpful_vote': (0, None),
+}
+
+# Limits of the integer column types
+INTEGER_RANGES = {
+    'UInt8': (0, 2 ** 8 - 1),
+    'UInt16': (0, 2 ** 16 - 1),
+    'UInt32': (0, 2 ** 32 - 1),
+    'UInt64': (0, 2 ** 64 - 1),
+    'Int8': (-2 ** 7, 2 ** 7 - 1),
+    'Int16': (-2 ** 15, 2 ** 15 - 1),
+    'Int32': (-2 ** 31, 2 ** 31 - 1),
+    'Int64': (-2 ** 63, 2 ** 63 - 1),
+}
+
+# Text accepted for a Bool column
+BOOL_TOKENS = ['true', 'false', '1', '0']
+
+# Amazon reviews start in the mid 90s; anything earlier is usually seconds passed as millis
+TIMESTAMP_MIN = datetime(1995, 1, 1, tzinfo=timezone.utc)
+# allowed clock skew for timestamps in the future
+TIMESTAMP_MAX_AHEAD = timedelta(days=1)
+
+
+def timestamp_bound() -> pl.Expr:
+    """The MAX_TIMESTAMP_COLUMN the rules compare timestamps to, from the clock at the time of the call.
+    Compiled rules are cached for the life of a process, so the bound can't be part of them."""
+    now_ms = int((datetime.now(timezone.utc) + TIMESTAMP_MAX_AHEAD).timestamp() * 1000)
+    return pl.lit(now_ms, pl.Int64).alias(MAX_TIMESTAMP_COLUMN)
+
+
+def _range_check(col: pl.Expr, low: float | None, high: float | None) -> pl.Expr | None:
+    checks = []
+    if low is not None:
+        checks.append(col < low)
+    if high is not None:
+        checks.append(col > high)
+    if not checks:
+        return None
+    out_of_range = checks[0]
+    for check in checks[1:]:
+        out_of_range = out_of_range | check
+    return out_of_range
+
+
+class TableValidator:
+    """Vectorized row validation for one table, derived from its CREATE TABLE query.
+
+    Every rule is an expression that is true for a bad row, paired with the reason
+    reported for it. A batch is split into valid and rejected rows in one pass; the
+    first failing rule of a row is its reject reason.
+    """
+
+    def __init__(self, table_name: str, columns: list[dict], key_columns: list[str]):
+        self.table_name = table_name
+        self.columns = columns
+        self.key_columns = key_columns
+        self._compiled: dict[tuple, list] = {}
+
+    def compile(self, schema: pl.Schema) -> list[tuple[pl.Expr, str]]:
+        """Rules for an input schema as (is_bad, reason) pairs; evaluate them on a frame with timestamp_bound()"""
+        rules = []
+        if PARSE_ERROR_COLUMN in schema:
+            rules.append((pl.col(PARSE_ERROR_COLUMN).is_not_null(),
+                          pl.lit('unparseable line: ') + pl.col(PARSE_ERROR_COLUMN)))
+
+        for column in self.columns:
+            name = column['name']
+            base_type, nullable = _unwrap_type(column['type'])
+            if name not in schema:
+                if not nullable and not column['default']:
+                    rules.append((pl.lit(True), pl.lit(f"missing column {name}")))
+                continue
+            col, source = pl.col(name), schema[name]
+
+            if not nullable and not column['default']:
+                rules.append((col.is_null(), pl.lit(f"missing {name}")))
+            if name in self.key_columns and source == pl.Utf8:
+                rules.append((col.str.strip_chars() == '', pl.lit(f"empty {name}")))
+
+            if base_type in INTEGER_RANGES or base_type in ('Float32', 'Float64'):
+                if source == pl.Utf8:
+                    # only the records path hands over strings; the transform casts them later
+                    target = CLICKHOUSE_TO_POLARS[base_type]
+                    rules.append((col.is_not_null() & col.cast(target, strict=False).is_null(),
+                                  pl.lit(f"{name} is not a valid {base_type}")))
+                    col = col.cast(target, strict=False)
+                elif base_type in INTEGER_RANGES and source.is_float():
+                    rules.append((col != col.floor(), pl.lit(f"{name} is not a whole number")))
+                low, high = INTEGER_RANGES.get(base_type, (None, None))
+                domain_low, domain_high = VALUE_RANGES.get(name, (None, None))
+                low = domain_low if domain_low is not None else low
+                high = domain_high if domain_high is not None else high
+                out_of_range = _range_check(col, low, high)
+                if out_of_range is not None:
+                    rules.append((out_of_range, pl.lit(f"{name} out of range")))
+
+            elif base_type == 'Bool' and source == pl.Utf8:
+                # see transform._cast_expr, anything else would be stored as false
+                rules.append((~col.str.strip_chars().str.to_lowercase().is_in(BOOL_TOKENS),
+                              pl.lit(f"{name} is not a valid Bool")))
+
+            elif base_type in ('DateTime', 'DateTime64') and (source.is_integer() or source == pl.Utf8):
+                # epoch millis, see transform._cast_expr
+                if source == pl.Utf8:
+                    rules.append((col.is_not_null() & col.cast(pl.Int64, strict=False).is_null(),
+                                  pl.lit(f"{name} is not a valid epoch timestamp")))
+                    col = col.cast(pl.Int64, strict=False)
+                low = int(TIMESTAMP_MIN.timestamp() * 1000)
+                rules.append(((col < low) | (col > pl.col(MAX_TIMESTAMP_COLUMN)), pl.lit(f"{name} out of range")))
+
+        logger.debug(f"Compiled {len(rules)} validation rules for '{self.table_name}'")
+        return rules
+
+    def split(self, df: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame]:
+        """Valid rows and rejected rows (with a `_reject_reason` column) of a batch"""
+        key = tuple(df.schema.items())
+        rules = self._compiled.get(key)
+        if rules is None:
+            # compiled once per distinct input schema, like the transform plans
+            rules = self._compiled[key] = self.compile(df.schema)
+        helper_columns = [c for c in (RAW_LINE_COLUMN, PARSE_ERROR_COLUMN) if c in df.columns]
+        if not rules or df.is_empty():
+            return df.drop(helper_columns), df.clear().with_columns(pl.lit(None, pl.Utf8).alias(REJECT_REASON_COLUMN))
+
+        reason = pl.coalesce([pl.when(is_bad).then(why) for is_bad, why in rules]).alias(REJECT_REASON_COLUMN)
+        checked = df.with_columns(timestamp_bound()).with_columns(reason).drop(MAX_TIMESTAMP_COLUMN)
+        bad = checked.get_column(REJECT_REASON_COLUMN).is_not_null()
+        if not bad.any():
+            return df.drop(helper_columns), checked.clear()
+        valid = checked.filter(~bad).drop([REJECT_REASON_COLUMN] + helper_columns)
+        return valid, checked.filter(bad)
+
+
+def compile_table_validator(key: str) -> TableValidator:
+    """Create the validator for a table defined in create_schema.py"""
+    return TableValidator(get_sql_query(key)['table_name'], get_table_columns(key), get_sorting_key(key))
@@ -0,0 +1,285 @@
+import base64
+import http.client
+import io
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+from urllib.parse import urlencode
+
+import polars as pl
+
+from config.config import clickhouse_config, logger
+from src.utils.metrics import metrics, parse_key
+
+# Compression codecs each block format can carry inside the payload
+BLOCK_FORMATS = {
+    'parquet': {'clickhouse_format': 'Parquet', 'compressions': ('zstd', 'lz4', 'snappy', 'uncompressed')},
+    'arrow': {'clickhouse_format': 'ArrowStream', 'compressions': ('zstd', 'lz4', 'uncompressed')},
+}
+
+
+class DbutilsWriter:
+    """Writes through `dbutils.Query.sql_write`, the original path"""
+    name = 'dbutils'
+    thread_safe = False  # one dbutils connection, one insert at a time
+
+    def __init__(self, q):
+        self.q = q
+
+    def write(self, df: pl.DataFrame, table_name: str, schema: str, max_chunk: int) -> None:
+        self.q.sql_write(df=df, schema=schema, table_name=table_name, max_chunk=max_chunk)
+
+
+class HttpConnectionPool:
+    """Keep-alive HTTP connections to one ClickHouse host, shared by every thread in the process"""
+
+    def __init__(self, host: str, port: int, size: int = 4, timeout: float = 300):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.opened = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[http.client.HTTPConnection]:
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self.opened += 1
+            try:
+                yield conn
+            except Exception:
+                conn.close()  # don't hand a connection in an unknown state to the next caller
+                raise
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+
+_pools: dict[tuple, HttpConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(host: str, port: int, size: int) -> HttpConnectionPool:
+    """One pool per host and port in each process, reused by every writer that targets it"""
+    with _pools_lock:
+        key = (host, int(port))
+        if key not in _pools:
+            _pools[key] = HttpConnectionPool(host, int(port), size)
+        return _pools[key]
+
+
+class HttpBlockWriter:
+    """Streams Parquet or Arrow blocks with ZSTD/LZ4 compression to the ClickHouse HTTP interface"""
+    name = 'http'
+    thread_safe = True  # every write checks out its own pooled connection
+
+    def __init__(self, host: str, port: int, user: str, password: str, block_format: str = 'parquet',
+                 compression: str = 'zstd', pool_size: int = 4):
+        if block_format not in BLOCK_FORMATS:
+            raise ValueError(f"block_format must be one of {list(BLOCK_FORMATS)}, got '{block_format}'")
+        if compression not in BLOCK_FORMATS[block_format]['compressions']:
+            raise ValueError(f"{block_format} blocks support {BLOCK_FORMATS[block_format]['compressions']}, "
+                             f"got '{compression}'")
+        self.block_format = block_format
+        self.compression = compression
+        self.pool = get_connection_pool(host, port, pool_size)
+        token = base64.b64encode(f"{user}:{password}".encode()).decode()
+        self.headers = {'Authorization': f"Basic {token}", 'Content-Type': 'application/octet-stream'}
+
+    def encode(self, df: pl.DataFrame) -> bytes:
+        buffer = io.BytesIO()
+        if self.block_format == 'parquet':
+            df.write_parquet(buffer, compression=self.compression)
+        else:
+            df.write_ipc_stream(buffer, compression=self.compression)
+        return buffer.getvalue()
+
+    def _post(self, sql: str, body: bytes, retry: bool = True) -> None:
+        url = '/?' + urlencode({'query': sql})
+        try:
+            with self.pool.connection() as conn:
+                conn.request('POST', url, body=body, headers=self.headers)
+                response = conn.getresponse()
+                payload = response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # the server dropped an idle keep-alive connection before reading the request
+            if not retry:
+                raise
+            return self._post(sql, body, retry=False)
+        if response.status != 200:
+            raise RuntimeError(f"ClickHouse HTTP insert failed ({response.status}): {payload.decode(errors='replace')}")
+
+    def execute(self, sql: str) -> None:
+        """Run a statement without result, e.g. DDL"""
+        self._post(sql, b'')
+
+    def write(self, df: pl.DataFrame, table_name: str, schema: str, max_chunk: int) -> None:
+        columns = ', '.join(f"`{column}`" for column in df.columns)
+        sql = (f"INSERT INTO {schema}.{table_name} ({columns}) "
+               f"FORMAT {BLOCK_FORMATS[self.block_format]['clickhouse_format']}")
+        for offset in range(0, len(df), max_chunk):
+            block = self.encode(df.slice(offset, max_chunk))
+            self._post(sql, block)
+            logger.debug(f"Sent {len(block)} byte {self.block_format}/{self.compression} block to {table_name}")
+
+
+# column holding the shard of each row while a frame is split
+_SHARD_COLUMN = '_shard'
+
+
+def parse_shards(value: str, default_port: int) -> List[tuple[str, int]]:
+    """`host1:8123,host2` -> [('host1', 8123), ('host2', default_port)]"""
+    shards = []
+    for item in value.split(','):
+        item = item.strip()
+        if item:
+            host, _, port = item.partition(':')
+            shards.append((host, int(port) if port else int(default_port)))
+    return shards
+
+
+def shard_of(keys: pl.Series, shards: int) -> pl.Series:
+    """Shard of every key: CRC32 of its UTF-8 bytes modulo the number of shards, which is where a
+    Distributed table with sharding key CRC32(<key>) and equal shard weights sends the row"""
+    keys = keys.cast(pl.Utf8).fill_null('')
+    # keys repeat a lot (popular products), so each distinct one is hashed once
+    distinct = keys.unique()
+    crc = pl.Series([zlib.crc32(key.encode()) % shards for key in distinct], dtype=pl.UInt32)
+    return keys.replace_strict(distinct, crc, return_dtype=pl.UInt32)
+
+
+class ShardedWriter:
+    """Spreads inserts over several ClickHouse hosts, each holding its own local tables.
+
+    Every row goes to the shard of its `shard_key` (see `shard_of`), so a key always lands on
+    the same host and ReplacingMergeTree still deduplicates it there; reviews and their images
+    share the key `asin` and therefore the host. A write splits its frame into one part per
+    shard and inserts the parts in parallel, each through the HTTP connection pool of its host.
+    It returns once every shard has its part. If a shard fails the write raises, and retrying
+    the batch re-sends it to the shards that succeeded, where ReplacingMergeTree drops the repeat.
+    Rows, bytes and insert latency are recorded per shard in the metrics registry.
+    """
+    name = 'sharded'
+    thread_safe = True
+
+    def __init__(self, shards: List[tuple[str, int]], user: str, password: str, shard_key: str = 'asin',
+                 block_format: str = 'parquet', compression: str = 'zstd', pool_size: int = 4):
+        if not shards:
+            raise ValueError("The sharded writer needs at least one host in CLICKHOUSE_SHARDS")
+        self.shards = [f"{host}:{port}" for host, port in shards]
+        self.shard_key = shard_key
+        self.writers = [HttpBlockWriter(host, port, user, password, block_format, compression, pool_size)
+                        for host, port in shards]
+        # enough threads for every pooled connection, so concurrent writes only wait on the pools
+        self._executor = ThreadPoolExecutor(max_workers=len(shards) * pool_size, thread_name_prefix='shard-insert')
+
+    def _write_shard(self, shard: int, df: pl.DataFrame, table_name: str, schema: str, max_chunk: int) -> None:
+        labels = {'shard': self.shards[shard], 'table': table_name}
+        start = time.perf_counter()
+        try:
+            self.writers[shard].write(df, table_name, schema, max_chunk)
+        except Exception:
+            metrics.inc('ingest_shard_errors_total', **labels)
+            raise
+        metrics.observe('ingest_shard_insert_seconds', time.perf_counter() - start, **labels)
+        metrics.inc('ingest_shard_rows_total', len(df), **labels)
+        metrics.inc('ingest_shard_bytes_total', df.estimated_size(), **labels)
+
+    def write(self, df: pl.DataFrame, table_name: str, schema: str, max_chunk: int) -> None:
+        if self.shard_key not in df.columns:
+            raise ValueError(f"Cannot shard {table_name}: it has no shard key column '{self.shard_key}'")
+        if len(self.writers) == 1:
+            self._write_shard(0, df, table_name, schema, max_chunk)
+            return
+        parts = (df.with_columns(shard_of(df.get_column(self.shard_key), len(self.writers)).alias(_SHARD_COLUMN))
+                 .partition_by(_SHARD_COLUMN, as_dict=True, include_key=False))
+        futures = {shard: self._executor.submit(self._write_shard, shard, part, table_name, schema, max_chunk)
+                   for (shard,), part in parts.items()}
+        # wait for every shard before failing, a retry must not race inserts still running
+        errors = {}
+        for shard, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                errors[self.shards[shard]] = e
+        if errors:
+            logger.error(f"Insert into {table_name} failed on {len(errors)}/{len(futures)} shards: {errors}")
+            raise RuntimeError(f"Insert into {table_name} failed on shards {', '.join(errors)}: "
+                               f"{next(iter(errors.values()))}")
+
+    def execute(self, sql: str) -> None:
+        """Run a statement on every shard, e.g. the DDL of the local tables"""
+        for writer in self.writers:
+            writer.execute(sql)
+
+
+def shard_stats(snapshot: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Rows, MB, inserts, mean insert latency and rows/sec while inserting, per shard, from a
+    metrics snapshot that includes the worker processes"""
+    stats: Dict[str, Dict[str, Any]] = {}
+
+    def entry(key: str) -> tuple[str, Dict[str, Any]]:
+        name, labels = parse_key(key)
+        shard = dict(labels).get('shard')
+        return name, stats.setdefault(shard, {'rows': 0, 'mb': 0.0, 'inserts': 0, 'seconds': 0.0, 'errors': 0})
+
+    for key, value in snapshot['counters'].items():
+        if key.startswith('ingest_shard_'):
+            name, shard = entry(key)
+            if name == 'ingest_shard_rows_total':
+                shard['rows'] += int(value)
+            elif name == 'ingest_shard_bytes_total':
+                shard['mb'] += value / (1024 * 1024)
+            elif name == 'ingest_shard_errors_total':
+                shard['errors'] += int(value)
+    for key, value in snapshot['histograms'].items():
+        if key.startswith('ingest_shard_insert_seconds'):
+            _, shard = entry(key)
+            shard['inserts'] += value['count']
+            shard['seconds'] += value['sum']
+    for shard in stats.values():
+        shard['mb'] = round(shard['mb'], 1)
+        shard['mean_latency_s'] = round(shard['seconds'] / shard['inserts'], 4) if shard['inserts'] else 0.0
+        shard['rows_per_sec'] = round(shard['rows'] / shard['seconds'], 1) if shard['seconds'] else 0.0
+        shard['seconds'] = round(shard['seconds'], 2)
+    return stats
+
+
+WRITER_BACKENDS = ['dbutils', 'http', 'sharded']
+
+
+def make_writer(backend: str, q=None):
+    """Build the writer backend used by `ClickHouseDB.sql_write_df`"""
+    if backend == 'dbutils':
+        return DbutilsWriter(q)
+    if backend == 'http':
+        return HttpBlockWriter(
+            host=clickhouse_config['db_host'],
+            port=clickhouse_config['http_port'],
+            user=clickhouse_config['db_user'],
+            password=clickhouse_config['db_pass'],
+            block_format=clickhouse_config['http_format'],
+            compression=clickhouse_config['http_compression'],
+            pool_size=clickhouse_config['pool_size'],
+        )
+    if backend == 'sharded':
+        return ShardedWriter(
+            shards=parse_shards(clickhouse_config['shards'], clickhouse_config['http_port']),
+            user=clickhouse_config['db_user'],
+            password=clickhouse_config['db_pass'],
+            shard_key=clickhouse_config['shard_key'],
+            block_format=clickhouse_config['http_format'],
+            compression=clickhouse_config['http_compression'],
+            pool_size=clickhouse_config['pool_size'],
+        )
+    raise ValueError(f"Unknown writer backend '{backend}', expected one of {WRITER_BACKENDS}")
@@ -0,0 +1,54 @@
+import os
+import sys
+from pathlib import Path
+
+# the modules import each other from the project root, like `python main.py` runs them
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# table names in the generated SQL come from the database name; no test connects to it
+os.environ.setdefault('CLICKHOUSE_DB', 'amazon')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import gzip
+import json
+
+import pytest
+
+
+def review(index: int, **fields) -> dict:
+    """One raw review line as in the Amazon Reviews 2023 files"""
+    return {
+        'rating': 5.0, 'title': f"Title {index}", 'text': f"Text {index}<br /><br />more", 'images': [],
+        'asin': f"B{index:09d}", 'parent_asin': f"P{index:09d}", 'user_id': f"U{index:09d}",
+        'timestamp': 1589228332952 + index * 1000, 'helpful_vote': index % 3, 'verified_purchase': True,
+        **fields,
+    }
+
+
+@pytest.fixture
+def reviews_file(tmp_path):
+    """Writes `records` (dicts, or raw str lines) to <tmp_path>/<name>.jsonl.gz and returns its path"""
+    def write(records: list, name: str = 'Reviews_A') -> str:
+        path = tmp_path / f"{name}.jsonl.gz"
+        with gzip.open(path, 'wt') as f:
+            for record in records:
+                f.write((record if isinstance(record, str) else json.dumps(record)) + '\n')
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def standin():
+    from src.utils.standin_server import StandInClickHouseServer
+    with StandInClickHouseServer() as server:
+        yield server
+
+
+@pytest.fixture
+def http_settings(standin, monkeypatch):
+    """Points the `http` writer of ClickHouseDB at the stand-in server"""
+    from config.config import clickhouse_config
+    for key, value in {'db_host': standin.host, 'http_port': standin.port, 'db_user': 'test',
+                       'db_pass': 'test'}.items():
+        monkeypatch.setitem(clickhouse_config, key, value)
+    return standin
@@ -0,0 +1,69 @@
+import polars as pl
+
+from src.utils.batching import AdaptiveBatchSizer, FrameBuffer
+
+MB = 1024 * 1024
+
+
+def test_budget_shrinks_on_slow_inserts_and_grows_on_fast_ones():
+    sizer = AdaptiveBatchSizer('reviews', budget_bytes=16 * MB, max_latency=2.0)
+    sizer.observe_insert(rows=1000, frame_bytes=16 * MB, seconds=3.0)
+    assert sizer.budget_bytes == int(16 * MB * AdaptiveBatchSizer.SHRINK)
+
+    shrunk = sizer.budget_bytes
+    sizer.observe_insert(rows=1000, frame_bytes=shrunk, seconds=0.5)
+    assert sizer.budget_bytes == int(shrunk * AdaptiveBatchSizer.GROW)
+
+    # in between half and the full latency the budget holds
+    held = sizer.budget_bytes
+    sizer.observe_insert(rows=1000, frame_bytes=held, seconds=1.5)
+    assert sizer.budget_bytes == held
+    assert sizer.inserts == 3
+
+
+def test_budget_stays_within_bounds():
+    sizer = AdaptiveBatchSizer('reviews', budget_bytes=4 * MB, min_bytes=2 * MB, max_bytes=6 * MB)
+    for _ in range(10):
+        sizer.observe_insert(rows=100, frame_bytes=sizer.budget_bytes, seconds=10.0)
+    assert sizer.budget_bytes == 2 * MB
+    for _ in range(10):
+        sizer.observe_insert(rows=100, frame_bytes=sizer.budget_bytes, seconds=0.01)
+    assert sizer.budget_bytes == 6 * MB
+
+
+def test_hints_follow_the_observed_input():
+    sizer = AdaptiveBatchSizer('reviews', budget_bytes=8 * MB, max_rows=50000)
+    for _ in range(50):
+        sizer.observe_input(raw_bytes=2 * MB, frame_bytes=1 * MB, rows=1024)
+    assert abs(sizer.raw_bytes_hint() - 16 * MB) < 0.01 * 16 * MB
+    assert abs(sizer.rows_hint() - 8192) < 0.01 * 8192
+
+    # an empty chunk teaches nothing, and the row hint never exceeds max_rows
+    sizer.observe_input(raw_bytes=0, frame_bytes=0, rows=0)
+    assert abs(sizer.rows_hint() - 8192) < 0.01 * 8192
+    small = AdaptiveBatchSizer('images', budget_bytes=8 * MB, max_rows=100)
+    assert small.rows_hint() == 100
+
+
+def test_frame_buffer_flushes_at_the_row_cap_with_its_batch_seqs():
+    buffer = FrameBuffer('images', max_rows=5)
+    assert buffer.add(0, pl.DataFrame({'asin': ['a', 'b']})) is None
+    # batches without rows for this table still have to be committed with the flush
+    assert buffer.add(1, pl.DataFrame({'asin': []}, schema={'asin': pl.Utf8})) is None
+    seqs, df = buffer.add(2, pl.DataFrame({'asin': ['c', 'd', 'e']}))
+    assert seqs == [0, 1, 2] and df['asin'].to_list() == ['a', 'b', 'c', 'd', 'e']
+
+    assert buffer.drain() is None
+    buffer.add(3, pl.DataFrame({'asin': ['f']}))
+    assert buffer.drain()[0] == [3]
+
+
+def test_frame_buffer_flushes_on_the_sizer_budget():
+    sizer = AdaptiveBatchSizer('reviews', budget_bytes=1, min_bytes=1, max_rows=1000)
+    buffer = FrameBuffer('reviews', sizer=sizer)
+    assert buffer.max_rows == 1000
+    seqs, df = buffer.add(0, pl.DataFrame({'asin': ['a']}))
+    assert seqs == [0] and len(df) == 1
+
+    unbuffered = FrameBuffer('reviews')
+    assert unbuffered.add(7, pl.DataFrame({'asin': ['a']}))[0] == [7]
@@ -0,0 +1,41 @@
+import re
+
+import pytest
+
+from src.sql import create_schema
+from src.sql.create_schema import (get_layout_query, get_sorting_key, get_table_columns, get_version_column,
+                                   layout_profiles)
+
+TABLES = ['create_reviews_table', 'review_images_table']
+
+
+@pytest.fixture(params=sorted(layout_profiles))
+def profile(request, monkeypatch):
+    """Runs a test against the tables of every layout profile"""
+    for key in TABLES:
+        monkeypatch.setitem(create_schema.sql_queries, key,
+                            {**create_schema.sql_queries[key], 'sql_create': get_layout_query(key, request.param)})
+    return request.param
+
+
+def test_keys_and_versions_are_the_same_in_every_profile(profile):
+    assert get_sorting_key('create_reviews_table')[:3] == ['asin', 'user_id', 'parent_asin']
+    assert get_sorting_key('review_images_table') == ['asin', 'user_id', 'parent_asin', 'image_position']
+    assert get_version_column('create_reviews_table') == 'timestamp'
+    assert get_version_column('review_images_table') is None
+
+
+def test_columns_are_parsed_without_indexes_or_codecs(profile):
+    columns = {column['name']: column for column in get_table_columns('create_reviews_table')}
+    assert set(columns) == {'user_id', 'parent_asin', 'asin', 'title', 'text', 'rating', 'helpful_vote',
+                            'verified_purchase', 'timestamp', 'ingest_ts'}
+    assert columns['helpful_vote']['type'] == 'Nullable(Int64)'
+    assert columns['ingest_ts']['default'] and not columns['timestamp']['default']
+
+
+def test_no_profile_partitions_on_the_version_column(profile):
+    for key in TABLES:
+        sql_create = get_layout_query(key, profile)
+        version = get_version_column(key)
+        partition = re.search(r'PARTITION\s+BY\s+([^\n;]+)', sql_create, re.IGNORECASE)
+        assert partition is None or version is None or version not in partition.group(1)
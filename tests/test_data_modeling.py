@@ -0,0 +1,50 @@
+import json
+
+import polars as pl
+
+from src.pipelines.ingest import AmazonReviewsIngestion
+from src.utils.jsonl import parse_jsonl_chunk
+from tests.conftest import review
+
+
+def _image(name: str, kind: str = 'IMAGE') -> dict:
+    return {'small_image_url': f"https://img/{name}_s.jpg", 'medium_image_url': f"https://img/{name}_m.jpg",
+            'large_image_url': f"https://img/{name}_l.jpg", 'attachment_type': kind}
+
+
+RECORDS = [
+    review(0),
+    review(1, images=[_image('a')]),
+    review(2, images=[_image('b'), _image('c', kind='VIDEO'), _image('d')]),
+    review(3),
+]
+
+
+def _ingestion(tmp_path) -> AmazonReviewsIngestion:
+    return AmazonReviewsIngestion(data_folder=str(tmp_path), ingest_mode='columnar', writer='http',
+                                  key_index=False)
+
+
+def test_model_batch_keeps_every_image_with_its_position(tmp_path, http_settings):
+    df = parse_jsonl_chunk(('\n'.join(json.dumps(r) for r in RECORDS) + '\n').encode())
+    reviews_df, images_df = _ingestion(tmp_path).model_batch(df)
+
+    assert 'images' not in reviews_df.columns and len(reviews_df) == 4
+    assert reviews_df['text'].to_list() == [f"Text {i}\nmore" for i in range(4)]
+    assert images_df.columns[:4] == ['asin', 'parent_asin', 'user_id', 'image_position']
+    assert images_df.select('asin', 'image_position').rows() == [
+        ('B000000001', 0), ('B000000002', 0), ('B000000002', 1), ('B000000002', 2),
+    ]
+    assert images_df['medium_image_url'].to_list()[1:] == [f"https://img/{n}_m.jpg" for n in 'bcd']
+    assert images_df['attachment_type'].to_list() == ['IMAGE', 'IMAGE', 'VIDEO', 'IMAGE']
+
+
+def test_records_and_columnar_modeling_agree(tmp_path, http_settings):
+    ingestion = _ingestion(tmp_path)
+    df = parse_jsonl_chunk(('\n'.join(json.dumps(r) for r in RECORDS) + '\n').encode())
+    reviews_df, images_df = ingestion.model_batch(df)
+
+    modeled = [ingestion.data_modeling(json.loads(json.dumps(r))) for r in RECORDS]
+    assert [record['text'] for record, _ in modeled] == reviews_df['text'].to_list()
+    images = [image for _, rows in modeled for image in rows]
+    assert pl.DataFrame(images).select(images_df.columns).rows() == images_df.rows()
@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from src.pipelines.ingest import AmazonReviewsIngestion
+from src.utils.dead_letter import DEAD_LETTER_SUFFIX, parse_dead_letter_name, read_dead_letter
+from tests.conftest import review
+
+
+@pytest.mark.parametrize('ingest_mode,stage', [('columnar', False), ('pipelined', False), ('pipelined', True)])
+def test_rejected_rows_are_named_after_their_source(tmp_path, reviews_file, http_settings, ingest_mode, stage):
+    file_path = reviews_file([review(0), review(1, rating=9.0), review(2), '{"asin": broken'])
+    ingestion = AmazonReviewsIngestion(data_folder=str(tmp_path), ingest_mode=ingest_mode, writer='http',
+                                       key_index=False, stage=stage)
+    stats = ingestion.ingest_file(file_path)
+
+    assert stats['rejected'] == 2
+    assert http_settings.rows('amazon.reviews') == 2
+    files = ingestion.dead_letters.files()
+    assert [path.name for path in files] == [f"Reviews_A.reviews{DEAD_LETTER_SUFFIX}"]
+    assert parse_dead_letter_name(files[0]) == ('Reviews_A', 'reviews')
+    assert len(read_dead_letter(files[0])) == 2
+
+
+def test_records_mode_rejects_a_timestamp_that_is_not_a_number(tmp_path, reviews_file, http_settings):
+    file_path = reviews_file([review(0), review(1, timestamp='abc'), review(2)])
+    ingestion = AmazonReviewsIngestion(data_folder=str(tmp_path), ingest_mode='records', writer='http',
+                                       key_index=False)
+    stats = ingestion.ingest_file(file_path)
+
+    assert not stats.get('failed')
+    assert stats['rejected'] == 1
+    assert http_settings.rows('amazon.reviews') == 2
+    lines = read_dead_letter(ingestion.dead_letters.files()[0])
+    assert [json.loads(line)['timestamp'] for line in lines] == ['abc']
@@ -0,0 +1,78 @@
+import re
+from datetime import datetime
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from src.pipelines.analyze import AmazonReviewsAnalysis
+from src.sql.analysis import queries as analysis_sql_queries
+from src.sql.fusion import RATINGS, fusable_queries
+from src.sql.lazy_analysis import lazy_queries
+from src.utils.clickhouse import ClickHouseDB
+
+# the aggregates of fusion.py as Polars expressions, to answer a fused SELECT without a server
+_AGGREGATES = {
+    'count()': pl.len(),
+    'uniqExact(asin)': pl.col('asin').n_unique(),
+    'uniqExact(user_id)': pl.col('user_id').n_unique(),
+    'min(timestamp)': pl.col('timestamp').min(),
+    'max(timestamp)': pl.col('timestamp').max(),
+    **{f"countIf(rating = {rating})": (pl.col('rating') == rating).sum() for rating in RATINGS},
+    f"countIf(rating NOT BETWEEN {RATINGS.start} AND {RATINGS.stop - 1})":
+        (~pl.col('rating').is_between(RATINGS.start, RATINGS.stop - 1)).sum(),
+    'countIf(verified_purchase)': pl.col('verified_purchase').sum(),
+    'avgIf(rating, verified_purchase)': pl.col('rating').filter(pl.col('verified_purchase')).mean(),
+    'countIf(NOT verified_purchase)': (~pl.col('verified_purchase')).sum(),
+    'avgIf(rating, NOT verified_purchase)': pl.col('rating').filter(~pl.col('verified_purchase')).mean(),
+}
+
+
+def _reviews(ratings: list[int]) -> pl.DataFrame:
+    return pl.DataFrame({
+        'user_id': [f"U{i % 4}" for i in range(len(ratings))],
+        'parent_asin': [f"P{i % 3}" for i in range(len(ratings))],
+        'asin': [f"B{i % 5}" for i in range(len(ratings))],
+        'rating': pl.Series(ratings, dtype=pl.UInt8),
+        'helpful_vote': [i % 3 for i in range(len(ratings))],
+        'verified_purchase': [i % 2 == 0 for i in range(len(ratings))],
+        'timestamp': [datetime(2020, 1 + i % 12, 1) for i in range(len(ratings))],
+    })
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """Answers the standalone queries with their Polars twin and fused SELECTs aggregate by aggregate"""
+    data = {}
+
+    def sql_query(self, sql: str) -> pl.DataFrame:
+        reviews = data['reviews']
+        for name, query in analysis_sql_queries.items():
+            if sql == query:
+                data['standalone'].append(name)
+                return lazy_queries[name](reviews.lazy()).collect()
+        columns = re.findall(r'^\s*(.+?) AS (\w+),?$', sql, re.MULTILINE)
+        return reviews.select([_AGGREGATES[expression].alias(alias) for expression, alias in columns])
+
+    monkeypatch.setattr(ClickHouseDB, 'sql_query', sql_query)
+    return data
+
+
+def _report(tmp_path, fuse: bool) -> dict:
+    analysis = AmazonReviewsAnalysis(output_dir=str(tmp_path / f"fuse_{fuse}"), concurrency=1, use_rollups=False,
+                                     use_cache=False, fuse=fuse)
+    return analysis.run_queries(list(fusable_queries))
+
+
+@pytest.mark.parametrize('ratings', [[1, 2, 3, 4, 5, 5, 4, 5], [0, 1, 5, 5, 0, 3, 7, 4]])
+def test_fused_overview_matches_the_standalone_queries(tmp_path, fake_server, ratings):
+    fake_server.update(reviews=_reviews(ratings), standalone=[])
+    fused = _report(tmp_path, fuse=True)
+    out_of_range = any(rating not in RATINGS for rating in ratings)
+    # only the rating distribution with ratings outside 1-5 runs on its own
+    assert fake_server['standalone'] == (['rating_distribution'] if out_of_range else [])
+    unfused = _report(tmp_path, fuse=False)
+    for name in fusable_queries:
+        assert not isinstance(fused[name], Exception), fused[name]
+        assert_frame_equal(fused[name], unfused[name], check_dtypes=False)
+    assert fused['rating_distribution'].get_column('count').sum() == len(ratings)
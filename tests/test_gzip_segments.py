@@ -0,0 +1,48 @@
+import gzip
+import os
+
+import polars as pl
+import pytest
+
+from src.utils.gzip_segments import (iter_segment_chunks, iter_segment_frames, iter_segment_records,
+                                     load_segment_index, resegment_file, segmented_path)
+from tests.conftest import review
+
+RECORDS = 200
+
+
+@pytest.fixture
+def source(reviews_file):
+    return reviews_file([review(i) for i in range(RECORDS)])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_resegmented_file_holds_the_same_lines(source, workers):
+    index = resegment_file(source, segment_bytes=4096, workers=workers)
+
+    # still one valid gzip stream, of independently compressed members
+    with gzip.open(source, 'rb') as f:
+        assert gzip.decompress(segmented_path(source).read_bytes()) == f.read()
+    assert len(index['segments']) > 5
+    assert index['records'] == sum(segment['records'] for segment in index['segments']) == RECORDS
+    assert load_segment_index(source) == index
+
+
+def test_stale_index_is_ignored(source):
+    resegment_file(source, segment_bytes=4096)
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert load_segment_index(source) is None
+
+
+def test_segments_are_read_in_order_from_any_record(source):
+    index = resegment_file(source, segment_bytes=4096)
+    expected = [f"B{i:09d}" for i in range(RECORDS)]
+
+    frames = list(iter_segment_frames(source, index, batch_size=7, workers=2, skip_records=37))
+    assert pl.concat(frames).get_column('asin').to_list() == expected[37:]
+    assert max(len(frame) for frame in frames) == 7
+    records = list(iter_segment_records(source, index, workers=2, skip_records=150))
+    assert [record['asin'] for record in records] == expected[150:]
+    chunks = list(iter_segment_chunks(source, index, batch_size=lambda: 10, workers=2))
+    assert sum(chunk.count(b'\n') for chunk in chunks) == RECORDS
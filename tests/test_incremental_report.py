@@ -0,0 +1,58 @@
+import json
+
+import polars as pl
+import pytest
+
+from src.pipelines.analyze import AmazonReviewsAnalysis
+from src.sql.create_schema import get_rollup_queries
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Records the SQL of the report; rollup tables exist once created, the watermark is settable"""
+    state = {'sql': [], 'tables': set(), 'watermark': '2024-01-01 00:00:00'}
+
+    def sql_query(self, sql: str) -> pl.DataFrame:
+        state['sql'].append(' '.join(sql.split()))
+        if 'FROM system.tables' in sql:
+            return pl.DataFrame({'name': sorted(state['tables'])}, schema={'name': pl.Utf8})
+        if 'AS watermark' in sql:
+            return pl.DataFrame({'watermark': [state['watermark']]})
+        if sql.lstrip().startswith('CREATE TABLE'):
+            state['tables'].update(name for name in get_rollup_queries() if f".{name}" in sql.split('(')[0])
+        return pl.DataFrame({'test': [1]})
+
+    monkeypatch.setattr(AmazonReviewsAnalysis, 'sql_query', sql_query)
+    return state
+
+
+def _inserts(server) -> list[str]:
+    return [sql for sql in server['sql'] if sql.startswith('INSERT INTO')]
+
+
+def test_report_creates_no_rollups_by_default(tmp_path, server):
+    AmazonReviewsAnalysis(output_dir=str(tmp_path), use_cache=False).queries
+    assert not any(sql.startswith(('CREATE', 'INSERT', 'TRUNCATE')) for sql in server['sql'])
+
+
+def test_incremental_rebuilds_from_final_and_refreshes_new_rows(tmp_path, server):
+    AmazonReviewsAnalysis(output_dir=str(tmp_path), use_cache=False, incremental=True).queries
+    rebuilds = _inserts(server)
+    assert len(rebuilds) == len(get_rollup_queries())
+    assert all(" FINAL WHERE ingest_ts <= '2024-01-01 00:00:00'" in sql for sql in rebuilds)
+
+    server['sql'].clear()
+    server['watermark'] = '2024-01-02 00:00:00'
+    AmazonReviewsAnalysis(output_dir=str(tmp_path), use_cache=False, incremental=True).queries
+    refreshes = _inserts(server)
+    assert refreshes and all('FINAL' not in sql and "ingest_ts > '2024-01-01 00:00:00'" in sql for sql in refreshes)
+
+    # states older than the rebuild interval are recomputed from FINAL again
+    state_path = tmp_path / '.report_state.json'
+    state = json.loads(state_path.read_text())
+    state['rebuilt_at'] = {name: '2000-01-01T00:00:00' for name in state['rebuilt_at']}
+    state_path.write_text(json.dumps(state))
+    server['sql'].clear()
+    server['watermark'] = '2024-01-03 00:00:00'
+    AmazonReviewsAnalysis(output_dir=str(tmp_path), use_cache=False, incremental=True).queries
+    assert all(' FINAL WHERE' in sql for sql in _inserts(server))
@@ -0,0 +1,58 @@
+import polars as pl
+import pytest
+
+from src.pipelines.ingest import AmazonReviewsIngestion
+from tests.conftest import review
+
+MODES = ['records', 'columnar', 'pipelined']
+
+
+def _ingestion(tmp_path, ingest_mode: str, **kwargs) -> AmazonReviewsIngestion:
+    return AmazonReviewsIngestion(data_folder=str(tmp_path), ingest_mode=ingest_mode, writer='http',
+                                  key_index=False, **kwargs)
+
+
+@pytest.mark.parametrize('ingest_mode', MODES)
+def test_failed_insert_counts_as_an_error(tmp_path, reviews_file, http_settings, ingest_mode):
+    file_path = reviews_file([review(i) for i in range(3)])
+    http_settings.fail_next = 1
+    stats = _ingestion(tmp_path, ingest_mode).ingest_file(file_path)
+
+    assert stats['errors'] == 1
+    assert http_settings.rows() == 0
+
+
+@pytest.mark.parametrize('ingest_mode', MODES)
+def test_values_of_the_wrong_json_type_are_rejected_in_every_mode(tmp_path, reviews_file, http_settings, ingest_mode):
+    file_path = reviews_file([review(0), review(1, verified_purchase='yes'), review(2, timestamp='1589228332952'),
+                              review(3, verified_purchase='true'), review(4, helpful_vote=1.5), review(5)])
+    stats = _ingestion(tmp_path, ingest_mode).ingest_file(file_path)
+
+    assert stats['rejected'] == 4
+    assert http_settings.rows('amazon.reviews') == 2
+
+
+def _received(server, table: str) -> pl.DataFrame:
+    frames = [block.frame for block in server.blocks if block.table_name == f"amazon.{table}"]
+    return pl.concat(frames).sort(pl.all())
+
+
+def test_every_mode_writes_the_same_rows(tmp_path, reviews_file, http_settings):
+    image = {'small_image_url': 's', 'medium_image_url': 'm', 'large_image_url': 'l', 'attachment_type': 'IMAGE'}
+    records = [review(i, images=[image] * (i % 3), helpful_vote=None if i % 4 == 0 else i) for i in range(23)]
+    file_path = reviews_file(records + [review(23, rating=0.0), '{"asin": broken'])
+
+    received = {}
+    for ingest_mode in MODES:
+        http_settings.blocks.clear()
+        # small batches so every mode flushes several times, and the pipelined stages overlap
+        stats = _ingestion(tmp_path / ingest_mode, ingest_mode, batch_size=5).ingest_file(file_path)
+        assert (stats['total_inserted'], stats['images_processed'], stats['rejected']) == (23, 22, 2)
+        received[ingest_mode] = (_received(http_settings, 'reviews'), _received(http_settings, 'review_images'))
+
+    reviews, images = received['records']
+    assert len(reviews) == 23 and reviews.get_column('text').str.contains('\n').all()
+    assert images.get_column('image_position').to_list().count(1) == 7
+    for ingest_mode in MODES[1:]:
+        assert received[ingest_mode][0].equals(reviews), ingest_mode
+        assert received[ingest_mode][1].equals(images), ingest_mode
@@ -0,0 +1,28 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from tests.conftest import review
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# runs `main.py ingest --plan` in a fresh interpreter and prints the watched modules it imported
+_RUN_PLAN = """
+import json, runpy, sys
+sys.argv = ['main.py', 'ingest', '--plan', '--data_folder', {folder!r}] + {extra!r}
+runpy.run_path('main.py', run_name='__main__')
+print(json.dumps([m for m in ('src.utils.staging', 'src.utils.metrics', 'dbutils') if m in sys.modules]))
+"""
+
+
+def _plan_imports(folder: str, *extra: str) -> list[str]:
+    code = _RUN_PLAN.format(folder=folder, extra=list(extra))
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def test_plan_imports_staging_only_with_stage(reviews_file):
+    folder = str(Path(reviews_file([review(1), review(2)])).parent)
+    assert _plan_imports(folder) == []
+    assert _plan_imports(folder, '--stage') == ['src.utils.staging', 'src.utils.metrics']
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+import polars as pl
+
+from src.pipelines.ingest import AmazonReviewsIngestion
+from src.utils.key_index import KeyIndex
+from tests.conftest import review
+
+KEY = ['asin', 'user_id']
+BASE_TIME = datetime(2020, 5, 11, 12, 0, 0)
+
+
+def _rows(*rows) -> pl.DataFrame:
+    """(asin, user_id, text, seconds after BASE_TIME, ingest_ts seconds) per row"""
+    return pl.DataFrame({
+        'asin': [row[0] for row in rows],
+        'user_id': [row[1] for row in rows],
+        'text': [row[2] for row in rows],
+        'timestamp': [BASE_TIME + timedelta(seconds=row[3]) for row in rows],
+        'ingest_ts': [BASE_TIME + timedelta(seconds=row[4] if len(row) > 4 else 0) for row in rows],
+    })
+
+
+def _insert(index: KeyIndex, df: pl.DataFrame) -> pl.DataFrame:
+    new, entries = index.filter_new(df)
+    index.add(entries)
+    return new
+
+
+def _index(tmp_path, version_column='timestamp') -> KeyIndex:
+    return KeyIndex(str(tmp_path), 'reviews', KEY, version_column=version_column, ignore_columns=['ingest_ts'])
+
+
+def test_drops_only_rows_the_table_would_replace(tmp_path):
+    index = _index(tmp_path)
+    assert len(_insert(index, _rows(('A', 'u1', 'good', 10), ('B', 'u1', 'bad', 10)))) == 2
+    new = _insert(index, _rows(
+        ('A', 'u1', 'good', 10, 99),   # same version and content, only ingest_ts differs: dropped
+        ('B', 'u1', 'bad', 5),         # older version: dropped
+        ('B', 'u2', 'first', 10),      # new key
+    ))
+    assert new.get_column('user_id').to_list() == ['u2']
+    # newer version, and same version with edited content, both replace the indexed row
+    new = _insert(index, _rows(('A', 'u1', 'good', 20), ('B', 'u1', 'edited', 10)))
+    assert new.get_column('text').to_list() == ['good', 'edited']
+    # the newer versions are now what a re-ingest of the old rows is compared with
+    assert _insert(index, _rows(('A', 'u1', 'good', 10))).is_empty()
+
+
+def test_keeps_the_newest_row_of_a_key_within_a_batch(tmp_path):
+    index = _index(tmp_path)
+    new = _insert(index, _rows(('A', 'u1', 'newest', 30), ('A', 'u1', 'older', 10), ('A', 'u1', 'tie-last', 30)))
+    assert new.get_column('text').to_list() == ['tie-last']
+
+
+def test_table_without_version_compares_content(tmp_path):
+    index = _index(tmp_path, version_column=None)
+    _insert(index, _rows(('A', 'u1', 'url-1', 0)))
+    assert _insert(index, _rows(('A', 'u1', 'url-1', 0, 50))).is_empty()
+    assert len(_insert(index, _rows(('A', 'u1', 'url-2', 0)))) == 1
+
+
+def test_versions_survive_flush_and_compaction(tmp_path):
+    index = _index(tmp_path)
+    _insert(index, _rows(('A', 'u1', 'x', 10)))
+    index.flush()
+    other_process = _index(tmp_path)
+    assert _insert(other_process, _rows(('A', 'u1', 'x', 10))).is_empty()
+    assert len(_insert(other_process, _rows(('A', 'u1', 'x', 20)))) == 1
+    other_process.compact()
+    reopened = _index(tmp_path)
+    assert reopened.base.dtype.names == ('key', 'version', 'content')
+    assert _insert(reopened, _rows(('A', 'u1', 'x', 15))).is_empty()
+    assert len(_insert(reopened, _rows(('A', 'u1', 'x', 25)))) == 1
+
+
+def test_clear_forgets_every_key(tmp_path):
+    index = _index(tmp_path)
+    _insert(index, _rows(('A', 'u1', 'x', 10)))
+    index.clear()
+    assert len(index) == 0
+    assert len(_insert(index, _rows(('A', 'u1', 'x', 10)))) == 1
+
+
+def _ingestion(tmp_path, **settings) -> AmazonReviewsIngestion:
+    return AmazonReviewsIngestion(data_folder=str(tmp_path), writer='http', **settings)
+
+
+def test_reingest_inserts_updated_reviews_only(tmp_path, reviews_file, http_settings):
+    reviews_file([review(0), review(1)])
+    _ingestion(tmp_path, use_manifest=False).ingest_data_folder()
+    assert http_settings.rows('amazon.reviews') == 2
+
+    # same file again, with review 1 updated later: only the update is written
+    reviews_file([review(0), review(1, text='updated', timestamp=review(1)['timestamp'] + 60_000)], name='Reviews_B')
+    _ingestion(tmp_path).ingest_data_folder()
+    texts = [text for block in http_settings.blocks if block.table_name == 'amazon.reviews'
+             for text in block.frame.get_column('text').to_list()]
+    assert len(texts) == 3 and texts[-1] == 'updated'
+
+
+def test_no_manifest_starts_the_index_over(tmp_path, reviews_file, http_settings):
+    reviews_file([review(0), review(1)])
+    _ingestion(tmp_path).ingest_data_folder()
+    _ingestion(tmp_path, use_manifest=False).ingest_data_folder()
+    assert http_settings.rows('amazon.reviews') == 4
+
+
+def test_recreated_or_emptied_table_starts_the_index_over(tmp_path, reviews_file, http_settings, monkeypatch):
+    reviews_file([review(0)])
+    ingestion = _ingestion(tmp_path, use_manifest=False)
+    tables = {'uuid': 'uuid-1', 'total_rows': 1}
+    monkeypatch.setattr(ingestion, 'sql_query', lambda sql: pl.DataFrame({k: [v] for k, v in tables.items()}))
+    ingestion.check_key_indexes()
+    ingestion.ingest_file(reviews_file([review(0)]))
+    reviews_index = ingestion.key_indexes['reviews']
+    assert len(reviews_index) == 1 and reviews_index.table_uuid == 'uuid-1'
+
+    ingestion.check_key_indexes()
+    assert len(reviews_index) == 1  # same table, still holding rows
+    tables['uuid'] = 'uuid-2'
+    ingestion.check_key_indexes()
+    assert len(reviews_index) == 0 and reviews_index.table_uuid == 'uuid-2'
+
+    ingestion.ingest_file(reviews_file([review(0)]))
+    tables['total_rows'] = 0
+    ingestion.check_key_indexes()
+    assert len(reviews_index) == 0
@@ -0,0 +1,62 @@
+import pytest
+
+from src.pipelines.ingest import AmazonReviewsIngestion
+from src.utils.manifest import IngestManifest, untracked_checkpoint
+from tests.conftest import review
+
+RECORDS = 23
+
+
+def _ingestion(tmp_path, ingest_mode: str) -> AmazonReviewsIngestion:
+    return AmazonReviewsIngestion(data_folder=str(tmp_path), ingest_mode=ingest_mode, writer='http',
+                                  key_index=False, batch_size=5)
+
+
+def _asins(server) -> list[str]:
+    return [asin for block in server.blocks if block.table_name == 'amazon.reviews'
+            for asin in block.frame.get_column('asin')]
+
+
+@pytest.mark.parametrize('ingest_mode', ['records', 'columnar', 'pipelined'])
+def test_failed_file_resumes_after_its_last_committed_batch(tmp_path, reviews_file, http_settings, monkeypatch,
+                                                            ingest_mode):
+    # one image per review, so the images of a batch are flushed with it (image_batch_size = batch_size)
+    image = {'small_image_url': 's', 'medium_image_url': 'm', 'large_image_url': 'l', 'attachment_type': 'IMAGE'}
+    file_path = reviews_file([review(i, images=[image]) for i in range(RECORDS)])
+    ingestion = _ingestion(tmp_path, ingest_mode)
+    write = ingestion.writer.write
+    calls = []
+
+    def fail_third_batch(df, table_name, **kwargs):
+        if table_name == 'reviews':
+            calls.append(len(df))
+            if len(calls) == 3:
+                raise RuntimeError('insert timed out')
+        write(df, table_name, **kwargs)
+
+    monkeypatch.setattr(ingestion.writer, 'write', fail_third_batch)
+    ingestion.ingest_file(file_path)
+    entry = IngestManifest(str(tmp_path)).get(file_path)
+    assert entry['status'] == 'in_progress' and entry['last_error'] == 'insert timed out'
+    assert entry['records_committed'] == 10 and entry['batches_committed'] == 2
+    assert _asins(http_settings) == [f"B{i:09d}" for i in range(10)]
+
+    stats = _ingestion(tmp_path, ingest_mode).ingest_file(file_path)
+    assert stats['total_processed'] == RECORDS - 10
+    assert _asins(http_settings) == [f"B{i:09d}" for i in range(RECORDS)]
+    assert IngestManifest(str(tmp_path)).is_done(file_path)
+
+
+def test_checkpoint_only_advances_over_contiguous_committed_batches():
+    checkpoint = untracked_checkpoint('file.jsonl.gz', ['reviews', 'review_images'])
+    for seq, end in enumerate([5, 10, 15]):
+        checkpoint.register(seq, end)
+    checkpoint.commit(1, 'reviews')
+    checkpoint.commit(1, 'review_images')
+    assert checkpoint.start_record == 0
+    checkpoint.commit(0, 'reviews')
+    assert checkpoint.start_record == 0  # still waiting for the images of batch 0
+    checkpoint.commit(0, 'review_images')
+    assert checkpoint.start_record == 10
+    with pytest.raises(RuntimeError, match='1 batches'):
+        checkpoint.finish()
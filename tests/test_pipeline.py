@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from src.utils.pipeline import Pipeline
+
+ITEMS = 1000
+QUEUE_SIZE = 2
+
+
+def _counting_stage(counts: dict, name: str, fail_at: int | None = None):
+    lock = threading.Lock()
+
+    def stage(item):
+        with lock:
+            counts[name] += 1
+            seen = counts[name]
+        if seen == fail_at:
+            raise RuntimeError(f"{name} failed on item {seen}")
+        return item
+    return stage
+
+
+def test_runs_every_item_through_every_stage():
+    counts = {'decode': 0, 'transform': 0, 'insert': 0}
+    stats = Pipeline(lambda: iter(range(ITEMS)), [
+        ('decode', _counting_stage(counts, 'decode'), 1),
+        ('transform', _counting_stage(counts, 'transform'), 1),
+        ('insert', _counting_stage(counts, 'insert'), 2),
+    ], queue_size=QUEUE_SIZE).run()
+    assert counts == {'decode': ITEMS, 'transform': ITEMS, 'insert': ITEMS}
+    assert stats['insert']['items'] == ITEMS
+
+
+def test_failure_stops_the_other_stages():
+    counts = {'decode': 0, 'transform': 0, 'insert': 0}
+    pipeline = Pipeline(lambda: iter(range(ITEMS)), [
+        ('decode', _counting_stage(counts, 'decode'), 1),
+        ('transform', _counting_stage(counts, 'transform'), 1),
+        ('insert', _counting_stage(counts, 'insert', fail_at=3), 2),
+    ], queue_size=QUEUE_SIZE)
+    with pytest.raises(RuntimeError, match='insert failed on item 3'):
+        pipeline.run()
+    # upstream stages can only be ahead by what fits in the queues plus the item each worker holds
+    bound = 3 + 3 * (QUEUE_SIZE + 2)
+    assert counts['insert'] <= 3 + 1
+    assert counts['transform'] <= bound
+    assert counts['decode'] <= bound
+
+
+def test_failing_source_stops_the_stages():
+    counts = {'decode': 0}
+
+    def source():
+        yield from range(5)
+        raise ValueError('unreadable file')
+
+    with pytest.raises(ValueError, match='unreadable file'):
+        Pipeline(source, [('decode', _counting_stage(counts, 'decode'), 1)], queue_size=QUEUE_SIZE).run()
+    assert counts['decode'] <= 5
@@ -0,0 +1,79 @@
+import polars as pl
+import pytest
+
+from src.pipelines.analyze import AmazonReviewsAnalysis
+from src.utils.query_cache import QueryCache
+
+SQL = "SELECT rating, count() AS count FROM amazon.reviews GROUP BY rating;"
+
+
+def test_key_follows_the_sql_and_the_version_of_its_tables(tmp_path):
+    cache = QueryCache(tmp_path)
+    versions = {'amazon.reviews': '10:4', 'amazon.review_images': '3:2'}
+    key = cache.key(SQL, versions)
+
+    assert cache.key(f"  {SQL.replace(' ', chr(10))}  ", versions) == key
+    assert cache.key(SQL, {**versions, 'amazon.review_images': '4:3'}) == key
+    assert cache.key(SQL, {**versions, 'amazon.reviews': '12:5'}) != key
+    # tables without a known version are never cached
+    assert cache.key(SQL, {}) is None
+    assert cache.key("SELECT 1", versions) is None
+
+
+def test_results_round_trip_and_evict_least_recently_used(tmp_path):
+    cache = QueryCache(tmp_path, max_bytes=1)
+    df = pl.DataFrame({'rating': [1, 5], 'count': [3, 7]})
+    assert cache.get('missing') is None
+
+    cache.put('a', df)
+    # over the budget, even the newest file goes
+    assert cache.get('a') is None and cache.misses == 2
+
+    cache.max_bytes = 1024 * 1024
+    cache.put('a', df)
+    assert cache.get('a').equals(df) and cache.hits == 1
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Counts the report queries; `parts` is what system.parts reports for reviews"""
+    state = {'queries': 0, 'parts': (10, 4)}
+
+    def sql_query(self, sql: str) -> pl.DataFrame:
+        if 'FROM system.parts' in sql:
+            rows, max_block = state['parts']
+            return pl.DataFrame({'table': ['reviews'], 'rows': [rows], 'max_block': [max_block]})
+        state['queries'] += 1
+        return pl.DataFrame({'rating': [5], 'count': [state['queries']]})
+
+    monkeypatch.setattr(AmazonReviewsAnalysis, 'sql_query', sql_query)
+    return state
+
+
+def _report(tmp_path) -> AmazonReviewsAnalysis:
+    return AmazonReviewsAnalysis(output_dir=str(tmp_path), use_rollups=False)
+
+
+def test_report_reuses_results_until_the_parts_change(tmp_path, server):
+    first = _report(tmp_path).cached_sql_query(SQL)
+    assert _report(tmp_path).cached_sql_query(SQL).equals(first)
+    assert server['queries'] == 1
+
+    # an insert adds a part: new rows and a higher block number
+    server['parts'] = (12, 5)
+    report = _report(tmp_path)
+    assert report.cached_sql_query(SQL)['count'].to_list() == [2]
+    assert report.cache.misses == 1
+
+    # a deduplicating merge keeps the block number but drops rows
+    server['parts'] = (11, 5)
+    assert _report(tmp_path).cached_sql_query(SQL)['count'].to_list() == [3]
+
+
+def test_report_without_table_versions_runs_every_query(tmp_path, server):
+    # system.parts could not be read
+    server['parts'] = None
+    report = _report(tmp_path)
+    report.cached_sql_query(SQL)
+    report.cached_sql_query(SQL)
+    assert server['queries'] == 2 and report.data_versions == {}
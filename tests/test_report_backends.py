@@ -0,0 +1,31 @@
+import logging
+
+from src.utils.report_backends import PolarsReportBackend, scan_reviews
+from tests.conftest import review
+
+DAY_MS = 86_400_000
+
+
+def _files(reviews_file):
+    reviews_file([review(1), review(2), review(1, rating=1.0, timestamp=review(1)['timestamp'] + DAY_MS)], 'Reviews_A')
+    # an older version of review 2, a row the ingest rejects and a line with a value of the wrong type
+    return reviews_file([review(2, rating=2.0, timestamp=review(2)['timestamp'] - DAY_MS), review(3, rating=9.0),
+                         '{"rating": "five", "asin": "B000000004"}'], 'Reviews_B')
+
+
+def test_dedupe_keeps_the_newest_row_of_every_key(reviews_file):
+    folder = _files(reviews_file).rsplit('/', 1)[0]
+
+    reviews = scan_reviews(folder).collect().sort('asin')
+    assert reviews.get_column('asin').to_list() == ['B000000001', 'B000000002']
+    assert reviews.get_column('rating').to_list() == [1, 5]
+    assert len(scan_reviews(folder, dedupe=False).collect()) == 4
+
+
+def test_skipped_rows_are_counted_and_logged(reviews_file, caplog):
+    folder = _files(reviews_file).rsplit('/', 1)[0]
+
+    with caplog.at_level(logging.WARNING, logger='config.config'):
+        results = PolarsReportBackend(folder).run_queries(['total_reviews'])
+    assert results['total_reviews'][0].item() == 2
+    assert 'Skipped 2 invalid or undecodable rows' in caplog.text
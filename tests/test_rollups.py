@@ -0,0 +1,69 @@
+import re
+
+import polars as pl
+import pytest
+
+from src.pipelines.analyze import AmazonReviewsAnalysis
+from src.sql.analysis import rollup_queries as report_queries, rollup_tables
+from src.sql.create_schema import get_rollup_queries
+
+
+def _columns(sql_create: str) -> dict[str, str]:
+    """Column name -> type of a rollup CREATE TABLE"""
+    body = sql_create.split('ENGINE')[0]
+    body = body[body.index('(') + 1:body.rindex(')')]
+    return dict(line.strip().rstrip(',').split(' ', 1) for line in body.splitlines() if line.strip())
+
+
+def _select_list(sql_select: str) -> list[str]:
+    return [expr.strip() for expr in re.split(r',\n', sql_select.split('SELECT', 1)[1].split('FROM', 1)[0])]
+
+
+@pytest.mark.parametrize('name', sorted(get_rollup_queries()))
+def test_rollup_select_produces_the_states_of_its_table(name):
+    rollup = get_rollup_queries()[name]
+    columns = _columns(rollup['sql_create'])
+    selected = {}
+    for expr in _select_list(rollup['sql_select']):
+        alias = expr.rsplit(' AS ', 1)[-1]
+        selected[alias] = expr
+
+    # same columns in the same order, so INSERT ... SELECT lines them up
+    assert list(selected) == list(columns)
+    for column, column_type in columns.items():
+        state = re.match(r'AggregateFunction\((\w+)', column_type)
+        if state:
+            assert selected[column].startswith(f"{state.group(1)}State("), column
+        else:
+            # grouping keys
+            assert "GROUP BY" in rollup['sql_select'] and column in rollup['sql_select'].split('GROUP BY')[1]
+
+
+@pytest.mark.parametrize('name', sorted(get_rollup_queries()))
+def test_rollup_view_and_backfill_read_every_row(name):
+    rollup = get_rollup_queries()[name]
+    assert 'ENGINE = AggregatingMergeTree' in rollup['sql_create']
+    assert f".{name}_mv TO amazon.{name} AS" in rollup['sql_view']
+    assert rollup['sql_backfill'].startswith(f"INSERT INTO amazon.{name}")
+    for sql in (rollup['sql_view'], rollup['sql_backfill']):
+        assert '{where}' not in sql and 'FROM amazon.reviews\n' in sql
+    assert rollup['sql_select'].format(where=" WHERE ingest_ts > 'x'").count("FROM amazon.reviews WHERE") == 1
+
+
+def test_report_reads_the_rollups_fed_by_a_view(tmp_path, monkeypatch):
+    tables = set(rollup_tables.values())
+    existing = sorted(tables | {f"{table}_mv" for table in tables})
+
+    def sql_query(self, sql: str) -> pl.DataFrame:
+        return pl.DataFrame({'name': existing}, schema={'name': pl.Utf8})
+
+    monkeypatch.setattr(AmazonReviewsAnalysis, 'sql_query', sql_query)
+    queries = AmazonReviewsAnalysis(output_dir=str(tmp_path), use_cache=False).queries
+    assert all(queries[name] == report_queries[name] for name in rollup_tables)
+
+    existing = [table for table in existing if table != 'rollup_rating_stats_mv']
+    queries = AmazonReviewsAnalysis(output_dir=str(tmp_path), use_cache=False).queries
+    # without its view (and no incremental watermark) a rollup may be stale, so the report reads reviews
+    assert 'rollup_rating_stats' not in queries['rating_distribution']
+    assert queries['total_reviews'] == report_queries['total_reviews']
+    assert all(rollup_tables[name] in report_queries[name] for name in rollup_tables)
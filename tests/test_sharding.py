@@ -0,0 +1,79 @@
+import zlib
+
+import polars as pl
+import pytest
+
+from src.sql.create_schema import get_distributed_query
+from src.utils.metrics import metrics, parse_key
+from src.utils.standin_server import StandInClickHouseServer
+from src.utils.writers import ShardedWriter, parse_shards, shard_of, shard_stats
+
+
+@pytest.fixture
+def shards():
+    servers = [StandInClickHouseServer().start() for _ in range(3)]
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+def _writer(servers) -> ShardedWriter:
+    return ShardedWriter([(server.host, server.port) for server in servers], 'user', 'pass')
+
+
+def _reviews(rows: int) -> pl.DataFrame:
+    return pl.DataFrame({'asin': [f"B{i % 40:09d}" for i in range(rows)], 'rating': [float(i % 5 + 1) for i in range(rows)]})
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 7])
+def test_shard_of_is_crc32_modulo_shards(count):
+    keys = [f"B{i:09d}" for i in range(200)] + ['', 'ünïcode', 'B000000001']
+    expected = [zlib.crc32(key.encode()) % count for key in keys]
+    assert shard_of(pl.Series(keys), count).to_list() == expected
+    # a missing key routes like the empty string
+    assert shard_of(pl.Series([None], dtype=pl.Utf8), count).to_list() == [zlib.crc32(b'') % count]
+
+
+def test_distributed_table_shards_on_crc32_of_the_key():
+    query = get_distributed_query('create_reviews_table', 'reviews_cluster', 'asin')
+    assert query['table_name'] == 'reviews_all'
+    assert "Distributed('reviews_cluster', 'amazon', 'reviews', " in query['sql_create']
+    assert query['sql_create'].rstrip(';').endswith('CRC32(asin))')
+
+
+def test_parse_shards_defaults_the_port():
+    assert parse_shards('ch1:9000, ch2,', 8123) == [('ch1', 9000), ('ch2', 8123)]
+
+
+def test_rows_are_partitioned_by_shard_key(shards):
+    metrics.drain()
+    df = _reviews(600)
+    _writer(shards).write(df, 'reviews', 'amazon', max_chunk=1000)
+
+    assert sum(server.rows() for server in shards) == len(df)
+    for index, server in enumerate(shards):
+        received = pl.concat([block.frame for block in server.blocks])
+        assert set(shard_of(received.get_column('asin'), len(shards)).to_list()) == {index}
+        assert '_shard' not in received.columns
+    stats = shard_stats(metrics.snapshot())
+    assert {shard: stats[f"{server.host}:{server.port}"]['rows'] for shard, server in enumerate(shards)} == \
+        {shard: server.rows() for shard, server in enumerate(shards)}
+
+
+def test_failed_shard_fails_the_write_after_the_others_finish(shards):
+    metrics.drain()
+    shards[1].fail_next = 1
+    df = _reviews(600)
+    with pytest.raises(RuntimeError, match=f"failed on shards {shards[1].host}:{shards[1].port}"):
+        _writer(shards).write(df, 'reviews', 'amazon', max_chunk=1000)
+
+    assert shards[1].rows() == 0
+    assert shards[0].rows() and shards[2].rows()
+    errors = {dict(parse_key(key)[1])['shard']: value for key, value in metrics.snapshot()['counters'].items()
+              if key.startswith('ingest_shard_errors_total')}
+    assert errors == {f"{shards[1].host}:{shards[1].port}": 1}
+
+
+def test_frames_without_the_shard_key_are_rejected(shards):
+    with pytest.raises(ValueError, match="no shard key column 'asin'"):
+        _writer(shards).write(pl.DataFrame({'rating': [5.0]}), 'reviews', 'amazon', max_chunk=1000)
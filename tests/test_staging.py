@@ -0,0 +1,52 @@
+import json
+
+import polars as pl
+
+from src.utils.jsonl import PARSE_ERROR_COLUMN, RAW_LINE_COLUMN, parse_jsonl_chunk
+from src.utils.staging import STAGE_META_FILE, ParquetStaging
+from tests.conftest import review
+
+
+def _batches(count: int, rows: int) -> list[pl.DataFrame]:
+    lines = [json.dumps(review(i, text='x' * 2000)) for i in range(count * rows)] + ['{"asin": broken']
+    chunk = '\n'.join(lines).encode() + b'\n'
+    df = parse_jsonl_chunk(chunk)
+    return [df.slice(offset, rows) for offset in range(0, len(df), rows)]
+
+
+def test_stage_round_trip_in_byte_bounded_parts(reviews_file):
+    file_path = reviews_file([review(0)])
+    batches = _batches(count=8, rows=50)
+    staging = ParquetStaging(part_rows=1000, part_bytes=250_000)
+    writer = staging.writer(file_path)
+    for batch in batches:
+        writer.write(batch)
+    stage_dir = writer.finish()
+
+    assert staging.find(file_path) == stage_dir
+    meta = json.loads((stage_dir / STAGE_META_FILE).read_text())
+    # ~100 KB per batch of 50 long reviews: the byte budget cuts parts long before the row limit
+    assert len(meta['parts']) > 1 and all(part['rows'] <= 150 for part in meta['parts'])
+    assert meta['rows'] == 401 and sum(part['bad_lines'] for part in meta['parts']) == 1
+
+    source = pl.concat(batches, how='diagonal_relaxed')
+    staged = pl.concat(ParquetStaging.iter_frames(stage_dir, lambda: 64, columns=['asin', 'text']),
+                       how='diagonal_relaxed')
+    assert staged.get_column('asin').to_list() == source.get_column('asin').to_list()
+    assert staged.get_column(PARSE_ERROR_COLUMN).drop_nulls().len() == 1
+    assert staged.get_column(RAW_LINE_COLUMN).drop_nulls().to_list() == ['{"asin": broken']
+
+    # a resume starts in the middle of a part
+    resumed = pl.concat(ParquetStaging.iter_frames(stage_dir, lambda: 64, skip_records=175, columns=['asin']),
+                        how='diagonal_relaxed')
+    assert resumed.get_column('asin').to_list() == source.get_column('asin').to_list()[175:]
+
+
+def test_unfinished_stage_is_not_found(reviews_file):
+    file_path = reviews_file([review(0)])
+    staging = ParquetStaging()
+    writer = staging.writer(file_path)
+    writer.write(_batches(count=1, rows=5)[0])
+    assert staging.find(file_path) is None
+    writer.abort()
+    assert staging.find(file_path) is None
@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+
+import polars as pl
+import pytest
+
+from src.utils.transform import TablePlan, _unwrap_type, compile_table_plan
+
+COLUMNS = [
+    {'name': 'flag', 'type': 'Bool', 'default': None},
+    {'name': 'stars', 'type': 'UInt8', 'default': None},
+    {'name': 'votes', 'type': 'Nullable(Int64)', 'default': None},
+    {'name': 'at', 'type': 'DateTime', 'default': None},
+    {'name': 'kind', 'type': 'LowCardinality(String)', 'default': None},
+    {'name': 'note', 'type': 'Nullable(String)', 'default': None},
+    {'name': 'ingest_ts', 'type': 'DateTime', 'default': 'now()'},
+]
+
+
+@pytest.mark.parametrize('column_type,expected', [
+    ('UInt8', ('UInt8', False)),
+    ('Nullable(Int64)', ('Int64', True)),
+    ('LowCardinality(Nullable(String))', ('String', True)),
+    ('DateTime64(3)', ('DateTime64', False)),
+])
+def test_unwrap_type(column_type, expected):
+    assert _unwrap_type(column_type) == expected
+
+
+def test_plan_casts_to_the_column_types():
+    df = pl.DataFrame({
+        'flag': ['true', ' 0 ', 'TRUE'],
+        'stars': [5.0, 1.0, 3.0],
+        'votes': ['7', 'null', ''],
+        'at': [1589228332952, 0, None],
+        'kind': ['a', 'b', 'c'],
+    })
+    out = TablePlan('t', COLUMNS).apply(df)
+
+    # columns without a value in the batch: nullable ones are sent as NULL, DEFAULT ones left to the server
+    assert out.columns == ['flag', 'stars', 'votes', 'at', 'kind', 'note']
+    assert out.schema == pl.Schema({'flag': pl.Boolean, 'stars': pl.UInt8, 'votes': pl.Int64,
+                                    'at': pl.Datetime('ms', 'UTC'), 'kind': pl.Utf8, 'note': pl.Utf8})
+    assert out.get_column('flag').to_list() == [True, False, True]
+    assert out.get_column('votes').to_list() == [7, None, None]
+    assert out.get_column('at').to_list() == [datetime(2020, 5, 11, 20, 18, 52, 952000, tzinfo=timezone.utc),
+                                             datetime(1970, 1, 1, tzinfo=timezone.utc), None]
+
+
+def test_datetime_sources_are_converted_to_utc():
+    naive = pl.DataFrame({'at': [datetime(2020, 1, 1, 12)]})
+    aware = naive.with_columns(pl.col('at').dt.replace_time_zone('Europe/Berlin'))
+    plan = TablePlan('t', [COLUMNS[3]])
+    assert plan.apply(naive).item() == datetime(2020, 1, 1, 12, tzinfo=timezone.utc)
+    assert plan.apply(aware).item() == datetime(2020, 1, 1, 11, tzinfo=timezone.utc)
+
+
+def test_plan_is_compiled_once_per_input_schema():
+    plan = compile_table_plan('create_reviews_table')
+    df = pl.DataFrame({'asin': ['B1'], 'user_id': ['U1'], 'rating': [4.0], 'timestamp': [1589228332952]})
+    plan.apply(df)
+    plan.apply(df.with_columns(pl.col('asin') + 'x'))
+    plan.apply(df.with_columns(pl.col('rating').cast(pl.Int64)))
+    assert len(plan._compiled) == 2
+
+
+def test_unsupported_types_are_rejected():
+    with pytest.raises(ValueError, match="Unsupported ClickHouse type 'Array\\(String\\)'"):
+        TablePlan('t', [{'name': 'tags', 'type': 'Array(String)', 'default': None}]).compile(pl.Schema({'tags': pl.Utf8}))
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+import pytest
+
+from src.utils import validation
+from src.utils.validation import REJECT_REASON_COLUMN, compile_table_validator
+from tests.conftest import review
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock of the validation module; set `clock.now_value` to move it"""
+    class Clock(datetime):
+        now_value = START
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.now_value
+
+    monkeypatch.setattr(validation, 'datetime', Clock)
+    return Clock
+
+
+def _reviews(*timestamps: datetime) -> pl.DataFrame:
+    return pl.DataFrame([review(i, timestamp=int(ts.timestamp() * 1000)) for i, ts in enumerate(timestamps)])
+
+
+def test_future_timestamps_are_checked_against_the_clock_of_each_batch(clock):
+    validator = compile_table_validator('create_reviews_table')
+    ahead = START + timedelta(days=5)
+
+    valid, rejected = validator.split(_reviews(START, ahead))
+    assert len(valid) == 1
+    assert rejected.get_column(REJECT_REASON_COLUMN).to_list() == ['timestamp out of range']
+
+    # the same validator, with its rules already compiled, a week later
+    clock.now_value = START + timedelta(days=7)
+    valid, rejected = validator.split(_reviews(START, ahead))
+    assert len(valid) == 2 and rejected.is_empty()
+    assert validation.MAX_TIMESTAMP_COLUMN not in valid.columns
+
+
+def test_old_timestamps_are_rejected(clock):
+    valid, rejected = compile_table_validator('create_reviews_table').split(_reviews(datetime(1990, 1, 1, tzinfo=timezone.utc)))
+    assert valid.is_empty()
+    assert rejected.get_column(REJECT_REASON_COLUMN).to_list() == ['timestamp out of range']
+
+
+def test_text_values_are_checked_before_they_are_cast(clock):
+    # a text column reaches the rules from Parquet sources or a records batch of mixed types
+    df = pl.DataFrame({**_reviews(START, START, START, START).to_dict(as_series=False),
+                       'verified_purchase': ['true', ' 0 ', 'yes', None],
+                       'timestamp': ['1704067200000', 'abc', '1704067200000', None]})
+    valid, rejected = compile_table_validator('create_reviews_table').split(df)
+    assert valid.get_column('asin').to_list() == ['B000000000']
+    assert rejected.get_column(REJECT_REASON_COLUMN).to_list() == [
+        'timestamp is not a valid epoch timestamp', 'verified_purchase is not a valid Bool', 'missing verified_purchase']
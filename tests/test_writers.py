@@ -0,0 +1,71 @@
+import polars as pl
+import pytest
+
+from src.utils.writers import HttpBlockWriter
+
+
+def _frame(rows: int) -> pl.DataFrame:
+    return pl.DataFrame({
+        'asin': [f"B{i % 50:09d}" for i in range(rows)],
+        'rating': [float(i % 5 + 1) for i in range(rows)],
+        'text': [f"review {i}" for i in range(rows)],
+    })
+
+
+def _writer(server, **kwargs) -> HttpBlockWriter:
+    return HttpBlockWriter(server.host, server.port, 'user', 'pass', **kwargs)
+
+
+@pytest.mark.parametrize('block_format,compression', [
+    ('parquet', 'zstd'), ('parquet', 'lz4'), ('arrow', 'zstd'), ('arrow', 'lz4'),
+])
+def test_blocks_round_trip(standin, block_format, compression):
+    df = _frame(1000)
+    _writer(standin, block_format=block_format, compression=compression).write(df, 'reviews', 'amazon', max_chunk=300)
+
+    assert [len(block.frame) for block in standin.blocks] == [300, 300, 300, 100]
+    assert {block.block_format for block in standin.blocks} == {'Parquet' if block_format == 'parquet' else 'ArrowStream'}
+    assert pl.concat([block.frame for block in standin.blocks]).equals(df)
+    assert standin.rows('amazon.reviews') == 1000
+
+
+def test_unsupported_compression_is_rejected(standin):
+    with pytest.raises(ValueError, match='arrow blocks support'):
+        _writer(standin, block_format='arrow', compression='snappy')
+
+
+def test_blocks_reuse_one_keep_alive_connection(standin):
+    writer = _writer(standin)
+    for _ in range(3):
+        writer.write(_frame(100), 'reviews', 'amazon', max_chunk=25)
+
+    assert len(standin.blocks) == 12
+    assert standin.client_connections() == 1
+    assert writer.pool.opened == 1
+
+
+def test_failed_insert_raises_and_the_next_one_succeeds(standin):
+    writer = _writer(standin)
+    standin.fail_next = 1
+    with pytest.raises(RuntimeError, match='simulated failure'):
+        writer.write(_frame(10), 'reviews', 'amazon', max_chunk=10)
+    assert standin.rows() == 0
+
+    writer.write(_frame(10), 'reviews', 'amazon', max_chunk=10)
+    assert standin.rows() == 10
+    assert standin.fail_next == 0
+
+
+def test_dropped_keep_alive_connection_is_retried_once(standin):
+    writer = _writer(standin)
+    writer.write(_frame(10), 'reviews', 'amazon', max_chunk=10)
+
+    standin.drop_next = 1
+    writer.write(_frame(10), 'reviews', 'amazon', max_chunk=10)
+    assert standin.rows() == 20
+    assert writer.pool.opened == 2
+
+    standin.drop_next = 2
+    with pytest.raises(ConnectionError):
+        writer.write(_frame(10), 'reviews', 'amazon', max_chunk=10)
+    assert standin.rows() == 20